@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+Time full passes of replTest on synthetic topologies, against the
+in-process fake backend (see fakeldap.py). No directory server is needed.
+
+    python3 bench/bench_repltest.py --hosts 1,10,50,100,200 --workers 8
+
+For every topology size it reports the wall time of a pass, the LDAP
+operations done and the peak of the memory allocated by Python.
+With --burst N it runs the throughput check instead, and reports also
+the slowest agreement rate and the worst p99 lag.
+'''
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dsReplTest.ldap as myldap
+import dsReplTest.throughput as throughput
+import dsReplTest.plan as plan
+from fakeldap import FakeTopology
+
+TEST_ENTRY = {'objectClass': [b'groupofuniquenames', b'top'], 'cn': b'Elettrogeno',
+              'description': b'Test Entry created by ds-repltest benchmark'}
+OPERATIONS = ('bind', 'search', 'add', 'delete', 'modify', 'unbind', 'lost')
+
+def make_instances(topology, hosts, suppliers, scheduled, downRate=0.0):
+    '''
+    Build the INSTANCES config of a single suffix with "hosts" hosts:
+    the first "suppliers" ones replicate to all the others. A fraction
+    "scheduled" of the agreements is scheduled, a fraction "downRate"
+    of the consumers doesn't answer.
+    '''
+    names = ['ldap{:03d}.bench.test'.format(i) for i in range(hosts)]
+    suppliers = max(1, min(suppliers, hosts))
+    suffix = {}
+    nagreements = 0
+    for supplier in names[:suppliers]:
+        replica = []
+        for consumer in names:
+            if consumer == supplier:
+                continue
+            isScheduled = nagreements < (hosts - 1)*suppliers*scheduled
+            nagreements += 1
+            agreementDN = topology.agreement(supplier, consumer, isScheduled)
+            replica.append({consumer: agreementDN if isScheduled else None})
+        suffix[supplier] = {'replica': replica, 'port': 389, 'protocol': 'ldap',
+                            'bind': 'cn=directory manager', 'pwd': 'password'}
+    for i, consumer in enumerate(names[suppliers:]):
+        topology.server(consumer).down = i < (hosts - suppliers)*downRate
+    return {'bench': {'suffixes': {'o=bench': suffix}}}
+
+def run(args, hosts):
+    ''' Run one pass on a topology of "hosts" hosts. This function returns a dictionary of figures. '''
+    topology = FakeTopology(args.delay, args.jitter, args.loss, args.latency, args.seed)
+    topology.install()
+    instances = make_instances(topology, hosts, args.suppliers, args.scheduled, args.down)
+    logger = logging.getLogger('ds-repltest-bench')
+    pool = myldap.ConnectionPool(args.timeout, reuse=args.pool, logger=logger)
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.burst:
+            RESULT, someError = throughput.throughputTest(instances, 'cn', TEST_ENTRY, args.burst, args.timeout,
+                                                          args.converge or 60, args.poll, logger, True, args.host_limit, pool)
+        else:
+            RESULT, someError = myldap.replTest(plan.compile_plan(instances), 'cn', TEST_ENTRY, args.timeout, args.timewait, args.update_timewait,
+                                                logger, True, args.workers, args.host_limit, args.converge, pool,
+                                                persistentAttribute='description' if args.probe_mode == 'modify' else None,
+                                                batch=args.batch)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    failed = sum(1 for suppliers in RESULT['bench']['suffixes'].values() for result in suppliers.values()
+                 for status in result['replica'].values() if not status)
+    figures = {'hosts': hosts, 'wall': round(wall, 3), 'peakMiB': round(peak/2**20, 2), 'failed': failed}
+    figures.update({name: topology.ops[name] for name in OPERATIONS})
+    if args.burst:
+        results = list(RESULT['bench']['suffixes']['o=bench'].values())
+        rates = [rate for result in results for rate in result['throughput'].values()]
+        lags = [lag for result in results for lag in result['lagP99'].values()]
+        figures['rate'] = min(rates, default=None)
+        figures['p99'] = max(lags, default=None)
+    return figures
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of a ds-repltest pass on a simulated topology.')
+    parser.add_argument('--hosts', default='1,10,50,100,200', help='comma separated topology sizes (default %(default)s)')
+    parser.add_argument('--suppliers', type=int, default=2, help='suppliers per topology (default %(default)s)')
+    parser.add_argument('--scheduled', type=float, default=0.1, help='fraction of scheduled agreements (default %(default)s)')
+    parser.add_argument('--delay', type=float, default=0.05, help='replication delay in seconds (default %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.05, help='max random extra delay in seconds (default %(default)s)')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a replicated change is lost (default %(default)s)')
+    parser.add_argument('--down', type=float, default=0.0, help='fraction of consumers down (default %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of every LDAP operation (default %(default)s)')
+    parser.add_argument('--timeout', type=float, default=5, help='TIMEOUT (default %(default)s)')
+    parser.add_argument('--timewait', type=float, default=0.2, help='TIMEWAIT (default %(default)s)')
+    parser.add_argument('--update-timewait', type=float, default=0.2, help='UPDATE_TIMEWAIT (default %(default)s)')
+    parser.add_argument('--converge', type=float, default=None, help='CONVERGE_TIMEOUT (default off)')
+    parser.add_argument('--workers', type=int, default=1, help='WORKERS (default %(default)s)')
+    parser.add_argument('--host-limit', type=int, default=None, help='HOST_LIMIT (default none)')
+    parser.add_argument('--probe-mode', choices=('add', 'modify'), default='add', help='PROBE_MODE (default %(default)s)')
+    parser.add_argument('--batch', action='store_true', help='batched verification (BATCH_VERIFY)')
+    parser.add_argument('--no-pool', dest='pool', action='store_false', help='disable the connection reuse')
+    parser.add_argument('--burst', type=int, default=0, help='run the throughput check with bursts of BURST entries')
+    parser.add_argument('--poll', type=float, default=0.05, help='THROUGHPUT_POLL of --burst (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default %(default)s)')
+    parser.add_argument('--json', action='store_true', help='print the figures in JSON')
+    args = parser.parse_args()
+
+    logging.getLogger('ds-repltest-bench').addHandler(logging.NullHandler())
+    rows = [run(args, int(hosts)) for hosts in args.hosts.split(',')]
+    if args.json:
+        print(json.dumps(rows, indent=1))
+        return
+    columns = ('hosts', 'wall', 'peakMiB', 'failed') + OPERATIONS + (('rate', 'p99') if args.burst else ())
+    print(' '.join('{:>8}'.format(column) for column in columns))
+    for row in rows:
+        print(' '.join('{:>8}'.format(str(row[column])) for column in columns))
+
+if __name__ == '__main__':
+    main()
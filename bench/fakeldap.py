@@ -0,0 +1,306 @@
+'''
+An in-process stand-in of a 389ds replication topology, for the benchmark.
+
+FakeTopology keeps the entries of every host in memory and replicates
+the adds, modifies and deletes of the suppliers to their consumers after a delay
+(plus a random jitter). A change may be lost with a given probability,
+and a scheduled agreement holds its changes until a "send update now"
+(the modify of nsDS5ReplicaUpdateSchedule done by ds-repltest).
+
+install() replaces ldap.initialize, so the engine talks to the fake
+hosts. The LDAP exceptions and constants are the python-ldap ones.
+'''
+import collections
+import heapq
+import random
+import threading
+import time
+import ldap
+
+def values(entry, attr):
+    ''' The values of an attribute of an entry, as lower case strings. '''
+    for name, value in entry.items():
+        if name.lower() == attr.lower():
+            if isinstance(value, (bytes, str)):
+                value = [value]
+            return [v.decode('utf-8').lower() if isinstance(v, bytes) else v.lower() for v in value]
+    return []
+
+def unescape(value):
+    ''' Decode the \\xx escapes of a filter value. '''
+    parts = value.split('\\')
+    return (parts[0] + ''.join(chr(int(part[:2], 16)) + part[2:] for part in parts[1:])).lower()
+
+def parse_filter(filterstr, pos=0):
+    '''
+    Parse the LDAP filter subset used by ds-repltest: &, |, !, equality,
+    presence and substrings. This function returns (node, next position),
+    where node is ('&'|'|', [nodes]), ('!', node) or ('=', attr, value).
+    '''
+    assert filterstr[pos] == '(', filterstr
+    pos += 1
+    if filterstr[pos] in '&|':
+        op, nodes = filterstr[pos], []
+        pos += 1
+        while filterstr[pos] == '(':
+            node, pos = parse_filter(filterstr, pos)
+            nodes.append(node)
+        return (op, nodes), pos + 1
+    if filterstr[pos] == '!':
+        node, pos = parse_filter(filterstr, pos + 1)
+        return ('!', node), pos + 1
+    end = filterstr.index(')', pos)
+    attr, value = filterstr[pos:end].split('=', 1)
+    return ('=', attr, value), end + 1
+
+def match_filter(node, dn, entry):
+    ''' Evaluate a parsed filter (see parse_filter) on an entry. '''
+    if node[0] == '&':
+        return all(match_filter(child, dn, entry) for child in node[1])
+    if node[0] == '|':
+        return any(match_filter(child, dn, entry) for child in node[1])
+    if node[0] == '!':
+        return not match_filter(node[1], dn, entry)
+    _, attr, value = node
+    if attr.lower() == 'objectclass' and value == '*':
+        return True
+    found = values(entry, attr)
+    # The rdn value belongs to the entry too
+    rdnAttr, rdnValue = dn.split(',', 1)[0].split('=', 1)
+    if rdnAttr.lower() == attr.lower():
+        found.append(rdnValue.replace('\\', '').lower())
+    if value == '*':
+        return bool(found)
+    pieces = [unescape(piece) for piece in value.split('*')]
+    for candidate in found:
+        if len(pieces) == 1:
+            if candidate == pieces[0]:
+                return True
+            continue
+        if not candidate.startswith(pieces[0]):
+            continue
+        pos = len(pieces[0])
+        for piece in pieces[1:-1]:
+            pos = candidate.find(piece, pos)
+            if pos < 0:
+                break
+            pos += len(piece)
+        else:
+            if candidate.endswith(pieces[-1]) and len(candidate) - len(pieces[-1]) >= pos:
+                return True
+    return False
+
+def compile_filter(filterstr):
+    if not filterstr.startswith('('):
+        filterstr = '(' + filterstr + ')'
+    return parse_filter(filterstr)[0]
+
+class FakeServer:
+    def __init__(self, topology, host):
+        self.topology = topology
+        self.host = host
+        self.entries = {}
+        self.pending = []       # heap of (apply at, seq, dn, attrs or None)
+        self.agreements = {}    # agreement DN -> (consumer host, scheduled)
+        self.held = collections.defaultdict(list)   # consumer host -> [(dn, attrs)]
+        self.down = False
+
+    def apply(self, now):
+        ''' Apply the replicated changes due by now. Called with the topology lock. '''
+        while self.pending and self.pending[0][0] <= now:
+            at, seq, dn, attrs = heapq.heappop(self.pending)
+            if attrs is None:
+                self.entries.pop(dn, None)
+            else:
+                self.entries[dn] = attrs
+
+    def replicate(self, dn, attrs):
+        ''' Send a change to the consumers. Called with the topology lock. '''
+        for agreementDN, (consumer, scheduled) in self.agreements.items():
+            if scheduled:
+                self.held[consumer].append((dn, attrs))
+            else:
+                self.topology.deliver(consumer, dn, attrs)
+
+class FakeTopology:
+    '''
+    The simulated hosts.
+        delay - seconds a change takes to reach a consumer
+        jitter - max random seconds added to delay
+        lossRate - probability that a replicated change is lost
+        latency - seconds every LDAP operation takes
+        seed - seed of the random generator
+    '''
+    def __init__(self, delay=0.05, jitter=0.05, lossRate=0.0, latency=0.0, seed=None):
+        self.delay = delay
+        self.jitter = jitter
+        self.lossRate = lossRate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.servers = {}
+        self.ops = collections.Counter()
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def server(self, host):
+        with self._lock:
+            if host not in self.servers:
+                self.servers[host] = FakeServer(self, host)
+            return self.servers[host]
+
+    def agreement(self, supplier, consumer, scheduled=False):
+        ''' Add a replication agreement. This function returns its DN. '''
+        agreementDN = 'cn={}-->{},cn=replica,cn=mapping tree,cn=config'.format(supplier, consumer)
+        self.server(consumer)
+        self.server(supplier).agreements[agreementDN] = (consumer, scheduled)
+        return agreementDN
+
+    def deliver(self, consumer, dn, attrs):
+        ''' Queue a change on a consumer. Called with the lock. '''
+        if self.lossRate and self.random.random() < self.lossRate:
+            self.ops['lost'] += 1
+            return
+        self._seq += 1
+        at = time.monotonic() + self.delay + self.random.uniform(0, self.jitter)
+        heapq.heappush(self.servers[consumer].pending, (at, self._seq, dn, attrs))
+
+    def connect(self, uri, **kwargs):
+        return FakeConnection(self, uri.split('://')[1].rsplit(':', 1)[0])
+
+    def install(self):
+        ''' Make ldap.initialize open connections to this topology. '''
+        ldap.initialize = self.connect
+
+class FakeConnection:
+    '''
+    The subset of ldap.ldapobject.LDAPObject used by ds-repltest. The
+    asynchronous searches are answered at once.
+    '''
+    def __init__(self, topology, host):
+        self.topology = topology
+        self.server = topology.server(host)
+        self.protocol_version = ldap.VERSION3
+        self._results = {}
+        self._msgid = 0
+
+    def _operation(self, name):
+        self.topology.ops[name] += 1
+        if self.topology.latency:
+            time.sleep(self.topology.latency)
+        if self.server.down:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+
+    def bind_s(self, who, cred, method=None):
+        self._operation('bind')
+
+    def unbind_s(self):
+        self.topology.ops['unbind'] += 1
+
+    def set_option(self, option, value):
+        pass
+
+    def get_option(self, option):
+        # No file descriptor to wait on: the callers poll
+        raise ldap.LDAPError({'desc': 'Not supported by the fake backend'})
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        self._operation('search')
+        with self.topology._lock:
+            self.server.apply(time.monotonic())
+            if scope == ldap.SCOPE_BASE:
+                if base == '':
+                    return [('', {})]
+                if base not in self.server.entries:
+                    raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+                candidates = [base]
+            else:
+                candidates = [dn for dn in self.server.entries
+                              if ',' in dn and dn.split(',', 1)[1].lower() == base.lower()]
+            node = compile_filter(filterstr)
+            return [(dn, dict(self.server.entries[dn])) for dn in candidates
+                    if match_filter(node, dn, self.server.entries[dn])]
+
+    def _async(self, operation, *args):
+        ''' Run an operation at once and keep its answer for result(). '''
+        self._msgid += 1
+        try:
+            self._results[self._msgid] = (ldap.RES_SEARCH_RESULT, operation(*args))
+        except ldap.LDAPError as err:
+            self._results[self._msgid] = err
+        return self._msgid
+
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self._async(self.search_s, base, scope, filterstr, attrlist)
+
+    def add(self, dn, modlist):
+        return self._async(self.add_s, dn, modlist)
+
+    def delete(self, dn):
+        return self._async(self.delete_s, dn)
+
+    def result(self, msgid, all=1, timeout=None):
+        answer = self._results.pop(msgid)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def abandon(self, msgid):
+        self._results.pop(msgid, None)
+
+    def add_s(self, dn, modlist):
+        self._operation('add')
+        with self.topology._lock:
+            if dn in self.server.entries:
+                raise ldap.ALREADY_EXISTS({'desc': 'Already exists'})
+            # As a directory server does, every attribute has a list of values
+            entry = {attr: [value] if isinstance(value, (bytes, str)) else list(value) for attr, value in modlist}
+            self.server.entries[dn] = entry
+            self.server.replicate(dn, dict(entry))
+
+    def delete_s(self, dn):
+        self._operation('delete')
+        with self.topology._lock:
+            self.server.apply(time.monotonic())
+            if dn not in self.server.entries:
+                raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+            del self.server.entries[dn]
+            self.server.replicate(dn, None)
+
+    def modify_s(self, dn, modlist):
+        self._operation('modify')
+        with self.topology._lock:
+            if dn not in self.server.agreements:
+                self._modify_entry(dn, modlist)
+                return
+            consumer, scheduled = self.server.agreements[dn]
+            for op, attr, value in modlist:
+                if op == ldap.MOD_ADD and attr.lower() == 'nsds5replicaupdateschedule':
+                    # "send update now"
+                    for heldDN, attrs in self.server.held.pop(consumer, []):
+                        self.topology.deliver(consumer, heldDN, attrs)
+
+    def _modify_entry(self, dn, modlist):
+        ''' Modify an entry and replicate it. Called with the lock. '''
+        self.server.apply(time.monotonic())
+        if dn not in self.server.entries:
+            raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+        attrs = dict(self.server.entries[dn])
+        for op, attr, value in modlist:
+            if isinstance(value, (bytes, str)):
+                value = [value]
+            name = next((name for name in attrs if name.lower() == attr.lower()), attr)
+            current = attrs.pop(name, [])
+            if isinstance(current, (bytes, str)):
+                current = [current]
+            if op == ldap.MOD_REPLACE:
+                current = list(value or [])
+            elif op == ldap.MOD_ADD:
+                current = list(current) + list(value)
+            elif value:
+                current = [v for v in current if v not in value]
+            else:
+                current = []
+            if current:
+                attrs[name] = current
+        self.server.entries[dn] = attrs
+        self.server.replicate(dn, dict(attrs))
@@ -4,22 +4,34 @@ import logging.handlers
 import os
 import time
 import sys
-import systemd.daemon
 import ldap
 import getopt
-from flask import Flask, render_template, url_for
+import contextlib
+import json
+from pathlib import Path
 from datetime import datetime
 import dsReplTest.ldap as myldap
 import dsReplTest.common as setting
+import dsReplTest.discovery as discovery
+import dsReplTest.results as results
+import dsReplTest.trace as trace
+from dsReplTest.config import ConfigHolder, ConfigError
+# The web stack, systemd and the optional engines are imported when needed,
+# so the one shot runs (--once, --throughput) start fast
 
 
 # Manage argv
 argv = sys.argv[1:]
 config_file = 'ds-repltest.yaml'
 runOnce = False
-usage = 'Usage: {} [-c <alt config file>][--once][--help]'.format(sys.argv[0])
+passiveOnce = False
+throughputOnce = False
+outputFormat = None
+profileFile = None
+FORMATS = ('text', 'json', 'nagios')
+usage = 'Usage: {} [-c <alt config file>][--once [--passive][--format text|json|nagios]][--throughput][--profile <trace file>][--help]'.format(sys.argv[0])
 try:
-    opts, args = getopt.getopt(argv,"c:",["once","help"])
+    opts, args = getopt.getopt(argv,"c:",["once","passive","throughput","format=","profile=","help"])
 except getopt.GetoptError:
     print (usage)
     sys.exit(2)
@@ -28,6 +40,14 @@ for opt, arg in opts:
         config_file = arg
     elif opt == '--once':
         runOnce = True
+    elif opt == '--passive':
+        passiveOnce = True
+    elif opt == '--throughput':
+        throughputOnce = True
+    elif opt == '--format' and arg in FORMATS:
+        outputFormat = arg
+    elif opt == '--profile':
+        profileFile = arg
     elif opt == '--help':
         print (usage)
         sys.exit(0)
@@ -40,6 +60,28 @@ if args:
     print (usage)
     sys.exit(2)
 
+if profileFile and not (runOnce or throughputOnce):
+    print('--profile needs --once or --throughput')
+    print (usage)
+    sys.exit(2)
+
+if (passiveOnce or outputFormat) and not runOnce:
+    print('--passive and --format need --once')
+    print (usage)
+    sys.exit(2)
+if outputFormat is None:
+    outputFormat = 'text'
+
+def die(message):
+    ''' Exit on a startup error. With --format json or nagios, the state is UNKNOWN. '''
+    if outputFormat == 'json':
+        print(json.dumps({'state': results.STATES[results.UNKNOWN], 'code': results.UNKNOWN, 'error': message}))
+    elif outputFormat == 'nagios':
+        print('DSREPLTEST UNKNOWN - {}'.format(message.replace('\n', ' ')))
+    else:
+        sys.exit(message)
+    sys.exit(results.UNKNOWN)
+
 '''
 Read Config
 '''
@@ -59,35 +101,33 @@ if not os.path.isfile(CONFIG):
         os.rename(distconf, os.path.join(os.path.dirname(distconf), config_file))
 
 # get the configuration items
-if os.path.isfile(CONFIG):
-    logging_parameters =  setting.load_yaml(CONFIG, "Logging")
-    LOGFILE_DIR = logging_parameters['LOGFILE_DIR']
-    LOGFILE_NAME = logging_parameters['LOGFILE_NAME']
-    LOGSTDOUT = logging_parameters['LOGSTDOUT']
-    LOGHANDLER = logging_parameters['TYPE']
-    SYSLOG_FAC = logging_parameters['SYSLOG_FAC']
-    SYSLOG_LEVEL = logging_parameters['LOG_LEVEL']
-    SYSLOG_SOCKET = logging_parameters['SYSLOG_SOCKET']
-
-    email_parameters = setting.load_yaml(CONFIG, "Email")
-    web_parameters = setting.load_yaml(CONFIG, "Web")
-    LDAP_INSTANCES = setting.load_yaml(CONFIG, "INSTANCES")
-    ENTRY = setting.load_yaml(CONFIG, "TEST_ENTRY")
-    NET_TIMEOUT = setting.load_yaml(CONFIG, "TIMEOUT")
-    SLEEPTIME = setting.load_yaml(CONFIG, "TIMEWAIT")
-    UPDATE_SLEEPTIME = setting.load_yaml(CONFIG, "UPDATE_TIMEWAIT")
-else:
-    sys.exit("Please check the config file! Config path: {}.\nHint: put a '{}' file in {} path.".format(CONFIG, config_file, config_path))
+if not os.path.isfile(CONFIG):
+    die("Please check the config file! Config path: {}.\nHint: put a '{}' file in {} path.".format(CONFIG, config_file, config_path))
+try:
+    config = ConfigHolder(CONFIG)
+except ConfigError as exc:
+    die("Please check the config file! {}. This is an YAML syntax file!".format(exc))
 # =============================================================================
 
-# check if all config parameters are present
-for confvar in (
-        LOGFILE_DIR, LOGFILE_NAME, LOGSTDOUT, LDAP_INSTANCES,
-        LOGHANDLER, SYSLOG_FAC, SYSLOG_LEVEL, SYSLOG_SOCKET,
-        LDAP_INSTANCES, ENTRY, NET_TIMEOUT, SLEEPTIME, UPDATE_SLEEPTIME ):
-    if confvar is None:
-        sys.exit("Please check the config file! Some parameters are missing. This is an YAML syntax file!")
+# These parameters are read at startup only
+cfg = config.current
+LOGFILE_DIR = cfg.Logging['LOGFILE_DIR']
+LOGFILE_NAME = cfg.Logging['LOGFILE_NAME']
+LOGSTDOUT = cfg.Logging['LOGSTDOUT']
+LOGHANDLER = cfg.Logging['TYPE']
+SYSLOG_FAC = cfg.Logging['SYSLOG_FAC']
+SYSLOG_LEVEL = cfg.Logging['LOG_LEVEL']
+SYSLOG_SOCKET = cfg.Logging['SYSLOG_SOCKET']
+LOGFORMAT = cfg.Logging.get('FORMAT', 'kv')
+web_parameters = cfg.Web
+WEB_SERVER = web_parameters.get('SERVER', 'flask')
 
+# The TLS options are global: all the ldaps and StartTLS connections share one TLS context
+if cfg.TLS_CACERT or cfg.TLS_CACERTDIR or cfg.TLS_CERT or cfg.TLS_KEY or cfg.TLS_REQCERT != 'demand':
+    try:
+        myldap.set_tls(cfg.TLS_CACERT, cfg.TLS_CACERTDIR, cfg.TLS_CERT, cfg.TLS_KEY, cfg.TLS_REQCERT)
+    except (ValueError, ldap.LDAPError) as exc:
+        die("Unable to set the TLS options: {}".format(exc))
 
 if LOGHANDLER == 'file':
     LOGFILE_PATH = os.path.join(LOGFILE_DIR, LOGFILE_NAME)
@@ -96,73 +136,262 @@ if LOGHANDLER == 'file':
 else:
     LOGFILE_PATH = False
 
-if not setting.set_log(LOGHANDLER, SYSLOG_SOCKET, SYSLOG_FAC, SYSLOG_LEVEL, LOGSTDOUT, LOGFILE_PATH):
-    print("Something wrong in log definition")
-    sys.exit(1)
+# The machine readable outputs own stdout: the log goes to stderr
+if not setting.set_log(LOGHANDLER, SYSLOG_SOCKET, SYSLOG_FAC, SYSLOG_LEVEL, LOGSTDOUT, LOGFILE_PATH, LOGFORMAT,
+                       sys.stdout if outputFormat == 'text' else sys.stderr):
+    die("Something wrong in log definition")
 
 log = logging.getLogger(setting.loggerName)
+config.logger = log
 
-''' check on ENTRY used for test '''
-if ('uid' in ENTRY.keys()):
-    rdn = 'uid'
-elif ('cn' in ENTRY.keys()):
-    rdn = 'cn'
-else:
-    log.fatal("The rdn of the test entry is not 'cn' or 'uid'")
-    sys.exit(255)
+def notify_errors(cfg):
+    ''' Send the error notification email, if enabled. '''
+    if cfg.Email['SEND']:
+        log.info('Sending mail to notify errors')
+        (emailSent, emailErr) = setting.notifyEmail(cfg.Email)
+        if not emailSent:
+            log.error('Unable to send email: {}'.format(emailErr))
 
-''' convert ENTRY in bytes
-  This is to avoid to enter the b'string' in the config file
-'''
-for key, value in ENTRY.items():
-    if type(value) == list:
-        for i in range(len(value)):
-            ENTRY[key][i] = value[i].encode('utf-8')
+def discover(cfg, instances):
+    '''
+    Fill the suffixes of the instances to autodiscover.
+    This function returns a tuple (instances, discoveryError).
+    '''
+    try:
+        with trace.span('discovery'):
+            return discovery.resolve_instances(instances, cfg.DISCOVERY_CACHE, cfg.DISCOVERY_TTL, cfg.TIMEOUT, log), False
+    except ldap.LDAPError as err:
+        log.error('action=discover status=fail {}'.format(myldap.handle_log(err)))
+        return {instance: dict(conf, suffixes=conf.get('suffixes') or {}) for instance, conf in instances.items()}, True
+
+def check(cfg, instances, passive=False, progress=None):
+    '''
+    Run the write probes (or the passive RUV checks) on instances,
+    with the Config cfg.
+        progress - function called after every supplier with
+                   (done, total, instance, basedn, supplier, result)
+    This function returns a tuple (RESULT, testError).
+    '''
+    (instances, discoveryError) = discover(cfg, instances)
+    pool = myldap.ConnectionPool(cfg.TIMEOUT, cfg.POOL_IDLE_TIMEOUT, cfg.CONNECTION_POOL, log)
+    if passive:
+        import dsReplTest.ruv as ruv
+        (RESULT, testError) = ruv.passiveTest(instances, cfg.TIMEOUT, cfg.PASSIVE_MAX_LAG, log, LOGSTDOUT, cfg.WORKERS, cfg.HOST_LIMIT, pool,
+                                               progress=progress)
+    else:
+        (RESULT, testError) = myldap.replTest(cfg.plan(instances), cfg.rdn, cfg.ENTRY, cfg.TIMEOUT, cfg.TIMEWAIT, cfg.UPDATE_TIMEWAIT, log, LOGSTDOUT,
+                                              cfg.WORKERS, cfg.HOST_LIMIT, cfg.CONVERGE_TIMEOUT, pool,
+                                              progress=progress, deadline=cfg.PASS_DEADLINE, preflight=cfg.PREFLIGHT,
+                                              persistentAttribute=cfg.persistentAttribute, batch=cfg.BATCH_VERIFY)
+    return RESULT, testError or discoveryError
+
+def probe_step(cfg):
+    ''' The longest time between two supplier probes ending, for the systemd timeouts. '''
+    return max((myldap.probe_time(supplierConf, cfg.TIMEOUT, cfg.TIMEWAIT, cfg.UPDATE_TIMEWAIT, cfg.CONVERGE_TIMEOUT)
+                for conf in cfg.INSTANCES.values() for suppliers in (conf.get('suffixes') or {}).values()
+                for supplierConf in suppliers.values()), default=0) + cfg.TIMEOUT
+
+def report_progress(done, total, instance, basedn, supplier, result):
+    '''
+    Tell systemd and the web clients how the pass is going, and give
+    more time to the startup.
+    '''
+    monitor.progress(done, total)
+    if result is not None:
+        event = results.supplier_result(supplier, result).as_dict()
+        event.update(instance=instance, basedn=basedn, done=done, total=total)
+        broadcaster.publish('probe', event)
+    if systemd.daemon.booted():
+        systemd.daemon.notify('STATUS=Check on progress: {}/{} suppliers done'.format(done, total))
+        if not ready.is_set():
+            systemd.daemon.notify('EXTEND_TIMEOUT_USEC={}'.format(int(probe_step(config.current) * 1000000)))
+
+def watchdog(interval):
+    '''
+    Ping the systemd watchdog every interval seconds, unless a pass is
+    stalled: then systemd restarts the service.
+    '''
+    stalled = False
+    while True:
+        limit = 2*probe_step(config.current)
+        if monitor.stalled(limit):
+            if not stalled:
+                log.fatal('action=watchdog status=fail detail="A pass made no progress for {}s"'.format(limit))
+            stalled = True
+        else:
+            stalled = False
+            systemd.daemon.notify('WATCHDOG=1')
+        time.sleep(interval)
+
+
+def run_pass(instances, passive=False):
+    '''
+    Run the checks on instances and store the results for the web server.
+    The pass uses the current Config until its end, also if it's reloaded.
+    '''
+    config.reload_if_changed()
+    cfg = config.current
+    # The instances of the current Config, if they are still there
+    instances = {instance: cfg.INSTANCES[instance] for instance in instances if instance in cfg.INSTANCES}
+    monitor.start()
+    broadcaster.publish('pass', {'instances': list(instances), 'passive': passive})
+    try:
+        (RESULT, testError) = check(cfg, instances, passive, report_progress)
+    finally:
+        monitor.end()
+    store.update(RESULT, testError, passive=passive)
+    broadcaster.publish('done', {'status': not testError, 'version': store.version})
+    # The history tracks the write probes: a passive check would count twice every pair
+    if history and not passive:
+        try:
+            history.record_result(RESULT)
+        except (OSError, ValueError) as exc:
+            log.error('Unable to write the history: {}'.format(exc))
+    if testError:
+        print ("FAIL. Some errors occur. Check at the log for more details.")
+        notify_errors(cfg)
     else:
-        ENTRY[key] = value.encode('utf-8')
+        print ("Test completed successfully on {}!".format(datetime.now().ctime()))
+    if systemd.daemon.booted():
+        if store.snapshot()[1]:
+            systemd.daemon.notify('STATUS=Checks completed with some errors! You can see the results on log or at the web page.')
+        else:
+            systemd.daemon.notify('STATUS=All checks completed with success! You can see the results on log or at the web page.')
+    if not ready.is_set():
+        # The service is ready when the results of the first pass are there
+        ready.set()
+        if systemd.daemon.booted():
+            systemd.daemon.notify('READY=1')
+    return testError
+
+def write_profile(path):
+    ''' Export the trace of the run and print its top time sinks (on stderr, the report owns stdout). '''
+    tracer = trace.stop()
+    tracer.export(path)
+    print('\n'.join(['Profile written to {}'.format(path)] + tracer.summary()), file=sys.stderr)
 
 ''' MAIN procedure '''
+if profileFile:
+    import atexit
+    trace.start()
+    atexit.register(write_profile, profileFile)
+
+if throughputOnce:
+    import dsReplTest.throughput as throughput
+    (instances, discoveryError) = discover(cfg, cfg.INSTANCES)
+    pool = myldap.ConnectionPool(cfg.TIMEOUT, cfg.POOL_IDLE_TIMEOUT, cfg.CONNECTION_POOL, log)
+    (RESULT, testError) = throughput.throughputTest(instances, cfg.rdn, cfg.ENTRY, cfg.THROUGHPUT_BURST, cfg.TIMEOUT,
+                                                    cfg.THROUGHPUT_TIMEOUT, cfg.THROUGHPUT_POLL, log, LOGSTDOUT,
+                                                    cfg.HOST_LIMIT, pool)
+    print ('\n'.join(throughput.report(RESULT)))
+    sys.exit(255 if testError or discoveryError else 0)
+
+if runOnce and outputFormat != 'text':
+    # Only the report goes to stdout
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        (RESULT, testError) = check(cfg, cfg.INSTANCES, passiveOnce)
+    instances = results.from_result(RESULT, passiveOnce)
+    if outputFormat == 'json':
+        print(results.to_report(instances, testError, datetime.now(), cfg.WARN_LATENCY))
+        code = results.state(instances, testError, cfg.WARN_LATENCY)
+    else:
+        (text, code) = results.to_nagios(instances, testError, cfg.WARN_LATENCY)
+        print(text)
+    if testError:
+        notify_errors(cfg)
+    sys.exit(code)
+
 if runOnce:
-    (RESULT, testError) = myldap.replTest(LDAP_INSTANCES, rdn, ENTRY, NET_TIMEOUT, SLEEPTIME, UPDATE_SLEEPTIME, log, LOGSTDOUT)
+    (RESULT, testError) = check(cfg, cfg.INSTANCES, passiveOnce)
     if testError:
         print ("FAIL. Some errors occur. Check at the log for more details.")
-        if email_parameters['SEND']:
-            log.info('Sending mail to notify errors')
-            (emailSent, emailErr) = setting.notifyEmail(email_parameters)
-            if not emailSent:
-                log.error('Unable to send email: {}'.format(emailErr))
+        notify_errors(cfg)
         sys.exit(255)
     else:
         print ("Test completed successfully!")
         sys.exit(0)
 
 # Run in systemd
+import signal
+import threading
+import systemd.daemon
+import dsReplTest.metrics as metrics
+from dsReplTest.scheduler import ResultStore, Scheduler, PassMonitor, Broadcaster
+from dsReplTest.history import History
+
+monitor = PassMonitor()
+ready = threading.Event()
+# With waitress every client of /events holds a thread: keep two for the pages and the API
+broadcaster = Broadcaster(maxClients=None if WEB_SERVER == 'builtin' else max(1, web_parameters.get('THREADS', 8) - 2))
 if systemd.daemon.booted():
-    extend_time = myldap.time_to_notify(LDAP_INSTANCES, NET_TIMEOUT, SLEEPTIME, UPDATE_SLEEPTIME) * 1000000
+    # The startup timeout is extended again every time a supplier is checked
+    extend_time = int(probe_step(cfg) * 1000000)
     systemd.daemon.notify('EXTEND_TIMEOUT_USEC={}'.format(extend_time))
     systemd.daemon.notify('STATUS=Please wait. Check on progress...')
-    log.debug('Systemd will wait up to {}s for end of checks.'.format(extend_time/1000000))
+    log.debug('Systemd will wait {}s for the next supplier check.'.format(extend_time/1000000))
+    watchdog_usec = int(os.environ.get('WATCHDOG_USEC', 0))
+    if watchdog_usec and os.environ.get('WATCHDOG_PID', str(os.getpid())) == str(os.getpid()):
+        threading.Thread(target=watchdog, args=(watchdog_usec/2000000,), name='ds-repltest watchdog', daemon=True).start()
 
-(RESULT, testError) = myldap.replTest(LDAP_INSTANCES, rdn, ENTRY, NET_TIMEOUT, SLEEPTIME, UPDATE_SLEEPTIME, log, LOGSTDOUT)
-current_time = datetime.now()
+store = ResultStore()
+history = None
+if cfg.HISTORY_FILE:
+    try:
+        history = History(cfg.HISTORY_FILE, cfg.HISTORY_RECORDS, log)
+    except (OSError, ValueError) as exc:
+        log.error('Unable to open the history file {}: {}'.format(cfg.HISTORY_FILE, exc))
+schedulers = []
+scheduler = Scheduler(cfg.INSTANCES, cfg.INTERVAL, run_pass, cfg.STAGGER, log)
+# The web server starts during the first pass: the probes are streamed at /events
+scheduler.launch(cfg.INSTANCES)
+if cfg.INTERVAL:
+    log.info('Checks scheduled every {}s{}'.format(cfg.INTERVAL, ', staggered per instance' if cfg.STAGGER else ''))
+    scheduler.start()
+    schedulers.append(scheduler)
+if cfg.PASSIVE_INTERVAL:
+    # The passive checks don't write, so they don't wait for the probes
+    passiveScheduler = Scheduler(cfg.INSTANCES, cfg.PASSIVE_INTERVAL, lambda instances: run_pass(instances, True), cfg.STAGGER, log)
+    log.info('Passive checks scheduled every {}s'.format(cfg.PASSIVE_INTERVAL))
+    passiveScheduler.start()
+    schedulers.append(passiveScheduler)
 
-if testError:
-    print ("FAIL. Some errors occur. Check at the log for more details.")
-    if email_parameters['SEND']:
-        log.info('Sending mail to notify errors')
-        (emailSent, emailErr) = setting.notifyEmail(email_parameters)
-        if not emailSent:
-            log.error('Unable to send email: {}'.format(emailErr))
-    if systemd.daemon.booted():
-        systemd.daemon.notify('READY=1')
-        systemd.daemon.notify('STATUS=Checks completed with some errors! You can see the results on log or at the web page.')
-else:
-    print ("Test completed successfully on {}!".format(current_time.ctime()))
+def reschedule(old, new):
+    ''' Schedule the instances of a reloaded Config. '''
+    for running in schedulers:
+        running.reschedule(new.INSTANCES)
+config.onReload = reschedule
+# Reload the config on SIGHUP, or when the file changes, without losing the results.
+# The handler only wakes up the watcher thread, which parses the file, logs and reschedules.
+signal.signal(signal.SIGHUP, lambda signum, frame: config.request_reload())
+config.watch()
+
+# Tells apart the result versions of different runs of the service
+STARTED = int(time.time())
+
+def stopping():
     if systemd.daemon.booted():
-        systemd.daemon.notify('READY=1')
-        systemd.daemon.notify('STATUS=All checks completed with success! You can see the results on log or at the web page.')
+        systemd.daemon.notify('STOPPING=1')
+        systemd.daemon.notify('STATUS=ds-repltest stopping.')
+
+if WEB_SERVER == 'builtin':
+    # Result presentation on the standard library: Flask, Jinja and waitress are not loaded
+    from dsReplTest.webserver import ReportServer
+    try:
+        server = ReportServer(web_parameters['HOST'], web_parameters['PORT'], store, broadcaster, history, metrics, STARTED, log)
+    except OSError as exc:
+        log.error('Unable to start the webserver: {}'.format(exc))
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    stopping()
+    sys.exit(0)
 
 ''' Result presentation with Flask inside the module dsReplTest '''
+from flask import Flask, Response, render_template, request, url_for
 app = Flask('dsReplTest')
 
 @app.template_filter()
@@ -173,6 +402,11 @@ def datetimefilter(value, format='%d/%m/%Y at %H:%M:%S'):
     return value.strftime(format)
 app.jinja_env.filters['datetimefilter'] = datetimefilter
 
+def timestampfilter(value):
+    """Convert a unix time to a datetime."""
+    return datetime.fromtimestamp(value)
+app.jinja_env.filters['timestampfilter'] = timestampfilter
+
 def selectIcon(selector):
     ''' Select the right icon taken from https://freeiconshop.com/icon/
         and https://icons-for-free.com/ '''
@@ -184,18 +418,58 @@ def selectIcon(selector):
         return url_for('static', filename='no.png')
 app.jinja_env.filters['selectIcon'] = selectIcon
 
+def cached_response(name, render, mimetype):
+    '''
+    Answer with the rendering "name" of the last results, built once per
+    pass. The clients which already have it get a 304.
+    '''
+    (text, version) = store.rendered(name, render)
+    testdate = store.snapshot()[2]
+    response = Response(text, mimetype=mimetype)
+    response.set_etag('{}-{}-{}'.format(name, STARTED, version))
+    if testdate:
+        response.last_modified = testdate.astimezone()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route("/")
 def index():
-    return render_template('template.html', result = RESULT, testdate=current_time)
+    return cached_response('html', lambda instances, someError, testdate:
+                           render_template('template.html', instances=instances, testdate=testdate), 'text/html')
+
+@app.route("/api/results")
+def api_results():
+    return cached_response('json', results.to_json, 'application/json')
+
+@app.route("/events")
+def events():
+    ''' Stream the results of the running passes, supplier by supplier. '''
+    client = broadcaster.subscribe()
+    if client is None:
+        return Response('Too many clients of the live progress.\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '60'})
+    response = Response(broadcaster.stream(client), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route("/history")
+def trends():
+    if not history:
+        return Response('History is disabled. See at HISTORY_FILE in the config file.\n', status=404, mimetype='text/plain')
+    return render_template('history.html', history=history.summary())
+
+@app.route("/metrics")
+def prometheus():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == "__main__":
     from waitress import serve
     try:
-        serve(app, host=web_parameters['HOST'], port=web_parameters['PORT'])
+        # Every client of /events holds a thread
+        serve(app, host=web_parameters['HOST'], port=web_parameters['PORT'], threads=web_parameters.get('THREADS', 8))
     except Exception as exc:
         log.error('Unable to start the webserver: {}'.format(exc))
 
-if systemd.daemon.booted():
-    systemd.daemon.notify('STOPPING=1')
-    systemd.daemon.notify('STATUS=ds-repltest stopping.')
+stopping()
 
@@ -1,31 +1,37 @@
-import yaml
+import contextlib
 import logging
 import logging.handlers
+import os
 import sys
-import smtplib
-import ssl
-from email.message import EmailMessage
-from email import utils
+import dsReplTest.events as events
 
 loggerName = 'ds-repltest'
+# A reusable no-op context manager (contextlib.nullcontext needs Python 3.7)
+NOOP = contextlib.suppress()
 
-def load_yaml(file, part):
-     with open(file, 'r') as ymlfile:
-         config_parameters = yaml.load(ymlfile, Loader=yaml.SafeLoader)[part]
-     return config_parameters
-
-def set_log(handler_type, socket, facility, level='INFO', stdout=False, filepath=False):
+def set_log(handler_type, socket, facility, level='INFO', stdout=False, filepath=False, fmt='kv', stream=None):
+    '''
+    Configure the logger. The handlers are fed by a background thread
+    (see dsReplTest.events).
+        fmt - 'kv' for the key=value format, 'json' for JSON lines
+        stream - where the stdout log goes (sys.stdout by default)
+    '''
     log = logging.getLogger(loggerName)
     log.setLevel(level)
+    handlers = []
     formatter_syslog = logging.Formatter('%(module)s[%(process)d]: %(message)s')
     formatter_stdout = logging.Formatter('%(asctime)s %(module)s[%(process)d]: %(levelname)s: %(message)s')
     formatter_file   = logging.Formatter('%(asctime)s %(module)s[%(process)d]: %(message)s')
+    if fmt == 'json':
+        formatter_syslog = formatter_stdout = formatter_file = events.JSONFormatter()
+    elif fmt != 'kv':
+        return False
 
     if handler_type == 'syslog':
         handler_syslog = logging.handlers.SysLogHandler(address=socket, facility=facility)
         handler_syslog.setFormatter(formatter_syslog)
         handler_syslog.setLevel(level)
-        log.addHandler(handler_syslog)
+        handlers.append(handler_syslog)
     if handler_type == 'file':
         if not filepath:
             return False
@@ -33,15 +39,21 @@ def set_log(handler_type, socket, facility, level='INFO', stdout=False, filepath
         handler_file = logging.handlers.WatchedFileHandler(filepath, encoding='utf8')
         handler_file.setFormatter(formatter_file)
         handler_file.setLevel(level)
-        log.addHandler(handler_file)
+        handlers.append(handler_file)
         os.umask(oldumask)
     if stdout:
-        handler_out = logging.StreamHandler(sys.stdout)
+        handler_out = logging.StreamHandler(stream or sys.stdout)
         handler_out.setLevel(level)
         handler_out.setFormatter(formatter_stdout)
-        log.addHandler(handler_out)
+        handlers.append(handler_out)
+    events.start_pipeline(log, handlers)
     return True
 def notifyEmail(mailConf):
+    # Imported here: most of the runs don't send any email
+    import smtplib
+    import ssl
+    from email.message import EmailMessage
+    from email import utils
     msg = EmailMessage()
     msg.set_content(mailConf['BODYTEXT'])
     msg.set_default_type('text/plain')
@@ -0,0 +1,268 @@
+'''
+The configuration of ds-repltest.
+
+The YAML file is parsed and validated once into a Config object. The
+object is read only: a reload builds a new one, so a pass which took a
+Config keeps using it until its end, while the next passes take the
+new one.
+'''
+import os
+import threading
+import time
+import types
+import yaml
+import dsReplTest.plan as plan
+
+# Optional keys and their default value
+DEFAULTS = {
+    'WORKERS': 1,
+    'HOST_LIMIT': None,
+    'CONVERGE_TIMEOUT': None,
+    'CONNECTION_POOL': True,
+    'POOL_IDLE_TIMEOUT': 300,
+    'INTERVAL': 43200,
+    'STAGGER': False,
+    'HISTORY_FILE': None,
+    'HISTORY_RECORDS': 100000,
+    'DISCOVERY_CACHE': None,
+    'DISCOVERY_TTL': 3600,
+    'PASSIVE_INTERVAL': None,
+    'PASSIVE_MAX_LAG': 300,
+    'PASS_DEADLINE': None,
+    'PREFLIGHT': True,
+    'BATCH_VERIFY': False,
+    'WARN_LATENCY': None,
+    'PROBE_MODE': 'add',
+    'PROBE_ATTRIBUTE': 'description',
+    'THROUGHPUT_BURST': 100,
+    'THROUGHPUT_TIMEOUT': 60,
+    'THROUGHPUT_POLL': 0.1,
+    'TLS_CACERT': None,
+    'TLS_CACERTDIR': None,
+    'TLS_CERT': None,
+    'TLS_KEY': None,
+    'TLS_REQCERT': 'demand',
+}
+REQUIRED = ('Logging', 'Email', 'Web', 'INSTANCES', 'TEST_ENTRY', 'TIMEOUT', 'TIMEWAIT', 'UPDATE_TIMEWAIT')
+LOGGING_KEYS = ('LOGFILE_DIR', 'LOGFILE_NAME', 'LOGSTDOUT', 'TYPE', 'SYSLOG_FAC', 'LOG_LEVEL', 'SYSLOG_SOCKET')
+ACCESS_KEYS = ('port', 'protocol', 'bind', 'pwd')
+# These keys are read at startup only: a reload doesn't change them
+STARTUP_KEYS = ('Logging', 'Web', 'INTERVAL', 'STAGGER', 'HISTORY_FILE', 'HISTORY_RECORDS', 'PASSIVE_INTERVAL',
+                'TLS_CACERT', 'TLS_CACERTDIR', 'TLS_CERT', 'TLS_KEY', 'TLS_REQCERT')
+PROTOCOLS = ('ldap', 'ldaps', 'ldapi')
+REQCERTS = ('never', 'allow', 'try', 'demand', 'hard')
+
+class ConfigError(Exception):
+    pass
+
+def freeze(value):
+    ''' Return a read only copy of a parsed YAML value. '''
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def validate_transport(conf, where, local=True):
+    ''' Check protocol, starttls and socket of a supplier, balancer or discover section. '''
+    protocols = PROTOCOLS if local else ('ldap', 'ldaps')
+    if conf['protocol'] not in protocols:
+        raise ConfigError('{}: protocol must be one of {}'.format(where, ', '.join(protocols)))
+    if conf['protocol'] == 'ldapi' and not conf.get('socket'):
+        raise ConfigError('{}: protocol ldapi needs "socket"'.format(where))
+    if conf['protocol'] == 'ldaps' and conf.get('starttls'):
+        raise ConfigError('{}: starttls needs protocol ldap'.format(where))
+
+def validate_instances(instances):
+    if not isinstance(instances, dict) or not instances:
+        raise ConfigError('INSTANCES must be a not empty dictionary')
+    for instance, conf in instances.items():
+        if not isinstance(conf, dict) or not (conf.get('suffixes') or conf.get('discover')):
+            raise ConfigError('Instance "{}" needs "suffixes" or "discover"'.format(instance))
+        if conf.get('discover'):
+            missing = [key for key in ACCESS_KEYS + ('suppliers',) if key not in conf['discover']]
+            if missing:
+                raise ConfigError('Instance "{}": "discover" misses {}'.format(instance, ', '.join(missing)))
+            validate_transport(conf['discover'], 'Instance "{}", "discover"'.format(instance), local=False)
+        if conf.get('balancer'):
+            missing = [key for key in ('protocol', 'host', 'port', 'basedn', 'bind', 'pwd') if key not in conf['balancer']]
+            if missing:
+                raise ConfigError('Instance "{}": "balancer" misses {}'.format(instance, ', '.join(missing)))
+            validate_transport(conf['balancer'], 'Instance "{}", "balancer"'.format(instance))
+        for basedn, suppliers in (conf.get('suffixes') or {}).items():
+            if not isinstance(suppliers, dict) or not suppliers:
+                raise ConfigError('Instance "{}", suffix "{}": no suppliers'.format(instance, basedn))
+            for supplier, supplierConf in suppliers.items():
+                missing = [key for key in ACCESS_KEYS + ('replica',) if key not in (supplierConf or {})]
+                if missing:
+                    raise ConfigError('Instance "{}", suffix "{}", supplier {} misses {}'
+                                      .format(instance, basedn, supplier, ', '.join(missing)))
+                validate_transport(supplierConf, 'Instance "{}", suffix "{}", supplier {}'.format(instance, basedn, supplier))
+                for consumer in supplierConf['replica'] or ():
+                    if not isinstance(consumer, dict) or len(consumer) != 1:
+                        raise ConfigError('Instance "{}", suffix "{}", supplier {}: wrong replica item {}'
+                                          .format(instance, basedn, supplier, consumer))
+
+def encode_entry(entry):
+    '''
+    Convert the TEST_ENTRY values in bytes. This is to avoid to enter
+    the b'string' in the config file.
+    '''
+    encoded = {}
+    for key, value in entry.items():
+        if isinstance(value, list):
+            encoded[key] = [item.encode('utf-8') for item in value]
+        else:
+            encoded[key] = str(value).encode('utf-8')
+    return encoded
+
+class Config:
+    '''
+    The parsed configuration file. Every top level key is an attribute
+    (config.INSTANCES, config.TIMEOUT...), the optional ones have their
+    default value. Besides:
+        rdn - the rdn attribute of the test entry ('uid' or 'cn')
+        ENTRY - TEST_ENTRY with values in bytes
+        persistentAttribute - PROBE_ATTRIBUTE in 'modify' PROBE_MODE, else None
+        mtime - modification time of the file when it was read
+        plans - {instance: Plan} of the instances with "suffixes" only
+                (see dsReplTest.plan). Use plan() to get the Plan of a pass.
+
+    It raises ConfigError if the file is not valid.
+    '''
+    def __init__(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path, 'r') as ymlfile:
+                parsed = yaml.load(ymlfile, Loader=yaml.SafeLoader)
+        except (OSError, yaml.YAMLError) as exc:
+            raise ConfigError('Unable to read {}: {}'.format(path, exc))
+        if not isinstance(parsed, dict):
+            raise ConfigError('{} is not a YAML dictionary'.format(path))
+        missing = [key for key in REQUIRED if parsed.get(key) is None]
+        if missing:
+            raise ConfigError('Missing parameters: {}'.format(', '.join(missing)))
+        missing = [key for key in LOGGING_KEYS if key not in parsed['Logging']]
+        if missing:
+            raise ConfigError('Missing Logging parameters: {}'.format(', '.join(missing)))
+        validate_instances(parsed['INSTANCES'])
+        if parsed.get('TLS_REQCERT', DEFAULTS['TLS_REQCERT']) not in REQCERTS:
+            raise ConfigError('TLS_REQCERT must be one of {}'.format(', '.join(REQCERTS)))
+        if parsed['Web'].get('SERVER', 'flask') not in ('flask', 'builtin'):
+            raise ConfigError("Web SERVER must be 'flask' or 'builtin'")
+        if parsed.get('PROBE_MODE', DEFAULTS['PROBE_MODE']) not in ('add', 'modify'):
+            raise ConfigError("PROBE_MODE must be 'add' or 'modify'")
+        if parsed.get('PROBE_ATTRIBUTE', DEFAULTS['PROBE_ATTRIBUTE']).lower() in ('uid', 'cn', 'objectclass'):
+            raise ConfigError('PROBE_ATTRIBUTE must not be the rdn or objectClass')
+        if 'uid' in parsed['TEST_ENTRY']:
+            rdn = 'uid'
+        elif 'cn' in parsed['TEST_ENTRY']:
+            rdn = 'cn'
+        else:
+            raise ConfigError("The rdn of the test entry is not 'cn' or 'uid'")
+        values = dict(DEFAULTS)
+        values.update(parsed)
+        values['ENTRY'] = encode_entry(parsed['TEST_ENTRY'])
+        values['rdn'] = rdn
+        values['persistentAttribute'] = values['PROBE_ATTRIBUTE'] if values['PROBE_MODE'] == 'modify' else None
+        values['mtime'] = mtime
+        values['path'] = path
+        for key, value in values.items():
+            object.__setattr__(self, key, freeze(value))
+        # The discovered instances get their Plan at every pass
+        object.__setattr__(self, 'plans', types.MappingProxyType(
+            {instance: plan.compile_plan({instance: conf}) for instance, conf in self.INSTANCES.items()
+             if not conf.get('discover')}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Config is read only')
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def plan(self, instances):
+        '''
+        Return the Plan of instances (a subset of INSTANCES, or the
+        INSTANCES resolved by the autodiscovery): the compiled one of the
+        instances as read from the file, a new one for the discovered ones.
+        '''
+        return plan.merge_plans(self.plans[instance] if instance in self.plans else plan.compile_plan({instance: conf})
+                                for instance, conf in instances.items())
+
+class ConfigHolder:
+    '''
+    Keep the current Config and replace it when the file changes.
+        path - the configuration file
+        onReload - function called with (old, new) after a reload
+    '''
+    def __init__(self, path, logger=None, onReload=None):
+        self.path = path
+        self.logger = logger
+        self.onReload = onReload
+        self._lock = threading.Lock()
+        self._requested = threading.Event()
+        self.current = Config(path)
+
+    def reload(self):
+        '''
+        Read the file again. If it's not valid the current Config is
+        kept. This function returns True if the Config is replaced.
+        '''
+        # Called by the watcher and by the passes: the one coming second doesn't wait
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            try:
+                new = Config(self.path)
+            except ConfigError as exc:
+                if self.logger:
+                    self.logger.error('action=reload status=fail detail="{}"'.format(str(exc).replace('"', "'")))
+                return False
+            old = self.current
+            self.current = new
+            changed = [key for key in STARTUP_KEYS if old.get(key) != new.get(key)]
+            if self.logger:
+                self.logger.info('action=reload status=success file="{}"'.format(self.path))
+                if changed:
+                    self.logger.warning('action=reload detail="{} changed: restart to apply"'.format(', '.join(changed)))
+            if self.onReload:
+                self.onReload(old, new)
+            return True
+        finally:
+            self._lock.release()
+
+    def reload_if_changed(self):
+        ''' Reload if the modification time of the file changed. '''
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime != self.current.mtime:
+            return self.reload()
+        return False
+
+    def request_reload(self):
+        '''
+        Ask the watcher thread (see watch) to reload the file. It only
+        sets an event, so a signal handler can call it.
+        '''
+        self._requested.set()
+
+    def watch(self, interval=10):
+        '''
+        Check the modification time of the file every interval seconds
+        in a daemon thread (see reload_if_changed), so a change applies
+        also while a long pass runs or between two far passes. The thread
+        reloads the file at once when asked by request_reload.
+        This function returns the thread.
+        '''
+        def loop():
+            while True:
+                if self._requested.wait(interval):
+                    self._requested.clear()
+                    self.reload()
+                else:
+                    self.reload_if_changed()
+        watcher = threading.Thread(target=loop, name='ds-repltest config watcher', daemon=True)
+        watcher.start()
+        return watcher
@@ -0,0 +1,180 @@
+'''
+Topology autodiscovery from the replication agreements.
+
+An instance may have a "discover" section in place of (or beside) the
+"suffixes" one. The agreements of the seed suppliers are read under
+"cn=mapping tree,cn=config" with one subtree search per supplier. The
+consumers which have agreements too (multi-supplier replica) are read
+in the same way. The resulting topology is cached on disk and used for
+TTL seconds without any LDAP operation. Then the agreements are read
+again, and a change of the topology is logged. The cache keeps only the
+topology: the credentials always come from the config file.
+'''
+import hashlib
+import json
+import os
+import time
+import ldap
+import dsReplTest.ldap as myldap
+import dsReplTest.events as events
+
+MAPPING_TREE = 'cn=mapping tree,cn=config'
+AGREEMENT_FILTER = '(objectClass=nsds5ReplicationAgreement)'
+AGREEMENT_ATTRS = ['nsDS5ReplicaHost', 'nsDS5ReplicaRoot', 'nsDS5ReplicaUpdateSchedule',
+                   'nsds5ReplicaEnabled']
+# A schedule meaning "always in synch"
+ALWAYS = ('*', '0000-2359 0123456')
+
+def first_value(attrs, name):
+    ''' Return the first value of an attribute as string, or None. '''
+    for key in attrs:
+        if key.lower() == name.lower() and attrs[key]:
+            return attrs[key][0].decode('utf-8')
+    return None
+
+def read_agreements(conn):
+    '''
+    Read the replication agreements of a supplier.
+        conn - LDAPObject bound with a DN allowed to read cn=config
+
+    This function returns a list of dictionaries with the keys
+    dn, consumer, suffix, scheduled (bool).
+    '''
+    agreements = []
+    for dn, attrs in conn.search_s(MAPPING_TREE, ldap.SCOPE_SUBTREE, AGREEMENT_FILTER, AGREEMENT_ATTRS):
+        if dn is None:
+            continue
+        enabled = first_value(attrs, 'nsds5ReplicaEnabled')
+        if enabled is not None and enabled.lower() == 'off':
+            continue
+        schedule = first_value(attrs, 'nsDS5ReplicaUpdateSchedule')
+        agreements.append({
+            'dn': dn,
+            'consumer': first_value(attrs, 'nsDS5ReplicaHost').lower(),
+            'suffix': first_value(attrs, 'nsDS5ReplicaRoot'),
+            'scheduled': schedule is not None and schedule not in ALWAYS})
+    return agreements
+
+def discover_instance(instance, discover, netTimeout, logger):
+    '''
+    Discover the topology of an instance starting from its seed suppliers.
+        discover - the "discover" section of the instance (dict)
+
+    This function returns a tuple (suffixes, fingerprint), where suffixes
+    has the same layout of the "suffixes" config section, without the
+    credentials (see with_credentials).
+    '''
+    wanted = discover.get('suffixes')
+    seeds = [host.lower() for host in discover['suppliers']]
+    queue = list(seeds)
+    visited = set()
+    suffixes = {}
+    fingerprint = hashlib.sha1()
+    while queue:
+        supplier = queue.pop(0)
+        if supplier in visited:
+            continue
+        visited.add(supplier)
+        uri = myldap.host_uri(discover, supplier)
+        try:
+            conn = myldap.connect(uri, discover['bind'], discover['pwd'], netTimeout, logger, discover.get('starttls', False))
+            try:
+                agreements = read_agreements(conn)
+            finally:
+                conn.unbind_s()
+        except ldap.LDAPError as err:
+            if supplier in seeds:
+                events.error(logger, instance=instance, host=supplier,
+                             action='discover', status='fail', **myldap.handle_fields(err))
+                raise
+            # A consumer we can't read: it's only a consumer for us
+            events.debug(logger, instance=instance, host=supplier, action='discover', status='skip', **myldap.handle_fields(err))
+            continue
+        events.info(logger, instance=instance, host=supplier,
+                    action='discover', status='success', detail='{} agreements found'.format(len(agreements)))
+        for agreement in sorted(agreements, key=lambda agreement: agreement['dn']):
+            if wanted and agreement['suffix'] not in wanted:
+                continue
+            fingerprint.update('{}|{}|{}|{}|{}\n'.format(supplier, agreement['dn'], agreement['consumer'],
+                               agreement['suffix'], agreement['scheduled']).encode('utf-8'))
+            supplierConf = suffixes.setdefault(agreement['suffix'], {}).setdefault(supplier, {
+                'replica': [],
+                'port': discover['port'],
+                'protocol': discover['protocol']})
+            supplierConf['replica'].append({agreement['consumer']: agreement['dn'] if agreement['scheduled'] else None})
+            if agreement['consumer'] not in visited:
+                queue.append(agreement['consumer'])
+    return suffixes, fingerprint.hexdigest()
+
+def with_credentials(suffixes, discover):
+    '''
+    Return a copy of the discovered suffixes with the bind, pwd and
+    starttls of the current "discover" section in every supplier.
+    '''
+    credentials = {'bind': discover['bind'], 'pwd': discover['pwd'], 'starttls': discover.get('starttls', False)}
+    resolved = {}
+    for suffix, suppliers in suffixes.items():
+        resolved[suffix] = {}
+        for supplier, supplierConf in suppliers.items():
+            resolved[suffix][supplier] = dict(supplierConf, **credentials)
+    return resolved
+
+def load_cache(path):
+    if path and os.path.isfile(path):
+        try:
+            with open(path, 'r') as cachefile:
+                return json.load(cachefile)
+        except (OSError, ValueError):
+            return {}
+    return {}
+
+def save_cache(path, cache):
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as cachefile:
+        json.dump(cache, cachefile, indent=1)
+    os.replace(tmp, path)
+
+def resolve_instances(directoryInstances, cachePath, ttl, netTimeout, logger):
+    '''
+    Fill the "suffixes" of the instances with a "discover" section.
+    The explicit suffixes of the config win over the discovered ones.
+        cachePath - JSON cache file of the discovered topology (None for no cache)
+        ttl - seconds the cached topology is used without reading the agreements
+
+    This function returns a new INSTANCES dictionary. If the discovery
+    fails, the cached topology is used, if any.
+    '''
+    if not any(conf.get('discover') for conf in directoryInstances.values()):
+        return directoryInstances
+    cache = load_cache(cachePath)
+    changed = False
+    resolved = {}
+    for instance, conf in directoryInstances.items():
+        if not conf.get('discover'):
+            resolved[instance] = conf
+            continue
+        cached = cache.get(instance)
+        if cached and time.time() - cached['checked'] < ttl:
+            suffixes = cached['suffixes']
+        else:
+            try:
+                suffixes, fingerprint = discover_instance(instance, conf['discover'], netTimeout, logger)
+                if not cached or cached['fingerprint'] != fingerprint:
+                    events.info(logger, instance=instance, action='discover', status='success', detail='topology changed')
+                cache[instance] = {'checked': time.time(), 'fingerprint': fingerprint, 'suffixes': suffixes}
+                changed = True
+            except ldap.LDAPError:
+                if not cached:
+                    raise
+                events.warning(logger, instance=instance, action='discover', status='fail', detail='using the cached topology')
+                suffixes = cached['suffixes']
+        resolved[instance] = dict(conf)
+        merged = with_credentials(suffixes, conf['discover'])
+        merged.update(conf.get('suffixes') or {})
+        resolved[instance]['suffixes'] = merged
+    if changed and cachePath:
+        try:
+            save_cache(cachePath, cache)
+        except OSError as exc:
+            logger.error('Unable to write the topology cache {}: {}'.format(cachePath, exc))
+    return resolved
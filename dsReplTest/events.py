@@ -0,0 +1,101 @@
+'''
+Structured probe events and the logging pipeline.
+
+The checks emit events (instance, baseDN, host, action, status,
+duration, error...) instead of formatted strings. An event is built
+only if the logger emits its level, and it's formatted by a background
+listener, so a slow syslog socket or log file doesn't slow the probes.
+'''
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# These fields are always quoted in the key=value format
+QUOTED = ('instance', 'baseDN', 'detail', 'error')
+
+class Event:
+    '''
+    A probe event. The fields keep their order. None values are skipped.
+    str() gives the key=value format of the syslog and file logs.
+    '''
+    __slots__ = ('fields',)
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def as_dict(self):
+        return {key: value for key, value in self.fields.items() if value is not None}
+
+    def __str__(self):
+        pairs = []
+        for key, value in self.fields.items():
+            if value is None:
+                continue
+            value = str(value)
+            if key in QUOTED or ' ' in value or not value:
+                value = '"{}"'.format(value.replace('"', "'").rstrip())
+            pairs.append('{}={}'.format(key, value))
+        return ' '.join(pairs)
+
+def emit(logger, level, **fields):
+    '''
+    Log an event, if the logger emits level. Call it through debug(),
+    info()... so that the record has the module of the caller.
+    '''
+    if logger is not None and logger.isEnabledFor(level):
+        # The caller of debug(), info()... (logging has stacklevel only from Python 3.8)
+        caller = sys._getframe(2)
+        logger.handle(logger.makeRecord(logger.name, level, caller.f_code.co_filename, caller.f_lineno,
+                                        Event(**fields), None, None, caller.f_code.co_name))
+
+def debug(logger, **fields):
+    emit(logger, logging.DEBUG, **fields)
+
+def info(logger, **fields):
+    emit(logger, logging.INFO, **fields)
+
+def warning(logger, **fields):
+    emit(logger, logging.WARNING, **fields)
+
+def error(logger, **fields):
+    emit(logger, logging.ERROR, **fields)
+
+def fatal(logger, **fields):
+    emit(logger, logging.CRITICAL, **fields)
+
+class JSONFormatter(logging.Formatter):
+    ''' One JSON object per line: time, level, module, the event fields (or message). '''
+    def format(self, record):
+        line = {'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), 'level': record.levelname,
+                'module': record.module, 'pid': record.process}
+        if isinstance(record.msg, Event):
+            line.update(record.msg.as_dict())
+        else:
+            line['message'] = record.getMessage()
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Put the records in the queue as they are: unlike QueueHandler, the
+    message is formatted later by the listener thread.
+    '''
+    def prepare(self, record):
+        return record
+
+def start_pipeline(logger, handlers):
+    '''
+    Send the records of logger to handlers through a queue drained by
+    a background thread. The queue is flushed at exit.
+    This function returns the QueueListener.
+    '''
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    logger.addHandler(DeferredQueueHandler(records))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,169 @@
+'''
+Compact on-disk history of the replication checks.
+
+The history is a ring file of fixed-size binary records, one for every
+supplier->consumer check: timestamp, pair ID, status and latency.
+When the file is full the oldest records are overwritten. The pair IDs
+are resolved through a small JSON index kept beside the ring file.
+
+The file is memory-mapped and read in chunks, so the summaries don't
+load the whole history in memory.
+'''
+import array
+import collections
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'DSRH'
+VERSION = 1
+# magic, version, record size, capacity, records written so far
+HEADER = struct.Struct('<4sHHIQ')
+HEADER_SIZE = 32
+# timestamp, pair ID, status (1 success, 0 fail), latency (NaN if unknown)
+RECORD = struct.Struct('<dIbf')
+CHUNK = 4096
+
+class History:
+    '''
+    Ring file of check records.
+        path - the ring file. The pair index is "<path>.pairs".
+        capacity - max number of records kept. An existing file keeps
+                   the capacity it was created with.
+    '''
+    def __init__(self, path, capacity=100000, logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._pairsPath = '{}.pairs'.format(path)
+        if os.path.isfile(self._pairsPath):
+            with open(self._pairsPath, 'r') as pairsfile:
+                self.pairs = [tuple(pair) for pair in json.load(pairsfile)]
+        else:
+            self.pairs = []
+        self._pairIds = {pair: i for i, pair in enumerate(self.pairs)}
+        if not os.path.isfile(path):
+            with open(path, 'wb') as ringfile:
+                ringfile.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0).ljust(HEADER_SIZE, b'\0'))
+                ringfile.truncate(HEADER_SIZE + capacity*RECORD.size)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, recsize, self.capacity, self.written = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or recsize != RECORD.size:
+            raise ValueError('{} is not a ds-repltest history file'.format(path))
+        if self.capacity != capacity and logger:
+            logger.warning('History file {} keeps its capacity of {} records'.format(path, self.capacity))
+
+    def close(self):
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+    def pair_id(self, instance, suffix, supplier, consumer):
+        ''' Return the ID of a pair, adding it to the index if new. '''
+        pair = (instance, suffix, supplier, consumer)
+        if pair not in self._pairIds:
+            self.pairs.append(pair)
+            self._pairIds[pair] = len(self.pairs) - 1
+            tmp = '{}.tmp'.format(self._pairsPath)
+            with open(tmp, 'w') as pairsfile:
+                json.dump(self.pairs, pairsfile)
+            os.replace(tmp, self._pairsPath)
+        return self._pairIds[pair]
+
+    def append(self, records):
+        ''' Append records, a list of tuples (timestamp, pair ID, status, latency). '''
+        with self._lock:
+            for timestamp, pairId, status, latency in records:
+                offset = HEADER_SIZE + (self.written % self.capacity)*RECORD.size
+                RECORD.pack_into(self._map, offset, timestamp, pairId, int(bool(status)),
+                                 float('nan') if latency is None else latency)
+                self.written += 1
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.written)
+            self._map.flush()
+
+    def record_result(self, RESULT, when=None):
+        ''' Append a record for every supplier->consumer pair of a RESULT dictionary. '''
+        if when is None:
+            when = time.time()
+        records = []
+        with self._lock:
+            for instance in RESULT:
+                for suffix in RESULT[instance]['suffixes']:
+                    for supplier, result in RESULT[instance]['suffixes'][suffix].items():
+                        if result is None:
+                            continue
+                        latency = result.get('latency', {})
+                        for consumer, status in result['replica'].items():
+                            records.append((when, self.pair_id(instance, suffix, supplier, consumer),
+                                            status, latency.get(consumer)))
+        self.append(records)
+
+    def records(self):
+        '''
+        Iterate over the records, from the oldest one, as tuples
+        (timestamp, pair ID, status, latency). Latency is None if unknown.
+        '''
+        with self._lock:
+            written = self.written
+        count = min(written, self.capacity)
+        first = written - count
+        # The ring may wrap around: read the two slices in chunks
+        start = first % self.capacity
+        for begin, end in ((start, min(start + count, self.capacity)), (0, max(0, start + count - self.capacity))):
+            for chunk in range(begin, end, CHUNK):
+                last = min(chunk + CHUNK, end)
+                data = self._map[HEADER_SIZE + chunk*RECORD.size:HEADER_SIZE + last*RECORD.size]
+                for timestamp, pairId, status, latency in RECORD.iter_unpack(data):
+                    yield timestamp, pairId, status, None if math.isnan(latency) else latency
+
+    def summary(self, trend=20, since=None):
+        '''
+        Summarize the history per pair.
+            trend - number of last statuses to return per pair
+            since - ignore the records older than this unix time
+
+        This function returns a list of dictionaries, one per pair,
+        with the keys: instance, suffix, supplier, consumer, checks,
+        failures, last, trend, p50, p95, p99 (latency percentiles,
+        None if unknown).
+        '''
+        checks = collections.Counter()
+        failures = collections.Counter()
+        last = {}
+        trends = {}
+        latencies = {}
+        for timestamp, pairId, status, latency in self.records():
+            if since is not None and timestamp < since:
+                continue
+            checks[pairId] += 1
+            if not status:
+                failures[pairId] += 1
+            last[pairId] = timestamp
+            if pairId not in trends:
+                trends[pairId] = collections.deque(maxlen=trend)
+                latencies[pairId] = array.array('f')
+            trends[pairId].append(bool(status))
+            if latency is not None:
+                latencies[pairId].append(latency)
+        summary = []
+        for pairId in sorted(checks, key=lambda pairId: self.pairs[pairId]):
+            instance, suffix, supplier, consumer = self.pairs[pairId]
+            item = {'instance': instance, 'suffix': suffix, 'supplier': supplier, 'consumer': consumer,
+                    'checks': checks[pairId], 'failures': failures[pairId], 'last': last[pairId],
+                    'trend': list(trends[pairId])}
+            values = sorted(latencies[pairId])
+            for name, rank in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                item[name] = percentile(values, rank)
+            summary.append(item)
+        return summary
+
+def percentile(values, rank):
+    ''' Nearest-rank percentile of sorted values (None if empty). '''
+    if not values:
+        return None
+    return round(values[max(0, math.ceil(rank*len(values)) - 1)], 3)
@@ -1,7 +1,21 @@
 import ldap
+import ldap.dn
+import ldap.filter
 import ldap.modlist
+import uuid
+import calendar
+import socket
+import urllib.parse
 import sys
 import time
+import select
+import threading
+import concurrent.futures
+import dsReplTest.metrics as metrics
+import dsReplTest.events as events
+import dsReplTest.trace as trace
+from dsReplTest.common import NOOP
+from dsReplTest.plan import host_uri, host_uris
 
 def handle_log(excpt):
     '''
@@ -19,12 +33,45 @@ def handle_log(excpt):
         fields = fields + ' detail="{}"'.format(excpt.args[0]['info'].replace("\"","'").rstrip())
     return fields
 
-def connect(ldapuri, binddn="", bindpw="", timeout=None, logger=None):
+def handle_fields(excpt):
+    '''
+    Same as handle_log, but this function returns the fields as a
+    dictionary for the events (see dsReplTest.events).
+    '''
+    fields = {}
+    if 'desc' in excpt.args[0]:
+        fields['error'] = excpt.args[0]['desc']
+    if 'info' in excpt.args[0]:
+        fields['detail'] = excpt.args[0]['info']
+    return fields
+
+def set_tls(cacert=None, cacertdir=None, cert=None, key=None, reqcert='demand'):
+  """
+  Set the TLS options of all the ldaps and StartTLS connections: they
+  share a single TLS context, loaded once here.
+    cacert, cacertdir - the CA certificates (file, directory)
+    cert, key - the client certificate and its key (files), if any
+    reqcert - check of the server certificate: never, allow, try, demand or hard
+  """
+  options = ((ldap.OPT_X_TLS_CACERTFILE, cacert), (ldap.OPT_X_TLS_CACERTDIR, cacertdir),
+             (ldap.OPT_X_TLS_CERTFILE, cert), (ldap.OPT_X_TLS_KEYFILE, key))
+  for option, value in options:
+    if value:
+      ldap.set_option(option, value)
+  ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, getattr(ldap, 'OPT_X_TLS_' + reqcert.upper()))
+  # Build the new context now: the connections opened later share it
+  ldap.set_option(ldap.OPT_X_TLS_NEWCTX, 0)
+
+def connect(ldapuri, binddn="", bindpw="", timeout=None, logger=None, starttls=False):
   """
   Perform LDAP connection and synchronous simple bind operation
     ldapuri - URI referring to the LDAP server (string)
-    binddn - Distinguished Name used to bind (string)
+    binddn - Distinguished Name used to bind (string). On an ldapi URI,
+             without binddn the bind is SASL EXTERNAL: the identity is
+             the one of the process.
     logger - Logger object instance
+    starttls - upgrade the connection with StartTLS before the bind
+               (not on ldapi: the socket is local)
 
   This function returns an LDAPobject instance if successful,
   None if failure
@@ -45,21 +92,46 @@ def connect(ldapuri, binddn="", bindpw="", timeout=None, logger=None):
   # Set LDAP protocol version used
   if logger: logger.debug("LDAP protocol version 3")
   conn.protocol_version=ldap.VERSION3
+  # The synchronous operations don't wait for an answer more than timeout
+  if timeout is not None:
+    conn.set_option(ldap.OPT_TIMEOUT, timeout)
+
+  if starttls and not ldapuri.startswith('ldapi://'):
+    if logger: logger.debug("Starting TLS")
+    start = time.monotonic()
+    try:
+      conn.start_tls_s()
+    except ldap.LDAPError as err:
+      if logger and 'desc' in err.args[0]: logger.error("LDAP StartTLS failed. {}".format(err.args[0]['desc']))
+      raise
+    finally:
+      metrics.OPERATION_SECONDS.observe(time.monotonic() - start, 'starttls')
+      trace.complete('starttls', start, uri=ldapuri)
 
   # Perform synchronous simple bind operation
+  external = ldapuri.startswith('ldapi://') and not binddn
   if binddn:
     password = bindpw
     if logger: logger.debug("Binding with {}".format(binddn))
+  elif external:
+    if logger: logger.debug("Binding with SASL EXTERNAL")
   else:
     if logger: logger.debug("Binding anonymously")
     password = "";
+  start = time.monotonic()
   try:
-    conn.bind_s(binddn, password, ldap.AUTH_SIMPLE)
+    if external:
+      conn.sasl_external_bind_s()
+    else:
+      conn.bind_s(binddn, password, ldap.AUTH_SIMPLE)
     return conn
   except ldap.LDAPError as err:
     if logger and 'desc' in err.args[0]: logger.error("LDAP bind failed. {}".format(err.args[0]['desc']))
     raise
     return None
+  finally:
+    metrics.OPERATION_SECONDS.observe(time.monotonic() - start, 'bind')
+    trace.complete('bind', start, uri=ldapuri)
 
 def search(ldapobj, baseDN, scope, filter):
   """
@@ -71,13 +143,123 @@ def search(ldapobj, baseDN, scope, filter):
 
   This function returns the number of entries found.
   """
+  start = time.monotonic()
   try:
       return len(ldapobj.search_s(baseDN, scope, filter))
   except ldap.NO_SUCH_OBJECT:
       return 0
+  finally:
+      metrics.OPERATION_SECONDS.observe(time.monotonic() - start, 'search')
+      trace.complete('search', start, base=baseDN)
+
+@trace.traced('wait entries', 'wait', 'dn', 'present')
+def wait_entries(conns, dn, deadlines, present=True, since=None, timeout=None, backoff=0.1, maxBackoff=2,
+                 filterstr='objectclass=*', attrlist=['1.1'], until=None, limiter=None):
+  """
+  Look for an entry on many servers at the same time, with asynchronous
+  base searches multiplexed on this thread. Each server is searched again,
+  with a delay doubling up to maxBackoff seconds, until the entry appears
+  (or disappears, if present is False) or its deadline passes.
+    conns - {host: LDAPObject}
+    dn - the entry to look for (string)
+    deadlines - {host: time.monotonic() value}. With a deadline already
+                passed the server is searched only once.
+    since - time.monotonic() value the elapsed time is measured from
+    timeout - seconds to wait for a single search answer
+    filterstr, attrlist - of the base searches. With a filter on a value
+                          the entry is found once the value replicates.
+    until - time.monotonic() value (the pass deadline): the searches sent
+            before it and still unanswered then are abandoned
+    limiter - HostLimiter object instance. A search takes a slot on its
+              host until the answer; a busy host is tried again after
+              backoff seconds, so the other hosts aren't held up.
+
+  This function returns {host: (nentries, elapsed, error)}, where
+  error is the ldap.LDAPError raised by the server, if any.
+  """
+  if since is None:
+      since = time.monotonic()
+  if limiter is None:
+      limiter = HostLimiter()
+  results = {}
+  pending = {}    # host -> (msgid, sent at)
+  nextPoll = dict.fromkeys(conns, 0)
+  delay = dict.fromkeys(conns, backoff)
+  while len(results) < len(conns):
+      now = time.monotonic()
+      for host in conns:
+          if host in results or host in pending or nextPoll[host] > now:
+              continue
+          if not limiter.acquire(host):
+              if until is not None and until <= now:
+                  results[host] = (None, None, ldap.TIMEOUT({'desc': 'Timeout', 'info': 'Pass deadline exceeded'}))
+              else:
+                  nextPoll[host] = now + backoff
+              continue
+          try:
+              pending[host] = (conns[host].search(dn, ldap.SCOPE_BASE, filterstr, attrlist), now)
+          except ldap.LDAPError as err:
+              limiter.release(host)
+              results[host] = (None, None, err)
+      if pending:
+          # Sleep until a server answers or the next poll is due
+          wakeup = [nextPoll[host] for host in conns if host not in results and host not in pending]
+          wait = min(wakeup) - now if wakeup else maxBackoff
+          if until is not None and until > now:
+              wait = min(wait, until - now)
+          fds = []
+          for host in pending:
+              try:
+                  fds.append(conns[host].get_option(ldap.OPT_DESC))
+              except ldap.LDAPError:
+                  pass
+          if fds:
+              select.select(fds, [], [], max(0, min(wait, maxBackoff)))
+          else:
+              # No descriptor to wait on: poll the answers, without spinning
+              time.sleep(max(0, min(wait, backoff)))
+      for host, (msgid, sent) in list(pending.items()):
+          try:
+              rtype, rdata = conns[host].result(msgid, 1, 0)
+          except ldap.NO_SUCH_OBJECT:
+              rtype, rdata = ldap.RES_SEARCH_RESULT, []
+          except ldap.LDAPError as err:
+              del pending[host]
+              limiter.release(host)
+              results[host] = (None, None, err)
+              continue
+          now = time.monotonic()
+          if rtype is not None:
+              metrics.OPERATION_SECONDS.observe(now - sent, 'search')
+              trace.complete('search', sent, overlap=True, host=host, base=dn)
+          if rtype is None:
+              expired = timeout is not None and now - sent > timeout
+              if expired or (until is not None and sent < until <= now):
+                  del pending[host]
+                  limiter.release(host)
+                  try:
+                      conns[host].abandon(msgid)
+                  except ldap.LDAPError:
+                      pass
+                  info = 'No answer in {}s'.format(timeout) if expired else 'Pass deadline exceeded'
+                  results[host] = (None, None, ldap.TIMEOUT({'desc': 'Timeout', 'info': info}))
+              continue
+          del pending[host]
+          limiter.release(host)
+          nentries = len(rdata)
+          if (nentries == 1) == present or now >= deadlines[host]:
+              results[host] = (nentries, now - since, None)
+          else:
+              nextPoll[host] = now + min(delay[host], deadlines[host] - now)
+              delay[host] = min(delay[host]*2, maxBackoff)
+      if not pending and len(results) < len(conns):
+          wakeup = [nextPoll[host] for host in conns if host not in results]
+          time.sleep(max(0, min(wakeup) - time.monotonic()))
+  return {host: results[host] for host in conns}
 
 def add(ldapobj, dn, ldif, logger=None):
   modlist = ldap.modlist.addModlist(ldif)
+  start = time.monotonic()
   try:
       ldapobj.add_s(dn, modlist)
       return True
@@ -89,9 +271,13 @@ def add(ldapobj, dn, ldif, logger=None):
       if logger and 'desc' in err.args[0]: logger.debug("Can't add the dn <{}>. Error: {}".format(dn, err.args[0]['desc']))
       raise
       return False
+  finally:
+      metrics.OPERATION_SECONDS.observe(time.monotonic() - start, 'add')
+      trace.complete('add', start, dn=dn)
 
 def delete(ldapobj, dn, logger=None):
   '''Perform LDAP synchronous del operation.'''
+  start = time.monotonic()
   try:
       ldapobj.delete_s(dn)
       return True
@@ -103,9 +289,63 @@ def delete(ldapobj, dn, logger=None):
       if logger and 'desc' in err.args[0]: logger.debug("Can't delete the dn <{}>. Error: {}".format(dn, err.args[0]['desc']))
       raise
       return False
+  finally:
+      metrics.OPERATION_SECONDS.observe(time.monotonic() - start, 'delete')
+      trace.complete('delete', start, dn=dn)
+
+@trace.traced('pipeline', 'ldap', 'operation')
+def pipeline(ldapobj, requests, operation, timeout=None, window=100):
+  """
+  Perform many LDAP operations of the same kind pipelined on one
+  connection: up to window requests are sent before the first answer
+  is read.
+    requests - list of (dn, function sending the request and returning its msgid)
+    operation - name of the operation, for the metrics ('add', 'delete')
+    timeout - seconds to wait for a single answer
+
+  This function returns a list of (dn, time.monotonic() of the answer,
+  error), in the requests order. error is the ldap.LDAPError of the
+  operation, if any.
+  """
+  answers = []
+  sent = []
+  for dn, send in requests:
+      try:
+          sent.append((dn, send(), time.monotonic()))
+      except ldap.LDAPError as err:
+          sent.append((dn, err, time.monotonic()))
+      while len(sent) >= window or (sent and len(answers) + len(sent) == len(requests)):
+          dn, msgid, start = sent.pop(0)
+          if isinstance(msgid, ldap.LDAPError):
+              answers.append((dn, time.monotonic(), msgid))
+              continue
+          try:
+              ldapobj.result(msgid, 1, -1 if timeout is None else timeout)
+              answers.append((dn, time.monotonic(), None))
+          except ldap.LDAPError as err:
+              answers.append((dn, time.monotonic(), err))
+          metrics.OPERATION_SECONDS.observe(time.monotonic() - start, operation)
+          trace.complete(operation, start, overlap=True, dn=dn)
+  return answers
+
+def add_many(ldapobj, entries, timeout=None, window=100):
+  """
+  Perform pipelined LDAP asynchronous add operations (see pipeline).
+    entries - list of (dn, ldif)
+  """
+  return pipeline(ldapobj, [(dn, lambda dn=dn, ldif=ldif: ldapobj.add(dn, ldap.modlist.addModlist(ldif)))
+                            for dn, ldif in entries], 'add', timeout, window)
+
+def delete_many(ldapobj, dns, timeout=None, window=100):
+  """
+  Perform pipelined LDAP asynchronous del operations (see pipeline).
+    dns - list of DN
+  """
+  return pipeline(ldapobj, [(dn, lambda dn=dn: ldapobj.delete(dn)) for dn in dns], 'delete', timeout, window)
 
 def mod(ldapobj, dn, modlist, logger=None):
     '''Perform LDAP synchronous mod operation.'''
+    start = time.monotonic()
     try:
         ldapobj.modify_s(dn, modlist)
         return True
@@ -113,6 +353,9 @@ def mod(ldapobj, dn, modlist, logger=None):
         if logger and 'desc' in err.args[0]: logger.debug("Can't modify the dn <{}>. Error: {}".format(dn, err.args[0]['desc']))
         raise
         return False
+    finally:
+        metrics.OPERATION_SECONDS.observe(time.monotonic() - start, 'modify')
+        trace.complete('modify', start, dn=dn)
 
 
 class sunError(Exception):
@@ -124,6 +367,7 @@ class sunError(Exception):
             self.err = {'desc': "Can't stop the forced update in the replica."}
         super().__init__(self.err)
 
+@trace.traced('send update now', 'ldap', 'consumer')
 def send_update_now(conn_supplier, consumer_replDN, waitSeconds, instance=None, baseDN=None, supplier=None, consumer=None, logger=None):
     # "send update now" for non-always in synch replica
     if consumer_replDN is not None:
@@ -133,308 +377,1529 @@ def send_update_now(conn_supplier, consumer_replDN, waitSeconds, instance=None,
 
             mod(conn_supplier,consumer_replDN,switch_on,logger)
             if logger:
-                logger.info('instance="{}" baseDN="{}" supplier={} consumer={} action="force update" status=success'.format(instance, baseDN, supplier, consumer))
+                events.info(logger, instance=instance, baseDN=baseDN, supplier=supplier, consumer=consumer,
+                            action='force update', status='success')
         except Exception as err:
             if logger:
-                logger.error('instance="{}" baseDN="{}" supplier={} consumer={} action="force update" status=fail {}'
-                    .format(instance, baseDN, supplier, consumer, handle_log(err)))
+                events.error(logger, instance=instance, baseDN=baseDN, supplier=supplier, consumer=consumer,
+                             action='force update', status='fail', **handle_fields(err))
             raise sunError('enable')
         try:
             mod(conn_supplier,consumer_replDN,switch_off,logger)
             if logger:
-                logger.info('instance="{}" baseDN="{}" supplier={} consumer={} action="stop force update" status=success'.format(instance, baseDN, supplier, consumer))
+                events.info(logger, instance=instance, baseDN=baseDN, supplier=supplier, consumer=consumer,
+                            action='stop force update', status='success')
         except ldap.LDAPError as err:
             if logger:
-                logger.error('instance="{}" baseDN="{}" supplier={} consumer={} action="stop force update" status=fail {}'
-                    .format(instance, baseDN, supplier, consumer, handle_log(err)))
+                events.error(logger, instance=instance, baseDN=baseDN, supplier=supplier, consumer=consumer,
+                             action='stop force update', status='fail', **handle_fields(err))
             raise sunError('disable')
-        time.sleep(waitSeconds)
-
-
-def time_to_notify(directoryInstances,netTimeout, sleepTime, UPDATE_sleepTime):
-    ''' Calculate a time in order to tell systemd to wait until end of checks '''
-    waiting = 0
-    for instance in directoryInstances:
-        for basedn in directoryInstances[instance]['suffixes']:
-            for supplier in directoryInstances[instance]['suffixes'][basedn]:
-                waiting += netTimeout + 2*sleepTime
-                for consumer in directoryInstances[instance]['suffixes'][basedn][supplier]['replica']:
-                    waiting += netTimeout
-                    for consumer_host, consumer_repl in consumer.items():
-                        if consumer_repl is not None:
-                            waiting += UPDATE_sleepTime*2
+        with trace.span('UPDATE_TIMEWAIT', 'wait'):
+            time.sleep(waitSeconds)
+
+def send_updates_now(conn_supplier, agreements, instance=None, baseDN=None, supplier=None, logger=None):
+    '''
+    "send update now" on all the scheduled agreements of a supplier,
+    without waiting. The caller waits once for all the consumers.
+        agreements - {consumer host: replication agreement DN}
+
+    This function returns {consumer host: sunError} for the failed ones.
+    '''
+    failed = {}
+    for consumer, consumer_replDN in agreements.items():
+        try:
+            send_update_now(conn_supplier, consumer_replDN, 0, instance, baseDN, supplier, consumer, logger)
+        except sunError as err:
+            failed[consumer] = err
+    return failed
+
+def probe_time(supplierConf, netTimeout, sleepTime, UPDATE_sleepTime, convergeTimeout=None):
+    ''' Calculate the longest time the probe of a supplier can take '''
+    # In convergence mode we wait for the add and for the delete
+    waits = 1
+    if convergeTimeout is not None:
+        sleepTime = convergeTimeout
+        waits = 2
+    waiting = netTimeout + waits*sleepTime
+    scheduled = False
+    for consumer in supplierConf['replica']:
+        waiting += netTimeout
+        for consumer_host, consumer_repl in consumer.items():
+            if consumer_repl is not None:
+                scheduled = True
+    # One shared wait for all the scheduled consumers
+    if scheduled:
+        waiting += waits*UPDATE_sleepTime
     return waiting
 
-def replTest(directoryInstances, rDN, testEntry, netTimeout, sleepTime, UPDATE_sleepTime, logger, logout):
+def pass_time(plan, netTimeout, sleepTime, UPDATE_sleepTime, convergeTimeout=None):
+    ''' Calculate the longest time a pass on a plan can take: all the suppliers in a row '''
+    return sum(probe_time(supplier.conf, netTimeout, sleepTime, UPDATE_sleepTime, convergeTimeout)
+               for suffix in plan.suffixes for supplier in suffix.suppliers)
+
+class HostLimiter:
+    '''
+    Cap the number of concurrent LDAP operations on a single host.
+        limit - max concurrent operations per host (None or 0 means no cap)
+
+    Use it as "with limiter.host(hostname): ..." around the LDAP work,
+    or acquire and release a host without waiting (see wait_entries).
+    '''
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def host(self, hostname):
+        if not self.limit:
+            return NOOP
+        with self._lock:
+            if hostname not in self._semaphores:
+                self._semaphores[hostname] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[hostname]
+
+    def acquire(self, hostname):
+        ''' Take a slot on a host, if free. This method returns False if the host is busy. '''
+        if not self.limit:
+            return True
+        return self.host(hostname).acquire(blocking=False)
+
+    def release(self, hostname):
+        if self.limit:
+            self.host(hostname).release()
+
+# The errors of a connection which make its host unreachable for the rest of a pass
+UNREACHABLE = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR)
+
+def check_reachable(ldapuri, host, port, netTimeout):
+    '''
+    Check a host with a TCP connect (a connect to the socket, with
+    ldapi) and an anonymous rootDSE read. With ldaps the connect is
+    enough: the probes do the TLS handshake once, on their connection.
+    This function returns the reason why the host is unreachable, or
+    None if it answers.
+    '''
+    try:
+        if ldapuri.startswith('ldapi://'):
+            local = socket.socket(socket.AF_UNIX)
+            local.settimeout(netTimeout)
+            try:
+                local.connect(urllib.parse.unquote(ldapuri[len('ldapi://'):]))
+            finally:
+                local.close()
+        else:
+            socket.create_connection((host, port), netTimeout).close()
+    except OSError as err:
+        return "Unreachable: {}".format(err.strerror or err)
+    if ldapuri.startswith('ldaps://'):
+        return None
+    conn = ldap.initialize(ldapuri)
+    try:
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, netTimeout)
+        conn.set_option(ldap.OPT_TIMEOUT, netTimeout)
+        conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', ['1.1'])
+        return None
+    except ldap.LDAPError as err:
+        return "rootDSE read failed: {}".format(handle_fields(err).get('error', err))
+    finally:
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+class HostHealth:
+    '''
+    The reachability of the hosts during a pass, keyed by LDAP URI.
+    sweep() checks every host once before the probes; a connection
+    which fails later for a network error marks its host down as well.
+    The probes don't try the hosts down: they fail at once with the
+    reason.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._down = {}     # ldapuri -> reason
+
+    def down(self, ldapuri):
+        ''' Return the reason why the host of ldapuri is down, or None. '''
+        return self._down.get(ldapuri)
+
+    def mark_down(self, ldapuri, reason):
+        with self._lock:
+            self._down.setdefault(ldapuri, reason)
+
+    def failed(self, ldapuri, err):
+        ''' Record a failed connection: only the network errors mark the host down. '''
+        if isinstance(err, UNREACHABLE):
+            self.mark_down(ldapuri, "Unreachable: {}".format(handle_fields(err).get('error', err)))
+
+    @trace.traced('preflight', 'pass')
+    def sweep(self, uris, netTimeout, logger=None, workers=32):
+        '''
+        Check all the hosts in parallel (see check_reachable).
+            uris - {ldapuri: (protocol, host, port)} (see host_uris)
+        This function returns the number of hosts down.
+        '''
+        if not uris:
+            return 0
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(uris))) as executor:
+            jobs = {executor.submit(check_reachable, uri, host, port, netTimeout): (uri, host)
+                    for uri, (protocol, host, port) in uris.items()}
+            for job in concurrent.futures.as_completed(jobs):
+                uri, host = jobs[job]
+                reason = job.result()
+                if reason is None:
+                    events.debug(logger, host=host, action='reachability', status='success')
+                else:
+                    self.mark_down(uri, reason)
+                    events.error(logger, host=host, action='reachability', status='fail', detail=reason)
+        events.info(logger, action='reachability sweep', status='success', hosts=len(uris),
+                    down=len(self._down), duration=round(time.monotonic() - start, 3))
+        return len(self._down)
+
+class ConnectionPool:
+    '''
+    A cache of bound LDAP connections, keyed by (ldapuri, binddn, starttls).
+    A TLS connection kept here is reused with its TLS session: there is
+    a handshake only when a new connection is opened.
+        timeout - network timeout used to open new connections
+        maxIdle - seconds after which an idle connection is unbound
+        reuse - if False, every get() opens a new connection and every
+                release() unbinds it (no caching at all)
+
+    A connection taken by get() is used by one caller only until it
+    is given back by release(). Idle connections are checked with a
+    rootDSE read before they are handed out again.
+    '''
+    def __init__(self, timeout=None, maxIdle=300, reuse=True, logger=None):
+        self.timeout = timeout
+        self.maxIdle = maxIdle
+        self.reuse = reuse
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._idle = {}     # (uri, binddn, starttls) -> [(conn, released at)]
+        self._keys = {}     # id(conn) -> (uri, binddn, starttls)
+        self._closed = False
+
+    def get(self, ldapuri, binddn="", bindpw="", starttls=False):
+        '''
+        Return a bound LDAPObject, reusing an idle one if healthy.
+        It raises ldap.LDAPError if a new connection fails.
+        '''
+        key = (ldapuri, binddn, starttls)
+        self.evict()
+        while self.reuse:
+            with self._lock:
+                if not self._idle.get(key):
+                    break
+                conn, released = self._idle[key].pop()
+            if self._healthy(conn):
+                if self.logger: self.logger.debug("Reusing connection to {} as {}".format(ldapuri, binddn))
+                return conn
+            self._unbind(conn)
+        conn = connect(ldapuri, binddn, bindpw, self.timeout, self.logger, starttls)
+        with self._lock:
+            self._keys[id(conn)] = key
+        return conn
+
+    def release(self, conn):
+        ''' Give back a connection taken by get(). '''
+        if not self.reuse:
+            self._unbind(conn, raising=True)
+            return
+        with self._lock:
+            key = self._keys.get(id(conn))
+            # A probe over the deadline may give back its connections late
+            if key is not None and not self._closed:
+                self._idle.setdefault(key, []).append((conn, time.monotonic()))
+                return
+        self._unbind(conn, raising=True)
+
+    def discard(self, conn):
+        ''' Unbind a connection taken by get() which must not be reused. '''
+        self._unbind(conn)
+
+    def evict(self):
+        ''' Unbind the connections idle for more than maxIdle seconds. '''
+        expired = []
+        now = time.monotonic()
+        with self._lock:
+            for key in self._idle:
+                keep = []
+                for conn, released in self._idle[key]:
+                    if now - released > self.maxIdle:
+                        expired.append(conn)
+                    else:
+                        keep.append((conn, released))
+                self._idle[key] = keep
+        for conn in expired:
+            self._unbind(conn)
+
+    def close(self):
+        ''' Unbind all the idle connections. The connections released later are unbound at once. '''
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn, released in conns]
+            self._idle = {}
+            self._closed = True
+        for conn in idle:
+            self._unbind(conn)
+
+    def _healthy(self, conn):
+        start = time.monotonic()
+        try:
+            conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', ['1.1'])
+            return True
+        except ldap.LDAPError:
+            return False
+        finally:
+            trace.complete('reuse check', start)
+
+    def _unbind(self, conn, raising=False):
+        with self._lock:
+            self._keys.pop(id(conn), None)
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            if raising:
+                raise
+
+@trace.traced('balancer', 'instance', 'instance')
+def check_balancer(instance, balancer, netTimeout, logger, pool=None, health=None):
+    '''
+    Check the LDAP access over the balancer of an instance.
+        instance - instance name (string)
+        balancer - the balancer section of the instance (dict)
+        health - HostHealth object instance
+
+    This function returns a tuple (status, someError).
+    '''
+    if pool is None:
+        pool = ConnectionPool(netTimeout, reuse=False, logger=logger)
+    if health is None:
+        health = HostHealth()
     someError = False
-    ''' Initialize the RESULT Dictionary '''
-    RESULT = {}
-    if not logout:
-        mapResult = { True: "\t[  \033[92mOK\033[0m  ]", False: "\t[  \033[91mKO\033[0m  ]" }
-        endStr = ''
-    else:
-        endStr = "\n"
+    status = None
+    balancer_uri = host_uri(balancer, balancer['host'])
+    try:
+        if health.down(balancer_uri):
+            raise ldap.SERVER_DOWN({'desc': health.down(balancer_uri)})
+        connB = pool.get(balancer_uri, balancer['bind'], balancer['pwd'], balancer.get('starttls', False))
+        events.info(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                    action='connect', status='success')
+    except ldap.LDAPError as err:
+            health.failed(balancer_uri, err)
+            events.error(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                         action='connect', status='fail', **handle_fields(err))
+            status = False
+            someError = True
+            connB = False
+    except:
+        print("\n\n Unhandled exception!! \n\n")
+        events.fatal(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                     action='connect', status='fail', error='unhandled exception')
+        raise
+    if connB:
+        try:
+            nentries = search(connB, balancer['basedn'], ldap.SCOPE_BASE, 'objectclass=*')
+            events.info(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                        action='balancer search', status='success', detail='{} entries found'.format(nentries))
+            if nentries == 1:
+                events.info(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                            action='validate', status='success')
+                status = True
+            else:
+                events.error(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                             action='validate', status='fail', detail='wrong number of entries found')
+                status = False
+                someError = True
+        except ldap.LDAPError as err:
+            nentries = 0
+            someError = True
+            events.error(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                         action='balancer search', status='fail', **handle_fields(err))
+            status = False
+        try:
+            pool.release(connB)
+            events.info(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                        action='disconnect', status='success')
+        except:
+            events.error(logger, instance=instance, baseDN=balancer['basedn'], balancer=balancer['host'],
+                         action='disconnect', status='fail')
+            someError = True
+    metrics.BALANCER_STATUS.set(int(bool(status)), instance)
+    return status, someError
+
+def timed_out(instance, basedn, supplier, logger):
+    '''
+    Compose the result of a supplier whose probe didn't end (or didn't
+    start) before the deadline of the pass.
+        supplier - SupplierPlan object instance (see dsReplTest.plan)
+    '''
+    result = {'replica': {}, 'detail': {}, 'status': False, 'overallStatus': False, 'error': 'Timed out'}
+    for edge in supplier.edges:
+        result['replica'][edge.consumer] = False
+        result['detail'][edge.consumer] = 'Timed out'
+    events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                 action='validate', status='fail', detail="Pass deadline exceeded")
+    record_metrics(instance, basedn, supplier.name, result)
+    return result
+
+def capped(deadline, passDeadline):
+    ''' A time.monotonic() deadline, not after the deadline of the pass (None for no deadline). '''
+    return deadline if passDeadline is None else min(deadline, passDeadline)
+
+def release_all(pool, conns, result, instance, basedn, logger):
+    '''
+    Give back to the pool the consumer connections in conns ({host: LDAPObject}).
+    This function returns True if some release fails.
+    '''
+    someError = False
+    for host, conn in conns.items():
+        try:
+            pool.release(conn)
+            events.info(logger, instance=instance, baseDN=basedn, host=host, action='disconnect', status='success')
+        except:
+            events.error(logger, instance=instance, baseDN=basedn, host=host, action='disconnect', status='fail')
+            result['overallStatus'] = False
+            someError = True
+    return someError
 
-    for instance in directoryInstances:
-        RESULT[instance] = {}
-        RESULT[instance]['suffixes'] = {}
-        RESULT[instance]['status'] = None
-        print (instance)
-        # Check balancer, if any
-        if 'balancer' in directoryInstances[instance].keys() and directoryInstances[instance]['balancer'] is not None:
-            balancer_uri = "{}://{}:{}".format(directoryInstances[instance]['balancer']['protocol'],
-                                               directoryInstances[instance]['balancer']['host'],
-                                               directoryInstances[instance]['balancer']['port'])
-            print("\t\tChecking balancer access on {}".format(balancer_uri), end=endStr)
+@trace.traced('supplier', 'supplier', 'instance', 'basedn', 'supplier')
+def probe_supplier(instance, basedn, supplier, entryDN, testEntry,
+                   netTimeout, sleepTime, UPDATE_sleepTime, logger, limiter=None, convergeTimeout=None, pool=None,
+                   health=None, persistentAttribute=None, passDeadline=None):
+    '''
+    Write the test entry on a supplier, check it on every consumer and
+    then delete it.
+        supplier - SupplierPlan object instance (see dsReplTest.plan)
+        entryDN - DN of the test entry (string)
+        limiter - HostLimiter object instance
+        convergeTimeout - if not None, poll each consumer until the entry
+                          arrives (and later disappears) instead of sleeping
+                          sleepTime, up to convergeTimeout seconds.
+                          The replication latency of each consumer is
+                          stored in result['latency'].
+        pool - ConnectionPool object instance
+        health - HostHealth object instance. The hosts down are not
+                 tried: they fail at once with the reason.
+        persistentAttribute - if not None, the test entry is a persistent
+                 one (see persistent_entry): a new nonce replaces the
+                 value of this attribute, instead of the add, and the
+                 consumers are searched for that value. There is no
+                 delete, so no second wait and no tombstone.
+        passDeadline - time.monotonic() value of the pass deadline. The
+                 waits end by then, the consumers not yet connected fail
+                 as timed out, and the entry is still deleted.
+
+    All the consumers are searched at the same time (see wait_entries),
+    so checking them takes as long as the slowest one.
+
+    This function returns a tuple (result, someError), where result is
+    the RESULT dictionary of the supplier. Besides the statuses it has
+    "elapsed" (seconds), "detail" ({consumer: failure reason}) and, if
+    the supplier fails, "error".
+    '''
+    if limiter is None:
+        limiter = HostLimiter()
+    if pool is None:
+        pool = ConnectionPool(netTimeout, reuse=False, logger=logger)
+    if health is None:
+        health = HostHealth()
+    someError = False
+    started = time.monotonic()
+    result = {}
+    result['replica'] = {}
+    result['detail'] = {}
+    result['overallStatus'] = True
+    converge = convergeTimeout is not None
+    if converge:
+        result['latency'] = {}
+    # Connect to the Supplier
+    if health.down(supplier.uri):
+        result['status'] = False
+        result['overallStatus'] = False
+        result['error'] = health.down(supplier.uri)
+        result['elapsed'] = 0.0
+        for edge in supplier.edges:
+            result['replica'][edge.consumer] = False
+            result['detail'][edge.consumer] = 'Supplier down'
+        events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                     action='validate', status='fail', detail=result['error'])
+        record_metrics(instance, basedn, supplier.name, result)
+        return result, True
+    with limiter.host(supplier.name):
+        try:
+            connS = pool.get(supplier.uri, supplier.bind, supplier.pwd, supplier.starttls)
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='connect', status='success')
+        except ldap.LDAPError as err:
+            health.failed(supplier.uri, err)
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                         action='connect', status='fail', **handle_fields(err))
+            result['status'] = False
+            result['overallStatus'] = False
+            result['error'] = "Can't connect"
+            result['elapsed'] = round(time.monotonic() - started, 3)
+            for edge in supplier.edges:
+                result['replica'][edge.consumer] = False
+                result['detail'][edge.consumer] = "Can't connect to the supplier"
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                         action='validate', status='fail', detail="Can't connect")
+            record_metrics(instance, basedn, supplier.name, result)
+            return result, True
+        except:
+            print("\n\n Unhandled exception!! \n\n")
+            events.fatal(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                         action='connect', status='fail', error='unhandled exception')
+            raise
+
+
+        # Add to the Supplier (or change the nonce of the persistent entry)
+        try:
+            if persistentAttribute is None:
+                add(connS, entryDN, testEntry, logger)
+            else:
+                nonce = write_nonce(connS, entryDN, testEntry, persistentAttribute, logger)
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='write', status='success')
+        except ldap.LDAPError as err:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                         action='write', status='fail', **handle_fields(err))
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                         action='validate', status='fail', detail="Can't add to the supplier")
+            result['status'] = False
+            result['error'] = "Can't add to the supplier"
+            result['overallStatus'] = False
+            someError= True
+        addTime = time.monotonic()
+
+    # Wait to allow replica propagation among consumers
+    if not converge:
+        with trace.span('TIMEWAIT', 'wait'):
+            time.sleep(max(0, capped(time.monotonic() + sleepTime, passDeadline) - time.monotonic()))
+    # "send update now" for all the non-always in synch replica at once.
+    #  Then the scheduled consumers are searched until the entry arrives,
+    #  up to UPDATE_sleepTime seconds.
+    agreements = {edge.consumer: edge.agreement for edge in supplier.edges if edge.agreement is not None}
+    with limiter.host(supplier.name):
+        sunFailed = send_updates_now(connS, agreements, instance, basedn, supplier.name, logger)
+    forceTime = time.monotonic()
+    # Check the testEntry replica on Consumers:
+    #  connect to all of them, then search on all at the same time.
+    connsC = {}
+    deadlines = {}
+    for edge in supplier.edges:
+        if edge.consumer in sunFailed:
+            result['replica'][edge.consumer] = False
+            result['detail'][edge.consumer] = 'Send update now failed'
+            result['overallStatus'] = False
+            someError= True
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name, consumer=edge.consumer,
+                         action='validate', status='fail', **handle_fields(sunFailed[edge.consumer]))
+            continue
+        #  Connect on consumer
+        if passDeadline is not None and time.monotonic() >= passDeadline:
+            result['replica'][edge.consumer] = False
+            result['detail'][edge.consumer] = 'Timed out'
+            result['overallStatus'] = False
+            someError = True
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name, consumer=edge.consumer,
+                         action='validate', status='fail', detail="Pass deadline exceeded")
+            continue
+        if health.down(edge.uri):
+            result['replica'][edge.consumer] = False
+            result['detail'][edge.consumer] = health.down(edge.uri)
+            result['overallStatus'] = False
+            someError = True
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name, consumer=edge.consumer,
+                         action='validate', status='fail', detail=health.down(edge.uri))
+            continue
+        with limiter.host(edge.consumer), trace.span('consumer', 'consumer', consumer=edge.consumer):
             try:
-                connB = connect(balancer_uri,
-                                directoryInstances[instance]['balancer']['bind'],
-                                directoryInstances[instance]['balancer']['pwd'], netTimeout, logger)
-                logger.info('instance="{}" baseDN="{}" balancer="{}" action=connect status=success'.format(
-                    instance,
-                    directoryInstances[instance]['balancer']['basedn'],
-                    directoryInstances[instance]['balancer']['host']))
+                connsC[edge.consumer] = pool.get(edge.uri, supplier.bind, supplier.pwd, supplier.starttls)
+                events.info(logger, instance=instance, baseDN=basedn, host=edge.consumer, action='connect', status='success')
             except ldap.LDAPError as err:
-                    logger.error('instance="{}" baseDN="{}" balancer="{}" action=connect status=fail {}'
-                                 .format(instance, directoryInstances[instance]['balancer']['basedn'],
-                                         directoryInstances[instance]['balancer']['host'], handle_log(err)))
-                    RESULT[instance]['status'] = False
-                    someError = True
-                    connB = False
+                health.failed(edge.uri, err)
+                events.error(logger, instance=instance, baseDN=basedn, host=edge.consumer,
+                             action='connect', status='fail', **handle_fields(err))
+                result['replica'][edge.consumer] = False
+                result['detail'][edge.consumer] = "Can't connect"
+                result['overallStatus'] = False
+                someError = True
+                events.fatal(logger, instance=instance, baseDN=basedn, consumer=edge.consumer,
+                             action='validate', status='fail', detail="Can't connect")
+                continue
             except:
                 print("\n\n Unhandled exception!! \n\n")
-                logger.fatal('instance="{}" baseDN="{}" balancer="{}" action=connect status=fail error="unhandled exception"'
-                             .format(instance, directoryInstances[instance]['balancer']['basedn'],
-                                     directoryInstances[instance]['balancer']['host']))
+                events.fatal(logger, instance=instance, baseDN=basedn, host=edge.consumer,
+                             action='connect', status='fail', error='unhandled exception')
                 raise
-            if connB:
+        # Keep the configuration order in the result
+        result['replica'][edge.consumer] = None
+        if edge.agreement is not None:
+            deadlines[edge.consumer] = forceTime + UPDATE_sleepTime
+        elif converge:
+            deadlines[edge.consumer] = addTime + convergeTimeout
+        else:
+            deadlines[edge.consumer] = 0
+        deadlines[edge.consumer] = capped(deadlines[edge.consumer], passDeadline)
+
+    #  Search on the consumers
+    if persistentAttribute is None:
+        found = wait_entries(connsC, entryDN, deadlines, since=addTime, timeout=netTimeout, until=passDeadline,
+                             limiter=limiter)
+    elif result.get('status') is False:
+        # The consumers still have the old nonce: nothing to look for
+        found = {}
+        for consumer_host in connsC:
+            result['replica'][consumer_host] = False
+            result['detail'][consumer_host] = "Can't write on the supplier"
+    else:
+        found = wait_entries(connsC, entryDN, deadlines, since=addTime, timeout=netTimeout,
+                             filterstr=nonce_filter(persistentAttribute, nonce), attrlist=[persistentAttribute],
+                             until=passDeadline, limiter=limiter)
+    for consumer_host, (nentries, elapsed, err) in found.items():
+        if err is None:
+            events.info(logger, instance=instance, baseDN=basedn, host=consumer_host, action='search', status='success',
+                        duration=None if elapsed is None else round(elapsed, 3))
+            if converge and nentries == 1:
+                result['latency'][consumer_host] = round(elapsed, 3)
+        else:
+            events.error(logger, instance=instance, baseDN=basedn, host=consumer_host,
+                         action='search', status='fail', **handle_fields(err))
+            someError = True
+        if nentries == 1:
+            events.info(logger, instance=instance, baseDN=basedn, supplier=supplier.name, consumer=consumer_host,
+                        action='validate', status='success')
+            result['replica'][consumer_host] = True
+        else:
+            events.error(logger, instance=instance, baseDN=basedn, supplier=supplier.name, consumer=consumer_host,
+                         action='validate', status='fail', detail='{} entries found. Expected 1'.format(nentries))
+            result['replica'][consumer_host] = False
+            result['detail'][consumer_host] = '{} entries found. Expected 1'.format(nentries)
+            result['overallStatus'] = False
+            someError = True
+
+    if not converge or persistentAttribute is not None:
+        # Unbind from consumers
+        if release_all(pool, connsC, result, instance, basedn, logger):
+            someError = True
+
+    if persistentAttribute is not None:
+        # The persistent entry stays: nothing to delete and to wait for
+        if result.get('status') is not False:
+            result['status'] = True
+            events.info(logger, instance=instance, baseDN=basedn, supplier=supplier.name, action='validate', status='success',
+                        duration=round(time.monotonic() - started, 3))
+        with limiter.host(supplier.name):
+            try:
+                pool.release(connS)
+                events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='disconnect', status='success')
+            except:
+                events.error(logger, instance=instance, baseDN=basedn, host=supplier.name, action='disconnect', status='fail')
+                result['overallStatus'] = False
+                someError = True
+        result['elapsed'] = round(time.monotonic() - started, 3)
+        record_metrics(instance, basedn, supplier.name, result)
+        return result, someError
+
+    with limiter.host(supplier.name):
+        # Delete the testEntry from the Supplier
+        try:
+            delete(connS, entryDN, logger)
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='delete', status='success')
+            events.info(logger, instance=instance, baseDN=basedn, supplier=supplier.name, action='validate', status='success',
+                        duration=round(time.monotonic() - started, 3))
+            result['status'] = True
+        except ldap.NO_SUCH_OBJECT:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                         action='delete', status='fail', error='No such object')
+            result['status'] = False
+            result['overallStatus'] = False
+            result['error'] = "Can't delete. Deleted already? Unexpected."
+            someError = True
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                         action='validate', status='fail', detail="Can't delete. Deleted already? Unexpected.")
+        except ldap.LDAPError as err:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                         action='delete', status='fail', **handle_fields(err))
+            result['status'] = False
+            result['overallStatus'] = False
+            result['error'] = "Can't delete"
+            someError = True
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                         action='validate', status='fail', detail="Can't delete")
+
+    # If the replica isn't always in synch, try to send update now
+    with limiter.host(supplier.name):
+        if send_updates_now(connS, agreements, instance, basedn, supplier.name, logger):
+            result['overallStatus'] = False
+            someError= True
+
+    if converge:
+        # Wait until the delete has reached the consumers, then unbind
+        deleteTime = time.monotonic()
+        for consumer_host in connsC:
+            if consumer_host in agreements:
+                deadlines[consumer_host] = deleteTime + UPDATE_sleepTime
+            else:
+                deadlines[consumer_host] = deleteTime + convergeTimeout
+            deadlines[consumer_host] = capped(deadlines[consumer_host], passDeadline)
+        found = wait_entries(connsC, entryDN, deadlines, present=False, since=deleteTime, timeout=netTimeout,
+                             until=passDeadline, limiter=limiter)
+        for consumer_host, (nentries, elapsed, err) in found.items():
+            if err is not None:
+                events.error(logger, instance=instance, baseDN=basedn, host=consumer_host,
+                             action='wait delete', status='fail', **handle_fields(err))
+            elif nentries != 0:
+                events.error(logger, instance=instance, baseDN=basedn, host=consumer_host,
+                             action='wait delete', status='fail', detail='{} entries found. Expected 0'.format(nentries))
+        if release_all(pool, connsC, result, instance, basedn, logger):
+            someError = True
+
+    # Unbind from Supplier
+    with limiter.host(supplier.name):
+        try:
+            pool.release(connS)
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='disconnect', status='success')
+        except:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier.name, action='disconnect', status='fail')
+            result['overallStatus'] = False
+            someError = True
+
+    result['elapsed'] = round(time.monotonic() - started, 3)
+    record_metrics(instance, basedn, supplier.name, result)
+    return result, someError
+
+def record_metrics(instance, basedn, supplier, result, passive=False):
+    '''
+    Update the metric registry with the result of a supplier. The
+    passive checks (see dsReplTest.ruv) have their own status series.
+    '''
+    now = time.time()
+    if passive:
+        supplierStatus, probeStatus, lastSuccess = (metrics.PASSIVE_SUPPLIER_STATUS, metrics.PASSIVE_STATUS,
+                                                    metrics.PASSIVE_LAST_SUCCESS)
+    else:
+        supplierStatus, probeStatus, lastSuccess = metrics.SUPPLIER_STATUS, metrics.PROBE_STATUS, metrics.PROBE_LAST_SUCCESS
+    supplierStatus.set(int(bool(result['overallStatus'])), instance, basedn, supplier)
+    for consumer, status in result['replica'].items():
+        probeStatus.set(int(bool(status)), instance, basedn, supplier, consumer)
+        if status:
+            lastSuccess.set(now, instance, basedn, supplier, consumer)
+    for consumer, latency in result.get('latency', {}).items():
+        metrics.REPLICATION_LATENCY.observe(latency, instance, basedn, supplier, consumer)
+    for consumer, lag in result.get('lag', {}).items():
+        metrics.REPLICATION_LAG.set(lag, instance, basedn, supplier, consumer)
+
+# The run ID of the persistent probe entries
+PERSISTENT_RUN = 'persistent'
+
+def new_run_id():
+    ''' Return a unique ID for the probe entries of this run (UTC timestamp and a random part). '''
+    return "{}.{}".format(time.strftime('%Y%m%d%H%M%S', time.gmtime()), uuid.uuid4().hex[:6])
+
+def run_started(runId):
+    ''' Return the epoch time a run ID (see new_run_id) was made at, or None if it isn't a run ID. '''
+    try:
+        return calendar.timegm(time.strptime(runId[:14], '%Y%m%d%H%M%S'))
+    except ValueError:
+        return None
+
+def probe_entry(rDN, testEntry, basedn, runId, supplier):
+    '''
+    Compose the probe entry written by a supplier during a run.
+    Its rdn value is "<TEST_ENTRY rdn>-<runId>-<supplier>", so all the
+    suppliers of a suffix can write at the same time without conflicts
+    and the consumers know which supplier the entry comes from.
+
+    This function returns a tuple (entryDN, entry).
+    '''
+    value = "{}-{}-{}".format(testEntry[rDN].decode('utf-8'), runId, supplier)
+    entry = dict(testEntry)
+    entry[rDN] = value.encode('utf-8')
+    return "{}={},{}".format(rDN, ldap.dn.escape_dn_chars(value), basedn), entry
+
+def persistent_entry(rDN, testEntry, basedn, supplier):
+    '''
+    Compose the persistent probe entry of a supplier on a suffix. It's
+    the probe entry of the run "persistent" (see probe_entry), so the
+    garbage collection leaves it alone.
+
+    This function returns a tuple (entryDN, entry).
+    '''
+    return probe_entry(rDN, testEntry, basedn, PERSISTENT_RUN, supplier)
+
+def write_nonce(ldapobj, entryDN, testEntry, attribute, logger=None):
+    '''
+    Replace the value of attribute in the persistent probe entry with a
+    new nonce (a new run ID). The entry is added if it doesn't exist yet.
+    This function returns the nonce (bytes).
+    '''
+    nonce = new_run_id().encode('utf-8')
+    try:
+        mod(ldapobj, entryDN, [(ldap.MOD_REPLACE, attribute, [nonce])], logger)
+    except ldap.NO_SUCH_OBJECT:
+        entry = dict(testEntry)
+        entry[attribute] = nonce
+        add(ldapobj, entryDN, entry, logger)
+    return nonce
+
+def nonce_filter(attribute, nonce):
+    return '({}={})'.format(attribute, ldap.filter.escape_filter_chars(nonce.decode('utf-8')))
+
+@trace.traced('garbage collection', 'suffix', 'instance', 'basedn')
+def sweep_probes(instance, basedn, suppliers, rDN, testEntry, runId, netTimeout, logger, limiter=None, pool=None, health=None,
+                 maxAge=None):
+    '''
+    Garbage collection: delete the probe entries left on a suffix by
+    previous runs (crashed, for instance), with one search on the first
+    reachable supplier. The entries of the current run and the persistent
+    ones (see persistent_entry) are untouched.
+        suppliers - the SupplierPlan objects of the suffix (see dsReplTest.plan)
+        maxAge - delete only the entries of the runs started more than
+                 maxAge seconds ago: the younger ones can belong to a
+                 pass still running on another host or process (cron
+                 next to the daemon, for instance). None deletes them all.
+
+    This function returns True if some error occurs.
+    '''
+    if limiter is None:
+        limiter = HostLimiter()
+    if pool is None:
+        pool = ConnectionPool(netTimeout, reuse=False, logger=logger)
+    prefix = "{}-".format(testEntry[rDN].decode('utf-8'))
+    value = ldap.filter.escape_filter_chars(testEntry[rDN].decode('utf-8'))
+    current = ldap.filter.escape_filter_chars("{}-{}-".format(testEntry[rDN].decode('utf-8'), runId))
+    persistent = ldap.filter.escape_filter_chars("{}-{}-".format(testEntry[rDN].decode('utf-8'), PERSISTENT_RUN))
+    garbageFilter = '(&(|({0}={1})({0}={1}-*))(!({0}={2}*))(!({0}={3}*)))'.format(rDN, value, current, persistent)
+    for supplier in suppliers:
+        if health is not None and health.down(supplier.uri):
+            continue
+        with limiter.host(supplier.name):
+            try:
+                connS = pool.get(supplier.uri, supplier.bind, supplier.pwd, supplier.starttls)
+            except ldap.LDAPError as err:
+                # Try with the next one. probe_supplier will log the failure.
+                if health is not None:
+                    health.failed(supplier.uri, err)
+                continue
+            someError = False
+            try:
+                found = connS.search_s(basedn, ldap.SCOPE_ONELEVEL, garbageFilter, [rDN])
+                garbage = [dn for dn, attrs in found if stale_probe(attrs.get(rDN, []), prefix, maxAge)]
+                events.info(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                            action='garbage search', status='success',
+                            detail='{} entries found, {} of running passes kept'.format(len(found), len(found) - len(garbage)))
+            except ldap.LDAPError as err:
+                garbage = []
+                someError = True
+                events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                             action='garbage search', status='fail', **handle_fields(err))
+            for entryDN in garbage:
                 try:
-                    nentries = search(connB, directoryInstances[instance]['balancer']['basedn'], ldap.SCOPE_BASE, 'objectclass=*')
-                    logger.info('instance="{}" baseDN="{}" balancer={} action="balancer search" status=success detail="{} entries found"'
-                                .format(instance, directoryInstances[instance]['balancer']['basedn'],
-                                        directoryInstances[instance]['balancer']['host'], nentries))
-                    if nentries == 1:
-                        logger.info('instance="{}" baseDN="{}" balancer={} action=validate status=success'.format(
-                            instance, directoryInstances[instance]['balancer']['basedn'],
-                            directoryInstances[instance]['balancer']['host']))
-                        RESULT[instance]['status'] = True
-                    else:
-                        logger.error('instance="{}" baseDN="{}" balancer={} action=validate status=fail detail="{}"'.format(
-                            instance, directoryInstances[instance]['balancer']['basedn'],
-                            directoryInstances[instance]['balancer']['host'],
-                            'wrong number of entries found'))
-                        RESULT[instance]['status'] = False
-                        someError = True
+                    delete(connS, entryDN, logger)
+                    events.info(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                                action='garbage', status='success', detail=entryDN)
+                except ldap.NO_SUCH_OBJECT:
+                    events.info(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                                action='garbage', status='success', detail='No such object')
                 except ldap.LDAPError as err:
-                    nentries = 0
-                    someError = True
-                    logger.error('instance="{}" baseDN="{}" balancer={} action="balancer search" status=fail {}'
-                                 .format(instance, directoryInstances[instance]['balancer']['basedn'],
-                                         directoryInstances[instance]['balancer']['host'], handle_log(err)))
-                    RESULT[instance]['status'] = False
-                try:
-                    connB.unbind_s()
-                    logger.info('instance="{}" baseDN="{}" balencer={} action=disconnect status=success'
-                                .format(instance, directoryInstances[instance]['balancer']['basedn'],
-                                        directoryInstances[instance]['balancer']['host']))
-                except:
-                    logger.error('instance="{}" baseDN="{}" balancer={} action=disconnect status=fail'
-                                .format(instance, directoryInstances[instance]['balancer']['basedn'],
-                                        directoryInstances[instance]['balancer']['host']))
-                    someError = True
-            if not logout:
-                print(mapResult[RESULT[instance]['status']])
-
-        # Perform the replication checks
-        for basedn in directoryInstances[instance]['suffixes']:
-            print("\t{}".format(basedn))
-            entryDN = "{}={},{}".format(rDN, testEntry[rDN].decode('utf-8'), basedn)
-            RESULT[instance]['suffixes'][basedn] = {}
-            for supplier in directoryInstances[instance]['suffixes'][basedn]:
-                RESULT[instance]['suffixes'][basedn][supplier] = {}
-                RESULT[instance]['suffixes'][basedn][supplier]['replica'] = {}
-                RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = True
-                # Connect to the Supplier
-                print("\t\tWorking on supplier {}".format(supplier), end=endStr)
-                supplier_uri = "{}://{}:{}".format(directoryInstances[instance]['suffixes'][basedn][supplier]['protocol'], supplier,
-                                                   directoryInstances[instance]['suffixes'][basedn][supplier]['port'])
+                    events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                                 action='garbage', status='fail', **handle_fields(err))
+            try:
+                pool.release(connS)
+            except ldap.LDAPError:
+                pass
+        return someError
+    return False
+
+def stale_probe(values, prefix, maxAge):
+    '''
+    Tell if a probe entry found by sweep_probes, with these values of
+    the rdn attribute, comes from a run started more than maxAge seconds
+    ago. The entries written before the run IDs existed are stale.
+    '''
+    if maxAge is None:
+        return True
+    for value in values:
+        value = value.decode('utf-8') if isinstance(value, bytes) else value
+        if value.startswith(prefix):
+            started = run_started(value[len(prefix):])
+            if started is not None and time.time() - started <= maxAge:
+                return False
+    return True
+
+class Probe:
+    '''
+    The probe entry written by a supplier during a batched check (see
+    probe_suffix).
+        conn - the supplier connection
+        value - the rdn value of the entry
+        nonce - the new value of the persistent entry (bytes), if any
+        sunFailed - {consumer: sunError} of the forced updates
+    '''
+    __slots__ = ('conn', 'dn', 'value', 'nonce', 'writeTime', 'forceTime', 'sunFailed')
+
+    def __init__(self, conn, dn, value, nonce, writeTime, forceTime, sunFailed):
+        self.conn = conn
+        self.dn = dn
+        self.value = value
+        self.nonce = nonce
+        self.writeTime = writeTime
+        self.forceTime = forceTime
+        self.sunFailed = sunFailed
+
+def batch_filter(rDN, expected, persistentAttribute=None):
+    '''
+    The filter matching all the probe entries expected on a consumer.
+        expected - list of (rdn value, nonce): the nonce (bytes) is used
+                   with a persistentAttribute only
+    '''
+    terms = []
+    for value, nonce in expected:
+        term = '({}={})'.format(rDN, ldap.filter.escape_filter_chars(value))
+        if persistentAttribute is not None:
+            term = '(&{}{})'.format(term, nonce_filter(persistentAttribute, nonce))
+        terms.append(term)
+    return terms[0] if len(terms) == 1 else '(|{})'.format(''.join(terms))
+
+@trace.traced('wait batch', 'wait', 'basedn', 'present')
+def wait_batch(conns, basedn, filters, expected, deadlines, present=True, timeout=None, backoff=0.1, maxBackoff=2,
+               until=None, limiter=None):
+    '''
+    Search many consumers at the same time, each one with a single one
+    level search for all the entries it expects. Each consumer is searched
+    again, with a delay doubling up to maxBackoff seconds, until it has all
+    of them (or none, if present is False) or the deadline of every entry
+    passed. A deadline already passed means a single search.
+        conns - {ConsumerPlan: LDAPObject}
+        filters - {ConsumerPlan: filter}
+        expected - {ConsumerPlan: set of entry DNs in lowercase}
+        deadlines - {ConsumerPlan: {entry DN in lowercase: time.monotonic() value}}
+        until - time.monotonic() value (the pass deadline): the consumers
+                not answered by then fail as timed out
+        limiter - HostLimiter object instance. A busy consumer is searched
+                  in the next round.
+
+    This function returns {ConsumerPlan: (seen, error)}, where seen is
+    {entry DN: time.monotonic() when it was found (or found missing, if
+    present is False)} for the entries whose state came in time.
+    '''
+    if limiter is None:
+        limiter = HostLimiter()
+    seen = {consumer: {} for consumer in conns}
+    errors = {}
+    answered = set()
+    delay = backoff
+    waiting = set(conns)
+    while waiting:
+        pending = {}
+        for consumer in waiting:
+            if not limiter.acquire(consumer.name):
+                continue
+            try:
+                pending[consumer] = (conns[consumer].search(basedn, ldap.SCOPE_ONELEVEL, filters[consumer], ['1.1']),
+                                     time.monotonic())
+            except ldap.LDAPError as err:
+                limiter.release(consumer.name)
+                errors[consumer] = err
+        for consumer, (msgid, sent) in pending.items():
+            wait = -1 if timeout is None else timeout
+            if until is not None:
+                wait = max(0, until - time.monotonic()) if wait < 0 else max(0, min(wait, until - time.monotonic()))
+            try:
+                rtype, rdata = conns[consumer].result(msgid, 1, wait)
+            except ldap.NO_SUCH_OBJECT:
+                rtype, rdata = ldap.RES_SEARCH_RESULT, []
+            except ldap.TIMEOUT:
+                rtype, rdata = None, None
+            except ldap.LDAPError as err:
+                errors[consumer] = err
+                continue
+            finally:
+                limiter.release(consumer.name)
+            now = time.monotonic()
+            if rtype is None:
                 try:
-                    connS = connect(supplier_uri,
-                                    directoryInstances[instance]['suffixes'][basedn][supplier]['bind'],
-                                    directoryInstances[instance]['suffixes'][basedn][supplier]['pwd'], netTimeout, logger)
-                    logger.info('instance="{}" baseDN="{}" host={} action=connect status=success'.format(instance, basedn, supplier))
-                except ldap.LDAPError as err:
-                    logger.error('instance="{}" baseDN="{}" host={} action=connect status=fail {}'
-                              .format(instance, basedn, supplier, handle_log(err)))
-                    RESULT[instance]['suffixes'][basedn][supplier]['status'] = False
-                    RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                    someError = True
-                    logger.fatal('instance="{}" baseDN="{}" supplier={} action=validate status=fail detail="{}"'
-                              .format(instance, basedn, supplier, "Can't connect"))
+                    conns[consumer].abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+                info = 'Pass deadline exceeded' if until is not None and now >= until else 'No answer in {}s'.format(timeout)
+                errors[consumer] = ldap.TIMEOUT({'desc': 'Timeout', 'info': info})
+                continue
+            metrics.OPERATION_SECONDS.observe(now - sent, 'search')
+            trace.complete('search', sent, host=consumer.name, base=basedn)
+            found = {dn.lower() for dn, attrs in rdata if dn is not None}
+            first = consumer not in answered
+            answered.add(consumer)
+            for dn in expected[consumer]:
+                if dn in seen[consumer] or (dn in found) != present:
                     continue
-                except:
-                    print("\n\n Unhandled exception!! \n\n")
-                    logger.fatal('instance="{}" baseDN="{}" host={} action=connect status=fail error="unhandled exception"'
-                              .format(instance, basedn, supplier))
-                    raise
+                # The first search counts also for the deadlines already passed
+                if now <= deadlines[consumer][dn] or first:
+                    seen[consumer][dn] = now
+        now = time.monotonic()
+        waiting = {consumer for consumer in waiting if consumer not in errors and len(seen[consumer]) < len(expected[consumer])
+                   and (consumer not in answered or any(now < deadlines[consumer][dn] for dn in expected[consumer]
+                                                        if dn not in seen[consumer]))}
+        if until is not None and now >= until:
+            for consumer in waiting - answered:
+                errors[consumer] = ldap.TIMEOUT({'desc': 'Timeout', 'info': 'Pass deadline exceeded'})
+            waiting = set()
+        if waiting:
+            time.sleep(delay if until is None else max(0, min(delay, until - now)))
+            delay = min(delay*2, maxBackoff)
+    return {consumer: (seen[consumer], errors.get(consumer)) for consumer in conns}
 
+def fail_edges(result, supplier, detail):
+    ''' Fail all the consumers of a supplier (SupplierPlan) with the same reason. '''
+    for edge in supplier.edges:
+        result['replica'][edge.consumer] = False
+        result['detail'][edge.consumer] = detail
 
-                # Garbage collection: we delete the test testEntry if already existent
-                # for some reason
+def write_probes(suffix, rDN, testEntry, runId, logger, limiter, pool, health, persistentAttribute, passDeadline, results):
+    '''
+    Write the probe entry of every supplier of a suffix, then force its
+    scheduled agreements. This function returns a tuple (written,
+    someError), where written is {supplier: Probe}.
+    '''
+    instance, basedn = suffix.instance, suffix.basedn
+    written = {}
+    someError = False
+    for supplier in suffix.suppliers:
+        result = results[supplier.name]
+        if passDeadline is not None and time.monotonic() >= passDeadline:
+            result.update(status=False, overallStatus=False, error='Timed out')
+            fail_edges(result, supplier, 'Timed out')
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                         action='validate', status='fail', detail="Pass deadline exceeded")
+            someError = True
+            continue
+        if health.down(supplier.uri):
+            result.update(status=False, overallStatus=False, error=health.down(supplier.uri))
+            fail_edges(result, supplier, 'Supplier down')
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                         action='validate', status='fail', detail=result['error'])
+            someError = True
+            continue
+        with limiter.host(supplier.name):
+            try:
+                connS = pool.get(supplier.uri, supplier.bind, supplier.pwd, supplier.starttls)
+                events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='connect', status='success')
+            except ldap.LDAPError as err:
+                health.failed(supplier.uri, err)
+                events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                             action='connect', status='fail', **handle_fields(err))
+                result.update(status=False, overallStatus=False, error="Can't connect")
+                fail_edges(result, supplier, "Can't connect to the supplier")
+                events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                             action='validate', status='fail', detail="Can't connect")
+                someError = True
+                continue
+            entryDN, entry = supplier_entry(rDN, testEntry, basedn, runId, supplier.name, persistentAttribute)
+            nonce = None
+            try:
+                if persistentAttribute is None:
+                    add(connS, entryDN, entry, logger)
+                else:
+                    nonce = write_nonce(connS, entryDN, entry, persistentAttribute, logger)
+                events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='write', status='success')
+            except ldap.LDAPError as err:
+                events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                             action='write', status='fail', **handle_fields(err))
+                events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier.name,
+                             action='validate', status='fail', detail="Can't add to the supplier")
+                result.update(status=False, overallStatus=False, error="Can't add to the supplier")
+                fail_edges(result, supplier, "Can't write on the supplier")
+                someError = True
                 try:
-                    nentries = search(connS, entryDN, ldap.SCOPE_BASE, 'objectclass=*')
-                    logger.info('instance="{}" baseDN="{}" host={} action="garbage search" status=success detail="{} entries found"'.format(instance, basedn, supplier, nentries))
-                except ldap.LDAPError as err:
-                    nentries = 0
-                    someError = True
-                    RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                    logger.error('instance="{}" baseDN="{}" host={} action="garbage search" status=fail {}'
-                              .format(instance, basedn, supplier, handle_log(err)))
-
-                if nentries == 1:
-                    try:
-                        delete(connS, entryDN, logger)
-                        logger.info('instance="{}" baseDN="{}" host={} action=garbage status=success'.format(instance, basedn, supplier))
-                    except ldap.NO_SUCH_OBJECT:
-                        logger.info('instance="{}" baseDN="{}" host={} action=garbage status=success detail="No such object"'
-                                 .format(instance, basedn, supplier))
-                    except ldap.LDAPError as err:
-                        logger.error('instance="{}" baseDN="{}" host={} action=garbage status=fail {}'
-                                  .format(instance, basedn, supplier, handle_log(err)))
-
-                if nentries > 1:
-                    logger.fatal('instance="{}" baseDN="{}" host={} action=garbage status=fail detail="{} entries found. Expected 1."'.format(instance, basedn, supplier, nentries))
-                    sys.exit(255)
-
-
-                # Add to the Supplier
+                    pool.release(connS)
+                except ldap.LDAPError:
+                    pass
+                continue
+            writeTime = time.monotonic()
+            agreements = {edge.consumer: edge.agreement for edge in supplier.edges if edge.agreement is not None}
+            sunFailed = send_updates_now(connS, agreements, instance, basedn, supplier.name, logger)
+            written[supplier.name] = Probe(connS, entryDN, entry[rDN].decode('utf-8'), nonce, writeTime, time.monotonic(),
+                                           sunFailed)
+    return written, someError
+
+def verify_consumers(suffix, rDN, written, netTimeout, UPDATE_sleepTime, logger, limiter, pool, health,
+                     convergeTimeout, persistentAttribute, passDeadline, results):
+    '''
+    Check every consumer of a suffix (suffix.consumers) with one batched
+    search, filling the results of the suppliers. This function returns
+    a tuple (conns, someError), where conns are the consumer connections
+    still taken from the pool.
+    '''
+    instance, basedn = suffix.instance, suffix.basedn
+    someError = False
+    conns = {}
+    filters = {}
+    expected = {}
+    deadlines = {}
+    edges = {}      # consumer -> {entry DN: supplier}
+    agreements = {(edge.supplier, edge.consumer): edge.agreement for supplier in suffix.suppliers for edge in supplier.edges}
+    for consumer in suffix.consumers:
+        wanted = {}
+        for supplier in consumer.suppliers:
+            if supplier not in written:
+                continue
+            sunFailed = written[supplier].sunFailed
+            if consumer.name in sunFailed:
+                results[supplier]['replica'][consumer.name] = False
+                results[supplier]['detail'][consumer.name] = 'Send update now failed'
+                events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer.name,
+                             action='validate', status='fail', **handle_fields(sunFailed[consumer.name]))
+                someError = True
+                continue
+            wanted[supplier] = written[supplier]
+        if not wanted:
+            continue
+        if passDeadline is not None and time.monotonic() >= passDeadline:
+            detail = 'Timed out'
+        elif health.down(consumer.uri):
+            detail = health.down(consumer.uri)
+        else:
+            detail = None
+            with limiter.host(consumer.name), trace.span('consumer', 'consumer', consumer=consumer.name):
                 try:
-                    add(connS, entryDN, testEntry, logger)
-                    logger.info('instance="{}" baseDN="{}" host={} action=write status=success'.format(instance, basedn, supplier))
+                    conns[consumer] = pool.get(consumer.uri, consumer.bind, consumer.pwd, consumer.starttls)
+                    events.info(logger, instance=instance, baseDN=basedn, host=consumer.name, action='connect', status='success')
                 except ldap.LDAPError as err:
-                    logger.error('instance="{}" baseDN="{}" host={} action=write status=fail {}'
-                              .format(instance, basedn, supplier, handle_log(err)))
-                    logger.fatal('instance="{}" baseDN="{}" supplier={} action=validate status=fail detail="{}"'
-                              .format(instance, basedn, supplier, "Can't add to the supplier"))
-                    RESULT[instance]['suffixes'][basedn][supplier]['status'] = False
-                    RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                    someError= True
-
-                # Wait to allow replica propagation among consumers
-                time.sleep(sleepTime)
-                # Check the testEntry replica on Consumers
-                for consumer in directoryInstances[instance]['suffixes'][basedn][supplier]['replica']:
-                    for consumer_host, consumer_repl in consumer.items():
-                        # "send update now" for non-always in synch replica
-                        try:
-                            send_update_now(connS, consumer_repl, UPDATE_sleepTime, instance, basedn, supplier, consumer_host, logger)
-                        except sunError as err:
-                            RESULT[instance]['suffixes'][basedn][supplier]['replica'][consumer_host] = False
-                            RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                            someError= True
-                            logger.fatal('instance="{}" baseDN="{}" supplier={} consumer={} action=validate status=fail {}'
-                                    .format(instance, basedn, supplier, consumer_host, handle_log(err)))
-                            continue
-                        # Check if the replica has completed as well
-                        #  Connect on consumer
-                        consumer_uri = "{}://{}:{}".format(directoryInstances[instance]['suffixes'][basedn][supplier]['protocol'], consumer_host,
-                                                           directoryInstances[instance]['suffixes'][basedn][supplier]['port'])
-                        try:
-                            connC = connect(consumer_uri,
-                                    directoryInstances[instance]['suffixes'][basedn][supplier]['bind'],
-                                    directoryInstances[instance]['suffixes'][basedn][supplier]['pwd'], netTimeout, logger)
-                            logger.info('instance="{}" baseDN="{}" host={} action=connect status=success'.format(instance, basedn, consumer_host))
-                        except ldap.LDAPError as err:
-                            logger.error('instance="{}" baseDN="{}" host={} action=connect status=fail {}'
-                                      .format(instance, basedn, consumer_host, handle_log(err)))
-                            RESULT[instance]['suffixes'][basedn][supplier]['replica'][consumer_host] = False
-                            RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                            someError = True
-                            logger.fatal('instance="{}" baseDN="{}" consumer={} action=validate status=fail detail="{}"'
-                                      .format(instance, basedn, consumer_host, "Can't connect"))
-                            continue
-                        except:
-                            print("\n\n Unhandled exception!! \n\n")
-                            logger.fatal('instance="{}" baseDN="{}" host={} action=connect status=fail error="unhandled exception"'
-                                      .format(instance, basedn, consumer_host))
-                            raise
-                            sys.exit(255)
-                        #  Search on the consumer
-                        nentries = None
-                        try:
-                            nentries = search(connC, entryDN, ldap.SCOPE_BASE, 'objectclass=*')
-                            logger.info('instance="{}" baseDN="{}" host={} action=search status=success'.format(instance, basedn, consumer_host))
-                        except ldap.LDAPError as err:
-                            logger.error('instance="{}" baseDN="{}" host={} action=search status=fail {}'
-                                      .format(instance, basedn, consumer_host, handle_log(err)))
-                            RESULT[instance]['suffixes'][basedn][supplier]['replica'][consumer_host] = False
-                            RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                            someError = True
-                        if nentries == 1:
-                            logger.info('instance="{}" baseDN="{}" supplier={} consumer={} action=validate status=success'
-                                     .format(instance, basedn, supplier, consumer_host))
-                            RESULT[instance]['suffixes'][basedn][supplier]['replica'][consumer_host] = True
-                        else:
-                            logger.error('instance="{}" baseDN="{}" supplier={} consumer={} action=validate status=fail detail="{} entries found. Expected 1"'
-                                     .format(instance, basedn, supplier, consumer_host, nentries))
-                            RESULT[instance]['suffixes'][basedn][supplier]['replica'][consumer_host] = False
-                            RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                            someError = True
-                        # Unbind from consumer
-                        try:
-                            connC.unbind_s()
-                            logger.info('instance="{}" baseDN="{}" host={} action=disconnect status=success'.format(instance, basedn, consumer_host))
-                        except:
-                            logger.error('instance="{}" baseDN="{}" host={} action=disconnect status=fail'.format(instance, basedn, consumer_host))
-                            RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                            someError = True
+                    health.failed(consumer.uri, err)
+                    events.error(logger, instance=instance, baseDN=basedn, host=consumer.name,
+                                 action='connect', status='fail', **handle_fields(err))
+                    detail = "Can't connect"
+        if detail is not None:
+            for supplier in wanted:
+                results[supplier]['replica'][consumer.name] = False
+                results[supplier]['detail'][consumer.name] = detail
+                events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer.name,
+                             action='validate', status='fail', detail=detail)
+            someError = True
+            continue
+        edges[consumer] = {}
+        deadlines[consumer] = {}
+        for supplier, probe in wanted.items():
+            dn = probe.dn.lower()
+            edges[consumer][dn] = supplier
+            if agreements[(supplier, consumer.name)] is not None:
+                deadline = probe.forceTime + UPDATE_sleepTime
+            elif convergeTimeout is not None:
+                deadline = probe.writeTime + convergeTimeout
+            else:
+                deadline = 0
+            deadlines[consumer][dn] = capped(deadline, passDeadline)
+            # Keep the configuration order in the result
+            results[supplier]['replica'][consumer.name] = None
+        expected[consumer] = set(edges[consumer])
+        filters[consumer] = batch_filter(rDN, [(probe.value, probe.nonce) for probe in wanted.values()], persistentAttribute)
 
+    found = wait_batch(conns, basedn, filters, expected, deadlines, timeout=netTimeout, until=passDeadline, limiter=limiter)
+    for consumer, (seen, err) in found.items():
+        if err is None:
+            events.info(logger, instance=instance, baseDN=basedn, host=consumer.name, action='search', status='success',
+                        detail='{} of {} entries found'.format(len(seen), len(expected[consumer])))
+        else:
+            events.error(logger, instance=instance, baseDN=basedn, host=consumer.name,
+                         action='search', status='fail', **handle_fields(err))
+            someError = True
+        for dn, supplier in edges[consumer].items():
+            result = results[supplier]
+            if dn in seen:
+                result['replica'][consumer.name] = True
+                if convergeTimeout is not None:
+                    result['latency'][consumer.name] = round(seen[dn] - written[supplier].writeTime, 3)
+                events.info(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer.name,
+                            action='validate', status='success')
+            else:
+                result['replica'][consumer.name] = False
+                result['detail'][consumer.name] = 'Search failed' if err is not None else 'Entry not replicated'
+                events.error(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer.name,
+                             action='validate', status='fail', detail=result['detail'][consumer.name])
+                someError = True
+    return conns, someError
 
-                # Delete the testEntry from the Supplier
-                try:
-                    delete(connS, entryDN, logger)
-                    logger.info('instance="{}" baseDN="{}" host={} action=delete status=success'.format(instance, basedn, supplier))
-                    logger.info('instance="{}" baseDN="{}" supplier={} action=validate status=success'
-                             .format(instance, basedn, supplier))
-                    RESULT[instance]['suffixes'][basedn][supplier]['status'] = True
-                except ldap.LDAPError as err:
-                    logger.error('instance="{}" baseDN="{}" host={} action=delete status=fail {}'
-                              .format(instance, basedn, supplier, handle_log(err)))
-                    RESULT[instance]['suffixes'][basedn][supplier]['status'] = False
-                    RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                    someError = True
-                    logger.fatal('instance="{}" baseDN="{}" supplier={} action=validate status=fail detail="{}"'
-                              .format(instance, basedn, supplier, "Can't delete"))
-                except ldap.NO_SUCH_OBJECT:
-                    logger.error('instance="{}" baseDN="{}" host={} action=delete status=fail error="No such object"'
-                              .format(instance, basedn, supplier))
-                    RESULT[instance]['suffixes'][basedn][supplier]['status'] = False
-                    RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                    someError = True
-                    logger.fatal('instance="{}" baseDN="{}" supplier={} action=validate status=fail detail="{}"'
-                              .format(instance, basedn, supplier, "Can't delete. Deleted already? Unexpected."))
-
-                # If the replica isn't always in synch, try to send update now
-                for consumer in directoryInstances[instance]['suffixes'][basedn][supplier]['replica']:
-                    for consumer_host, consumer_repl in consumer.items():
-                        # "send update now" for non-always in synch replica
-                        try:
-                            send_update_now(connS, consumer_repl, UPDATE_sleepTime, instance, basedn, supplier, consumer_host, logger)
-                        except sunError as err:
-                            RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
-                            someError= True
-
-                # Unbind from Supplier
+def delete_probes(suffix, written, logger, limiter, results):
+    ''' Delete the probe entries of the suppliers, then force their scheduled agreements again. '''
+    instance, basedn = suffix.instance, suffix.basedn
+    someError = False
+    for supplier in suffix.suppliers:
+        if supplier.name not in written:
+            continue
+        connS = written[supplier.name].conn
+        result = results[supplier.name]
+        with limiter.host(supplier.name):
+            try:
+                delete(connS, written[supplier.name].dn, logger)
+                events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='delete', status='success')
+            except ldap.LDAPError as err:
+                events.error(logger, instance=instance, baseDN=basedn, host=supplier.name,
+                             action='delete', status='fail', **handle_fields(err))
+                result.update(status=False, overallStatus=False, error="Can't delete")
+                someError = True
+            agreements = {edge.consumer: edge.agreement for edge in supplier.edges if edge.agreement is not None}
+            if send_updates_now(connS, agreements, instance, basedn, supplier.name, logger):
+                result['overallStatus'] = False
+                someError = True
+    return someError
+
+@trace.traced('suffix', 'suffix', 'suffix')
+def probe_suffix(suffix, rDN, testEntry, runId, netTimeout, sleepTime, UPDATE_sleepTime, logger, limiter=None,
+                 convergeTimeout=None, pool=None, health=None, persistentAttribute=None, passDeadline=None):
+    '''
+    Probe all the suppliers of a suffix with batched verification: all
+    the suppliers write their probe entry and force their scheduled
+    agreements, then, after a single wait, every consumer of the suffix
+    (suffix.consumers, see dsReplTest.plan) is checked with one one
+    level search whose filter ORs all the entries it expects, in place
+    of a base search for every supplier which lists it.
+        suffix - SuffixPlan object instance
+    The other arguments are the ones of probe_supplier.
+
+    This function returns a tuple (results, someError), where results
+    is {supplier: RESULT dictionary of the supplier}. The elapsed time of
+    every supplier is the one of the whole suffix.
+    '''
+    if limiter is None:
+        limiter = HostLimiter()
+    if pool is None:
+        pool = ConnectionPool(netTimeout, reuse=False, logger=logger)
+    if health is None:
+        health = HostHealth()
+    instance, basedn = suffix.instance, suffix.basedn
+    started = time.monotonic()
+    converge = convergeTimeout is not None
+    results = {}
+    for supplier in suffix.suppliers:
+        results[supplier.name] = {'replica': {}, 'detail': {}, 'overallStatus': True}
+        if converge:
+            results[supplier.name]['latency'] = {}
+
+    written, someError = write_probes(suffix, rDN, testEntry, runId, logger, limiter, pool, health,
+                                      persistentAttribute, passDeadline, results)
+    # A single wait for all the suppliers of the suffix, from the last write
+    if written and not converge:
+        with trace.span('TIMEWAIT', 'wait'):
+            lastWrite = max(probe.writeTime for probe in written.values())
+            time.sleep(max(0, capped(lastWrite + sleepTime, passDeadline) - time.monotonic()))
+    conns, err = verify_consumers(suffix, rDN, written, netTimeout, UPDATE_sleepTime, logger, limiter, pool, health,
+                                  convergeTimeout, persistentAttribute, passDeadline, results)
+    someError = someError or err
+
+    if persistentAttribute is None:
+        if delete_probes(suffix, written, logger, limiter, results):
+            someError = True
+        if converge and conns:
+            # Wait until the deletes have reached the consumers
+            deleteTime = time.monotonic()
+            expected = {}
+            deadlines = {}
+            filters = {}
+            for consumer in conns:
+                gone = [probe for supplier, probe in written.items() if results[supplier]['replica'].get(consumer.name)]
+                if gone:
+                    expected[consumer] = {probe.dn.lower() for probe in gone}
+                    deadlines[consumer] = dict.fromkeys(expected[consumer],
+                                                        capped(deleteTime + max(convergeTimeout, UPDATE_sleepTime), passDeadline))
+                    filters[consumer] = batch_filter(rDN, [(probe.value, None) for probe in gone])
+            busy = {consumer: conns[consumer] for consumer in filters}
+            for consumer, (seen, err) in wait_batch(busy, basedn, filters, expected, deadlines, present=False,
+                                                    timeout=netTimeout, until=passDeadline, limiter=limiter).items():
+                if err is not None or len(seen) < len(expected[consumer]):
+                    events.error(logger, instance=instance, baseDN=basedn, host=consumer.name, action='wait delete',
+                                 status='fail', detail='{} entries not deleted'.format(len(expected[consumer]) - len(seen)))
+    for consumer, conn in conns.items():
+        try:
+            pool.release(conn)
+            events.info(logger, instance=instance, baseDN=basedn, host=consumer.name, action='disconnect', status='success')
+        except ldap.LDAPError:
+            events.error(logger, instance=instance, baseDN=basedn, host=consumer.name, action='disconnect', status='fail')
+            someError = True
+
+    elapsed = round(time.monotonic() - started, 3)
+    for supplier in suffix.suppliers:
+        result = results[supplier.name]
+        if supplier.name in written:
+            with limiter.host(supplier.name):
                 try:
-                    connS.unbind_s()
-                    logger.info('instance="{}" baseDN="{}" host={} action=disconnect status=success'.format(instance, basedn, supplier))
-                except:
-                    logger.error('instance="{}" baseDN="{}" host={} action=disconnect status=fail'.format(instance, basedn, supplier))
-                    RESULT[instance]['suffixes'][basedn][supplier]['overallStatus'] = False
+                    pool.release(written[supplier.name].conn)
+                    events.info(logger, instance=instance, baseDN=basedn, host=supplier.name, action='disconnect', status='success')
+                except ldap.LDAPError:
+                    events.error(logger, instance=instance, baseDN=basedn, host=supplier.name, action='disconnect', status='fail')
+                    result['overallStatus'] = False
                     someError = True
+            result.setdefault('status', True)
+        if not all(result['replica'].values()):
+            result['overallStatus'] = False
+        if result['overallStatus']:
+            events.info(logger, instance=instance, baseDN=basedn, supplier=supplier.name, action='validate', status='success',
+                        duration=elapsed)
+        result['elapsed'] = elapsed
+        record_metrics(instance, basedn, supplier.name, result)
+    return results, someError
+
+@trace.traced('pass', 'pass', 'workers')
+def replTest(plan, rDN, testEntry, netTimeout, sleepTime, UPDATE_sleepTime, logger, logout, workers=1, hostLimit=None,
+             convergeTimeout=None, pool=None, runId=None, progress=None, deadline=None, preflight=False,
+             persistentAttribute=None, batch=False):
+    '''
+    Run the replication checks on all the instances.
+        plan - the instances compiled in a Plan (see dsReplTest.plan.compile_plan)
+        workers - max number of suppliers probed at the same time.
+                  With 1 the checks run serially.
+        hostLimit - max concurrent LDAP operations on the same host
+                    (None means no cap)
+        convergeTimeout - poll the consumers up to this number of seconds
+                          instead of sleeping sleepTime (see probe_supplier)
+        pool - ConnectionPool object instance. If None, every connection
+               is opened and closed when needed. All the idle connections
+               of the pool are unbound at the end of the run.
+        runId - ID of the probe entries (see probe_entry). A new one by default.
+        progress - function called after each supplier with (done, total,
+                   instance, basedn, supplier, result), where done and
+                   total count the suppliers
+        deadline - max seconds of the whole run. The suppliers not checked
+                   by then fail as timed out. The running probes stop
+                   waiting at the deadline, and the run returns when
+                   they have deleted their entries.
+                   The probe entries left by runs started more than the
+                   longest pass ago (the deadline, or all the suppliers
+                   in a row, see pass_time) are deleted before the probes.
+        preflight - check once every host of the instances, in parallel,
+                    before the probes (see HostHealth). Either way a host
+                    whose connection fails for a network error is not
+                    tried again during the run.
+        persistentAttribute - probe with a persistent entry per supplier
+                    and suffix, changing the value of this attribute,
+                    in place of the add and delete (see probe_supplier)
+        batch - probe the suppliers of a suffix together and check every
+                consumer with a single search (see probe_suffix). With
+                workers greater than 1 the suffixes run concurrently.
 
+    This function returns a tuple (RESULT, someError).
+    '''
+    if pool is None:
+        pool = ConnectionPool(netTimeout, reuse=False, logger=logger)
+    if runId is None:
+        runId = new_run_id()
+    if progress is None:
+        progress = lambda done, total, instance, basedn, supplier, result: None
+    start = time.monotonic()
+    passDeadline = None if deadline is None else start + deadline
+    # A run younger than a pass can still be running elsewhere: its entries stay
+    sweepAge = pass_time(plan, netTimeout, sleepTime, UPDATE_sleepTime, convergeTimeout)
+    if deadline is not None:
+        sweepAge = min(sweepAge, deadline + 2*netTimeout)
+    health = HostHealth()
+    try:
+        if preflight:
+            health.sweep(plan.hosts, netTimeout, logger)
+        if workers is not None and workers > 1:
+            return replTestConcurrent(plan, rDN, testEntry, netTimeout, sleepTime, UPDATE_sleepTime,
+                                      logger, logout, workers, hostLimit, convergeTimeout, pool, runId, progress, passDeadline,
+                                      health, persistentAttribute, sweepAge, batch)
+        return replTestSerial(plan, rDN, testEntry, netTimeout, sleepTime, UPDATE_sleepTime,
+                              logger, logout, convergeTimeout, pool, runId, progress, passDeadline, health, persistentAttribute,
+                              sweepAge, batch)
+    finally:
+        pool.close()
+        metrics.PASS_SECONDS.observe(time.monotonic() - start)
+        metrics.LAST_PASS.set(time.time())
+
+def replTestSerial(plan, rDN, testEntry, netTimeout, sleepTime, UPDATE_sleepTime, logger, logout,
+                   convergeTimeout=None, pool=None, runId=None, progress=None, passDeadline=None, health=None,
+                   persistentAttribute=None, sweepAge=None, batch=False):
+    '''
+    Check one supplier at a time (one suffix at a time, with batch). See at replTest.
+    A supplier already running when the deadline passes cuts its waits
+    there and deletes its entry (see probe_supplier).
+    '''
+    someError = False
+    total = plan.suppliers()
+    done = 0
+    ''' Initialize the RESULT Dictionary '''
+    RESULT = {}
+    if not logout:
+        mapResult = { True: "\t[  \033[92mOK\033[0m  ]", False: "\t[  \033[91mKO\033[0m  ]" }
+        endStr = ''
+    else:
+        endStr = "\n"
+
+    for instance in plan.instances:
+        with trace.span('instance', 'instance', instance=instance):
+            RESULT[instance] = {}
+            RESULT[instance]['suffixes'] = {}
+            RESULT[instance]['status'] = None
+            print (instance)
+            # Check balancer, if any
+            if instance in plan.balancers:
+                balancer = plan.balancers[instance]
+                print("\t\tChecking balancer access on {}".format(host_uri(balancer, balancer['host'])), end=endStr)
+                status, err = check_balancer(instance, balancer, netTimeout, logger, pool, health)
+                RESULT[instance]['status'] = status
+                someError = someError or err
+                if not logout:
+                    print(mapResult[RESULT[instance]['status']])
+
+            # Perform the replication checks
+            for suffix in plan.suffixes:
+                if suffix.instance != instance:
+                    continue
+                basedn = suffix.basedn
+                with trace.span('suffix', 'suffix', basedn=basedn):
+                    print("\t{}".format(basedn))
+                    RESULT[instance]['suffixes'][basedn] = {}
+                    if sweep_probes(instance, basedn, suffix.suppliers, rDN, testEntry, runId, netTimeout, logger, pool=pool,
+                                    health=health, maxAge=sweepAge):
+                        someError = True
+                    if batch:
+                        if passDeadline is not None and time.monotonic() >= passDeadline:
+                            results = {supplier.name: timed_out(instance, basedn, supplier, logger) for supplier in suffix.suppliers}
+                            someError = True
+                        else:
+                            results, err = probe_suffix(suffix, rDN, testEntry, runId, netTimeout, sleepTime, UPDATE_sleepTime,
+                                                        logger, convergeTimeout=convergeTimeout, pool=pool, health=health,
+                                                        persistentAttribute=persistentAttribute, passDeadline=passDeadline)
+                            someError = someError or err
+                    for supplier in suffix.suppliers:
+                        print("\t\tWorking on supplier {}".format(supplier.name), end=endStr)
+                        if batch:
+                            result, err = results[supplier.name], False
+                        elif passDeadline is not None and time.monotonic() >= passDeadline:
+                            result, err = timed_out(instance, basedn, supplier, logger), True
+                        else:
+                            entryDN, entry = supplier_entry(rDN, testEntry, basedn, runId, supplier.name, persistentAttribute)
+                            result, err = probe_supplier(instance, basedn, supplier,
+                                                         entryDN, entry, netTimeout, sleepTime, UPDATE_sleepTime, logger,
+                                                         convergeTimeout=convergeTimeout, pool=pool, health=health,
+                                                         persistentAttribute=persistentAttribute, passDeadline=passDeadline)
+                        RESULT[instance]['suffixes'][basedn][supplier.name] = result
+                        someError = someError or err
+                        done += 1
+                        progress(done, total, instance, basedn, supplier.name, result)
+                        if not logout:
+                            print(mapResult[RESULT[instance]['suffixes'][basedn][supplier.name]['overallStatus']])
+
+    return RESULT, someError
+
+def supplier_entry(rDN, testEntry, basedn, runId, supplier, persistentAttribute=None):
+    ''' The probe entry of a supplier in a run: the persistent one, with a persistentAttribute. '''
+    if persistentAttribute is None:
+        return probe_entry(rDN, testEntry, basedn, runId, supplier)
+    return persistent_entry(rDN, testEntry, basedn, supplier)
+
+def count_suppliers(directoryInstances):
+    return sum(len(suppliers) for instance in directoryInstances
+               for suppliers in directoryInstances[instance]['suffixes'].values())
+
+def replTestConcurrent(plan, rDN, testEntry, netTimeout, sleepTime, UPDATE_sleepTime, logger, logout, workers, hostLimit=None,
+                       convergeTimeout=None, pool=None, runId=None, progress=None, passDeadline=None, health=None,
+                       persistentAttribute=None, sweepAge=None, batch=False):
+    '''
+    Same as replTest, but the balancers and the suppliers (the suffixes,
+    with batch) are probed
+    concurrently in a pool of "workers" threads. Every supplier writes
+    its own probe entry, so also the suppliers of the same suffix run
+    at the same time. The RESULT dictionary keeps the configuration order.
+    At the deadline the queued probes are cancelled and the running ones
+    fail as timed out. These cut their waits at the deadline too (see
+    probe_supplier): the function returns once they have deleted their
+    entry, so the next pass never finds a probe still running.
+    '''
+    someError = False
+    total = plan.suppliers()
+    done = 0
+    RESULT = {}
+    if not logout:
+        mapResult = { True: "\t[  \033[92mOK\033[0m  ]", False: "\t[  \033[91mKO\033[0m  ]" }
+        endStr = ''
+    else:
+        endStr = "\n"
+    limiter = HostLimiter(hostLimit)
+    jobs = {}
+    pending = set()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for instance in plan.instances:
+            RESULT[instance] = {}
+            RESULT[instance]['suffixes'] = {}
+            RESULT[instance]['status'] = None
+            if instance in plan.balancers:
+                job = executor.submit(check_balancer, instance, plan.balancers[instance], netTimeout, logger, pool, health)
+                jobs[job] = (instance, None, None, None)
+        for suffix in plan.suffixes:
+            instance, basedn = suffix.instance, suffix.basedn
+            # Reserve the keys to keep the configuration order
+            RESULT[instance]['suffixes'][basedn] = dict.fromkeys(supplier.name for supplier in suffix.suppliers)
+            job = executor.submit(sweep_probes, instance, basedn, suffix.suppliers, rDN, testEntry, runId, netTimeout, logger,
+                                  limiter, pool, health, sweepAge)
+            jobs[job] = (instance, basedn, None, None)
+            if batch:
+                job = executor.submit(probe_suffix, suffix, rDN, testEntry, runId, netTimeout, sleepTime, UPDATE_sleepTime,
+                                      logger, limiter, convergeTimeout, pool, health, persistentAttribute, passDeadline)
+                jobs[job] = (instance, basedn, None, suffix)
+                continue
+            for supplier in suffix.suppliers:
+                entryDN, entry = supplier_entry(rDN, testEntry, basedn, runId, supplier.name, persistentAttribute)
+                job = executor.submit(probe_supplier, instance, basedn, supplier, entryDN, entry,
+                                      netTimeout, sleepTime, UPDATE_sleepTime, logger, limiter, convergeTimeout, pool, health,
+                                      persistentAttribute, passDeadline)
+                jobs[job] = (instance, basedn, supplier, None)
+
+        pending = set(jobs)
+        timeout = None if passDeadline is None else max(0, passDeadline - time.monotonic())
+        for job in concurrent.futures.as_completed(jobs, timeout):
+            pending.discard(job)
+            instance, basedn, supplier, suffix = jobs[job]
+            if basedn is None:
+                status, err = job.result()
+                RESULT[instance]['status'] = status
+                someError = someError or err
+                print("{}\tbalancer".format(instance), end=endStr)
+                if not logout:
+                    print(mapResult[status])
+            elif suffix is not None:
+                results, err = job.result()
+                someError = someError or err
+                for supplier in suffix.suppliers:
+                    result = results[supplier.name]
+                    RESULT[instance]['suffixes'][basedn][supplier.name] = result
+                    done += 1
+                    progress(done, total, instance, basedn, supplier.name, result)
+                    print("{}\t{}\tsupplier {}".format(instance, basedn, supplier.name), end=endStr)
+                    if not logout:
+                        print(mapResult[result['overallStatus']])
+            elif supplier is None:
+                # Garbage collection
+                someError = someError or job.result()
+            else:
+                result, err = job.result()
+                RESULT[instance]['suffixes'][basedn][supplier.name] = result
+                someError = someError or err
+                done += 1
+                progress(done, total, instance, basedn, supplier.name, result)
+                print("{}\t{}\tsupplier {}".format(instance, basedn, supplier.name), end=endStr)
+                if not logout:
+                    print(mapResult[result['overallStatus']])
+    except concurrent.futures.TimeoutError:
+        someError = True
+        for job in pending:
+            job.cancel()
+            instance, basedn, supplier, suffix = jobs[job]
+            if basedn is None or (supplier is None and suffix is None):
+                continue
+            for supplier in ([supplier] if suffix is None else suffix.suppliers):
+                result = timed_out(instance, basedn, supplier, logger)
+                RESULT[instance]['suffixes'][basedn][supplier.name] = result
+                done += 1
+                progress(done, total, instance, basedn, supplier.name, result)
+                print("{}\t{}\tsupplier {}".format(instance, basedn, supplier.name), end=endStr)
                 if not logout:
-                    print(mapResult[RESULT[instance]['suffixes'][basedn][supplier]['overallStatus']])
-                time.sleep(sleepTime)
+                    print(mapResult[False])
+    finally:
+        # The running probes end soon after the deadline: wait for their cleanup
+        executor.shutdown(wait=True)
 
     return RESULT, someError
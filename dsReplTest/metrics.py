@@ -0,0 +1,152 @@
+'''
+A small in-memory metric registry, rendered in the Prometheus text
+exposition format. The checks update it as they go, the web server
+only reads the text, which is rebuilt only after an update.
+'''
+import threading
+
+# Buckets (seconds) for LDAP operations and replication latency
+OPERATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PASS_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labelnames, labelvalues, extra=None):
+    pairs = ['{}="{}"'.format(name, escape(value)) for name, value in zip(labelnames, labelvalues)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Gauge:
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def set(self, value, *labelvalues):
+        with self.registry._lock:
+            self._values[labelvalues] = value
+            self.registry._text = None
+
+    def remove(self, *labelvalues):
+        with self.registry._lock:
+            self._values.pop(labelvalues, None)
+            self.registry._text = None
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} gauge'.format(self.name)]
+        for labelvalues, value in self._values.items():
+            lines.append('{}{} {}'.format(self.name, format_labels(self.labelnames, labelvalues), format_value(value)))
+        return lines
+
+class Histogram:
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=OPERATION_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}   # labelvalues -> [bucket counts, sum]
+
+    def observe(self, value, *labelvalues):
+        with self.registry._lock:
+            if labelvalues not in self._values:
+                self._values[labelvalues] = [[0] * len(self.buckets), 0.0]
+            counts = self._values[labelvalues][0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[labelvalues][1] += value
+            self.registry._text = None
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        for labelvalues, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name,
+                             format_labels(self.labelnames, labelvalues, ('le', format_value(bound))), cumulative))
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append('{}_sum{} {}'.format(self.name, labels, format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._metrics = []
+        self._text = None
+
+    def gauge(self, name, documentation, labelnames=()):
+        metric = Gauge(self, name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=OPERATION_BUCKETS):
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        ''' Return the metrics in the Prometheus text format. '''
+        text = self._text
+        if text is None:
+            with self._lock:
+                lines = []
+                for metric in self._metrics:
+                    lines.extend(metric.render())
+                text = self._text = '\n'.join(lines) + '\n'
+        return text
+
+REGISTRY = Registry()
+
+PROBE_STATUS = REGISTRY.gauge('dsrepltest_probe_status',
+    'Last check of the replica from a supplier to a consumer (1 success, 0 fail).',
+    ('instance', 'suffix', 'supplier', 'consumer'))
+PROBE_LAST_SUCCESS = REGISTRY.gauge('dsrepltest_probe_last_success_timestamp_seconds',
+    'Unix time of the last successful check of the replica from a supplier to a consumer.',
+    ('instance', 'suffix', 'supplier', 'consumer'))
+SUPPLIER_STATUS = REGISTRY.gauge('dsrepltest_supplier_status',
+    'Overall status of the last check of a supplier (1 success, 0 fail).',
+    ('instance', 'suffix', 'supplier'))
+BALANCER_STATUS = REGISTRY.gauge('dsrepltest_balancer_status',
+    'Last check of the balancer of an instance (1 success, 0 fail).',
+    ('instance',))
+OPERATION_SECONDS = REGISTRY.histogram('dsrepltest_ldap_operation_duration_seconds',
+    'Duration of the LDAP operations performed by the checks.',
+    ('operation',), OPERATION_BUCKETS)
+REPLICATION_LATENCY = REGISTRY.histogram('dsrepltest_replication_latency_seconds',
+    'Time from the write on the supplier until the entry is found on the consumer (convergence mode).',
+    ('instance', 'suffix', 'supplier', 'consumer'), LATENCY_BUCKETS)
+REPLICATION_LAG = REGISTRY.gauge('dsrepltest_replication_lag_seconds',
+    'Age of the newest change of the supplier not yet applied by the consumer, from the RUVs (passive mode).',
+    ('instance', 'suffix', 'supplier', 'consumer'))
+PASSIVE_STATUS = REGISTRY.gauge('dsrepltest_passive_status',
+    'Last passive check (RUVs and agreement status) of the replica from a supplier to a consumer (1 success, 0 fail).',
+    ('instance', 'suffix', 'supplier', 'consumer'))
+PASSIVE_LAST_SUCCESS = REGISTRY.gauge('dsrepltest_passive_last_success_timestamp_seconds',
+    'Unix time of the last successful passive check of the replica from a supplier to a consumer.',
+    ('instance', 'suffix', 'supplier', 'consumer'))
+PASSIVE_SUPPLIER_STATUS = REGISTRY.gauge('dsrepltest_passive_supplier_status',
+    'Overall status of the last passive check of a supplier (1 success, 0 fail).',
+    ('instance', 'suffix', 'supplier'))
+PASS_SECONDS = REGISTRY.histogram('dsrepltest_pass_duration_seconds',
+    'Duration of a whole pass of checks.',
+    (), PASS_BUCKETS)
+LAST_PASS = REGISTRY.gauge('dsrepltest_last_pass_timestamp_seconds',
+    'Unix time of the end of the last pass of checks.')
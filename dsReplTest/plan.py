@@ -0,0 +1,165 @@
+'''
+Compiled probe plan.
+
+compile_plan() turns INSTANCES into a compact plan: the distinct hosts,
+and for every suffix the suppliers (URI and bind), the edges supplier ->
+consumer with the consumer URI and the DN of the scheduled agreement,
+if any, and the distinct consumers with the suppliers they get entries
+from. The Config compiles a plan per instance when the file is read
+(see merge_plans), and replTest walks it, so the URIs and the
+credentials are built once, not for every probe.
+'''
+import urllib.parse
+
+def host_uri(conf, host, consumer=False):
+  """
+  Return the LDAP URI of host, reached as conf says.
+    conf - a supplier, balancer or discover section (dict):
+             protocol - ldap, ldaps or ldapi
+             port - the TCP port (with ldapi it's for the consumers only)
+             socket - with ldapi, the path of the local socket
+    consumer - True if host is a consumer of the supplier section conf.
+               An ldapi socket is local to its supplier: the consumers
+               are reached with ldap on port.
+  """
+  if conf['protocol'] != 'ldapi':
+    return "{}://{}:{}".format(conf['protocol'], host, conf['port'])
+  if consumer:
+    return "ldap://{}:{}".format(host, conf['port'])
+  return "ldapi://{}".format(urllib.parse.quote(conf['socket'], safe=''))
+
+def host_uris(directoryInstances):
+    '''
+    Collect every distinct host of the instances: balancers, suppliers
+    and consumers (with the protocol and port of their supplier, see
+    host_uri).
+    This function returns {ldapuri: (protocol, host, port)}.
+    '''
+    uris = {}
+    for conf in directoryInstances.values():
+        balancer = conf.get('balancer')
+        if balancer is not None:
+            uris.setdefault(host_uri(balancer, balancer['host']), (balancer['protocol'], balancer['host'], balancer['port']))
+        for suppliers in conf['suffixes'].values():
+            for supplier, supplierConf in suppliers.items():
+                uris.setdefault(host_uri(supplierConf, supplier), (supplierConf['protocol'], supplier, supplierConf['port']))
+                for consumer in supplierConf['replica']:
+                    for consumer_host in consumer:
+                        uri = host_uri(supplierConf, consumer_host, consumer=True)
+                        uris.setdefault(uri, (uri.split(':', 1)[0], consumer_host, supplierConf['port']))
+    return uris
+
+class Edge:
+    '''
+        uri - LDAP URI of the consumer (see host_uri)
+        agreement - DN of the scheduled agreement (None if always in synch)
+    '''
+    __slots__ = ('supplier', 'consumer', 'uri', 'agreement')
+
+    def __init__(self, supplier, consumer, uri, agreement=None):
+        self.supplier = supplier
+        self.consumer = consumer
+        self.uri = uri
+        self.agreement = agreement
+
+class SupplierPlan:
+    '''
+        conf - the supplier section of the suffix
+    '''
+    __slots__ = ('name', 'uri', 'bind', 'pwd', 'starttls', 'conf', 'edges')
+
+    def __init__(self, name, conf):
+        self.name = name
+        self.uri = host_uri(conf, name)
+        self.bind = conf['bind']
+        self.pwd = conf['pwd']
+        self.starttls = conf.get('starttls', False)
+        self.conf = conf
+        self.edges = []
+
+    def __str__(self):
+        return self.name
+
+class ConsumerPlan:
+    '''
+    A consumer is reached with the protocol, port and bind of its
+    suppliers: the ones with a different bind (or StartTLS) get a
+    ConsumerPlan each.
+        suppliers - names of the suppliers which replicate to it
+    '''
+    __slots__ = ('name', 'uri', 'bind', 'pwd', 'starttls', 'suppliers')
+
+    def __init__(self, name, uri, bind, pwd, starttls=False):
+        self.name = name
+        self.uri = uri
+        self.bind = bind
+        self.pwd = pwd
+        self.starttls = starttls
+        self.suppliers = []
+
+class SuffixPlan:
+    __slots__ = ('instance', 'basedn', 'suppliers', 'consumers')
+
+    def __init__(self, instance, basedn, suppliers=(), consumers=()):
+        self.instance = instance
+        self.basedn = basedn
+        self.suppliers = list(suppliers)
+        self.consumers = list(consumers)
+
+    def __str__(self):
+        return '{} {}'.format(self.instance, self.basedn)
+
+class Plan:
+    '''
+        instances - the instance names, in the configuration order
+        hosts - {ldapuri: (protocol, host, port)} (see host_uris)
+        balancers - {instance: balancer section}
+        suffixes - list of SuffixPlan, in the configuration order
+    '''
+    __slots__ = ('instances', 'hosts', 'balancers', 'suffixes')
+
+    def __init__(self, instances, hosts, balancers, suffixes):
+        self.instances = instances
+        self.hosts = hosts
+        self.balancers = balancers
+        self.suffixes = suffixes
+
+    def suppliers(self):
+        ''' The number of suppliers to probe. '''
+        return sum(len(suffix.suppliers) for suffix in self.suffixes)
+
+def compile_plan(directoryInstances):
+    ''' Build the Plan of the instances. '''
+    balancers = {}
+    suffixes = []
+    for instance, conf in directoryInstances.items():
+        if conf.get('balancer') is not None:
+            balancers[instance] = conf['balancer']
+        for basedn, suppliers in conf['suffixes'].items():
+            suffix = SuffixPlan(instance, basedn)
+            consumers = {}
+            for supplier, supplierConf in suppliers.items():
+                supplierPlan = SupplierPlan(supplier, supplierConf)
+                for consumer in supplierConf['replica']:
+                    for consumer_host, consumer_repl in consumer.items():
+                        uri = host_uri(supplierConf, consumer_host, consumer=True)
+                        supplierPlan.edges.append(Edge(supplier, consumer_host, uri, consumer_repl))
+                        key = (uri, supplierConf['bind'], supplierConf.get('starttls', False))
+                        if key not in consumers:
+                            consumers[key] = ConsumerPlan(consumer_host, uri, supplierConf['bind'], supplierConf['pwd'], key[2])
+                        consumers[key].suppliers.append(supplier)
+                suffix.suppliers.append(supplierPlan)
+            suffix.consumers = list(consumers.values())
+            suffixes.append(suffix)
+    return Plan(list(directoryInstances), host_uris(directoryInstances), balancers, suffixes)
+
+def merge_plans(plans):
+    ''' Join the Plans of some instances in a single Plan. '''
+    merged = Plan([], {}, {}, [])
+    for plan in plans:
+        merged.instances.extend(plan.instances)
+        for uri, host in plan.hosts.items():
+            merged.hosts.setdefault(uri, host)
+        merged.balancers.update(plan.balancers)
+        merged.suffixes.extend(plan.suffixes)
+    return merged
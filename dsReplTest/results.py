@@ -0,0 +1,203 @@
+'''
+The result model of a pass of checks.
+
+replTest and passiveTest build a RESULT dictionary while they run.
+from_result() turns it into a tree of small records (instance, suffix,
+supplier and consumer) with status, timings and error detail, which the
+web page walks and the JSON API serializes.
+'''
+import json
+
+class ConsumerResult:
+    __slots__ = ('name', 'status', 'latency', 'lag', 'detail')
+
+    def __init__(self, name, status, latency=None, lag=None, detail=None):
+        self.name = name
+        self.status = status
+        self.latency = latency
+        self.lag = lag
+        self.detail = detail
+
+    def as_dict(self):
+        return {'name': self.name, 'status': self.status, 'latency': self.latency,
+                'lag': self.lag, 'detail': self.detail}
+
+class SupplierResult:
+    '''
+        status - the write and delete on the supplier succeeded
+        overallStatus - status and all the consumers succeeded
+        elapsed - seconds spent on the supplier and its consumers
+    '''
+    __slots__ = ('name', 'status', 'overallStatus', 'elapsed', 'error', 'consumers')
+
+    def __init__(self, name, status, overallStatus, elapsed=None, error=None, consumers=()):
+        self.name = name
+        self.status = status
+        self.overallStatus = overallStatus
+        self.elapsed = elapsed
+        self.error = error
+        self.consumers = list(consumers)
+
+    def as_dict(self):
+        return {'name': self.name, 'status': self.status, 'overallStatus': self.overallStatus,
+                'elapsed': self.elapsed, 'error': self.error,
+                'consumers': [consumer.as_dict() for consumer in self.consumers]}
+
+class SuffixResult:
+    __slots__ = ('basedn', 'suppliers')
+
+    def __init__(self, basedn, suppliers=()):
+        self.basedn = basedn
+        self.suppliers = list(suppliers)
+
+    @property
+    def status(self):
+        return all(supplier.overallStatus for supplier in self.suppliers)
+
+    def as_dict(self):
+        return {'basedn': self.basedn, 'status': self.status,
+                'suppliers': [supplier.as_dict() for supplier in self.suppliers]}
+
+class InstanceResult:
+    '''
+        balancer - status of the balancer check (None if no balancer)
+        passive - the results come from the passive RUV check
+    '''
+    __slots__ = ('name', 'balancer', 'suffixes', 'passive')
+
+    def __init__(self, name, balancer=None, suffixes=(), passive=False):
+        self.name = name
+        self.balancer = balancer
+        self.suffixes = list(suffixes)
+        self.passive = passive
+
+    @property
+    def status(self):
+        return self.balancer is not False and all(suffix.status for suffix in self.suffixes)
+
+    def as_dict(self):
+        return {'name': self.name, 'passive': self.passive, 'balancer': self.balancer, 'status': self.status,
+                'suffixes': [suffix.as_dict() for suffix in self.suffixes]}
+
+def supplier_result(name, result):
+    ''' Build a SupplierResult from the result dictionary of a supplier. '''
+    latency = result.get('latency', {})
+    lag = result.get('lag', {})
+    detail = result.get('detail', {})
+    consumers = [ConsumerResult(consumer, status, latency.get(consumer), lag.get(consumer), detail.get(consumer))
+                 for consumer, status in result['replica'].items()]
+    return SupplierResult(name, result.get('status'), result['overallStatus'], result.get('elapsed'),
+                          result.get('error'), consumers)
+
+def instance_result(name, value, passive=False):
+    ''' Build an InstanceResult from the RESULT value of an instance. '''
+    suffixes = []
+    for basedn, suppliers in value['suffixes'].items():
+        suffixes.append(SuffixResult(basedn, [supplier_result(supplier, result)
+                                              for supplier, result in suppliers.items() if result is not None]))
+    return InstanceResult(name, value['status'], suffixes, passive)
+
+def from_result(RESULT, passive=False):
+    '''
+    Build the result model from a RESULT dictionary.
+        passive - RESULT comes from the passive RUV check
+    This function returns a list of InstanceResult, in the RESULT order.
+    '''
+    return [instance_result(instance, value, passive) for instance, value in RESULT.items()]
+
+def to_json(instances, someError, testdate):
+    ''' Serialize the result model of a snapshot. '''
+    return json.dumps({'testdate': testdate.isoformat() if testdate else None,
+                       'status': None if testdate is None else not someError,
+                       'instances': [instance.as_dict() for instance in instances]})
+
+# Exit codes of the monitoring plugins
+OK, WARNING, CRITICAL, UNKNOWN = 0, 1, 2, 3
+STATES = {OK: 'OK', WARNING: 'WARNING', CRITICAL: 'CRITICAL', UNKNOWN: 'UNKNOWN'}
+
+def slow(consumer, warnLatency):
+    ''' True if the latency (or the lag) of a replicated consumer reaches warnLatency seconds. '''
+    if warnLatency is None or not consumer.status:
+        return False
+    return any(value is not None and value >= warnLatency for value in (consumer.latency, consumer.lag))
+
+def pairs(instances, warnLatency=None):
+    '''
+    Flatten the result model in supplier -> consumer pairs.
+    This function returns a list of dictionaries.
+    '''
+    return [{'instance': instance.name, 'basedn': suffix.basedn, 'supplier': supplier.name, 'consumer': consumer.name,
+             'status': consumer.status, 'latency': consumer.latency, 'lag': consumer.lag, 'detail': consumer.detail,
+             'slow': slow(consumer, warnLatency)}
+            for instance in instances for suffix in instance.suffixes
+            for supplier in suffix.suppliers for consumer in supplier.consumers]
+
+def state(instances, someError, warnLatency=None):
+    '''
+    The monitoring state of a pass: CRITICAL if a balancer, a supplier
+    or a pair failed, WARNING if a pair is slower than warnLatency or if
+    some other error occurred (discovery, garbage collection...), else OK.
+    '''
+    if not all(instance.status for instance in instances):
+        return CRITICAL
+    if someError or any(pair['slow'] for pair in pairs(instances, warnLatency)):
+        return WARNING
+    return OK
+
+def to_report(instances, someError, testdate, warnLatency=None):
+    '''
+    Serialize a pass for the --format json output: the state, the
+    balancers, the suppliers and every pair. See the README.
+    '''
+    code = state(instances, someError, warnLatency)
+    allPairs = pairs(instances, warnLatency)
+    return json.dumps({
+        'testdate': testdate.isoformat() if testdate else None,
+        'state': STATES[code],
+        'code': code,
+        'summary': {'pairs': len(allPairs), 'failed': sum(1 for pair in allPairs if not pair['status']),
+                    'slow': sum(1 for pair in allPairs if pair['slow'])},
+        'balancers': [{'instance': instance.name, 'status': instance.balancer}
+                      for instance in instances if instance.balancer is not None],
+        'suppliers': [{'instance': instance.name, 'basedn': suffix.basedn, 'supplier': supplier.name,
+                       'status': supplier.status, 'overallStatus': supplier.overallStatus,
+                       'elapsed': supplier.elapsed, 'error': supplier.error}
+                      for instance in instances for suffix in instance.suffixes for supplier in suffix.suppliers],
+        'pairs': allPairs}, indent=1)
+
+def to_nagios(instances, someError, warnLatency=None):
+    '''
+    Format a pass as the output of a monitoring plugin: a status line
+    with the failures and the performance data of every pair.
+    This function returns a tuple (text, exit code).
+    '''
+    code = state(instances, someError, warnLatency)
+    allPairs = pairs(instances, warnLatency)
+    problems = []
+    for instance in instances:
+        if instance.balancer is False:
+            problems.append('{} balancer'.format(instance.name))
+        for suffix in instance.suffixes:
+            for supplier in suffix.suppliers:
+                if supplier.error:
+                    problems.append('{} {} ({})'.format(supplier.name, suffix.basedn, supplier.error))
+    for pair in allPairs:
+        if not pair['status']:
+            problems.append('{}->{} {}{}'.format(pair['supplier'], pair['consumer'], pair['basedn'],
+                                                 ' ({})'.format(pair['detail']) if pair['detail'] else ''))
+        elif pair['slow']:
+            problems.append('{}->{} {} slow'.format(pair['supplier'], pair['consumer'], pair['basedn']))
+    failed = sum(1 for pair in allPairs if not pair['status'])
+    line = 'DSREPLTEST {} - {} of {} pairs failed'.format(STATES[code], failed, len(allPairs))
+    if problems:
+        line += ': ' + ', '.join(problems)
+    elif code == WARNING:
+        line += ': some errors occurred, see the log'
+    warn = '' if warnLatency is None else warnLatency
+    perfdata = ['pairs={}'.format(len(allPairs)), 'failed={};;1'.format(failed)]
+    for pair in allPairs:
+        value = pair['latency'] if pair['latency'] is not None else pair['lag']
+        if value is not None:
+            label = '{}_{}_{}'.format(pair['supplier'], pair['consumer'], pair['basedn']).replace("'", '').replace('=', '_')
+            perfdata.append("'{}'={}s;{}".format(label, value, warn))
+    return '{} | {}'.format(line, ' '.join(perfdata)), code
@@ -0,0 +1,246 @@
+'''
+Passive replication check, without any write.
+
+Every replica keeps a Replica Update Vector (RUV) on the tombstone entry
+at the top of the suffix: for each replica ID it stores the CSN of the
+last change it has seen. The RUV of every host of a suffix is read once
+and compared with the RUV of each supplier: the lag of a consumer is the
+time between the newest change known by the supplier and the newest one
+already applied by the consumer. The status of the agreements
+(nsds5replicaLastUpdateStatus) is read on the suppliers too.
+'''
+import re
+import time
+import concurrent.futures
+import ldap
+import ldap.filter
+import dsReplTest.ldap as myldap
+import dsReplTest.events as events
+import dsReplTest.metrics as metrics
+
+RUV_FILTER = '(&(nsuniqueid=ffffffff-ffffffff-ffffffff-ffffffff)(objectclass=nstombstone))'
+AGREEMENT_FILTER = '(&(objectClass=nsds5ReplicationAgreement)(nsDS5ReplicaRoot={}))'
+AGREEMENT_ATTRS = ['nsDS5ReplicaHost', 'nsds5replicaLastUpdateStatus', 'nsds5replicaLastUpdateEnd']
+# {replica 1 ldap://host:389} <min CSN> <max CSN>
+RUV_ELEMENT = re.compile(r'^\{replica (\d+)(?: ([^}]*))?\}(?: (\w+))?(?: (\w+))?')
+# "Error (0) Replica acquired successfully..." or "0 Replica acquired successfully..."
+UPDATE_STATUS = re.compile(r'^(?:Error \()?(-?\d+)\)?')
+
+def csn_time(csn):
+    ''' Return the unix time of a CSN (the first 8 hex digits). '''
+    return int(csn[:8], 16)
+
+def parse_ruv(values):
+    '''
+    Parse the nsds50ruv values.
+        values - list of bytes
+
+    This function returns a dictionary {replica ID: max CSN}. The
+    replicas which haven't sent any change have no max CSN (None).
+    '''
+    ruv = {}
+    for value in values:
+        match = RUV_ELEMENT.match(value.decode('utf-8'))
+        if match:
+            ruv[int(match.group(1))] = match.group(4)
+    return ruv
+
+def read_ruv(conn, basedn):
+    ''' Read the RUV of a suffix. This function returns the dictionary of parse_ruv. '''
+    for dn, attrs in conn.search_s(basedn, ldap.SCOPE_SUBTREE, RUV_FILTER, ['nsds50ruv']):
+        if dn is not None:
+            for key in attrs:
+                if key.lower() == 'nsds50ruv':
+                    return parse_ruv(attrs[key])
+    return {}
+
+def read_update_status(conn, basedn):
+    '''
+    Read the status of the agreements of a suffix on a supplier.
+
+    This function returns a dictionary {consumer: (code, detail, end)},
+    where code is the result of the last update session (0 is success)
+    and end its generalized time.
+    '''
+    agreements = {}
+    attrfilter = AGREEMENT_FILTER.format(ldap.filter.escape_filter_chars(basedn))
+    for dn, attrs in conn.search_s('cn=mapping tree,cn=config', ldap.SCOPE_SUBTREE, attrfilter, AGREEMENT_ATTRS):
+        if dn is None:
+            continue
+        values = {key.lower(): attrs[key][0].decode('utf-8') for key in attrs if attrs[key]}
+        detail = values.get('nsds5replicalastupdatestatus', '')
+        match = UPDATE_STATUS.match(detail)
+        code = int(match.group(1)) if match else None
+        agreements[values.get('nsds5replicahost', '').lower()] = (code, detail, values.get('nsds5replicalastupdateend'))
+    return agreements
+
+def consumer_lag(supplierRuv, consumerRuv):
+    '''
+    Return the lag in seconds of a consumer, or None if the consumer
+    misses a replica ID known by the supplier.
+    '''
+    lag = 0
+    for rid, maxcsn in supplierRuv.items():
+        if maxcsn is None:
+            continue
+        if consumerRuv.get(rid) is None:
+            return None
+        if consumerRuv[rid] < maxcsn:
+            lag = max(lag, csn_time(maxcsn) - csn_time(consumerRuv[rid]))
+    return lag
+
+def passive_suffix(instance, basedn, suppliers, netTimeout, maxLag, logger, limiter=None, pool=None):
+    '''
+    Check the replica of a suffix through the RUVs.
+        suppliers - the suffix section of the instance (dict)
+        maxLag - max lag in seconds of an always in synch consumer.
+                 Scheduled consumers are checked on the agreement status only.
+
+    Every host is read once: the RUV on the consumers, the RUV and the
+    agreements on the suppliers.
+
+    This function returns a tuple (results, someError), where results
+    is {supplier: result} and result has the same keys of probe_supplier
+    plus "lag" ({consumer: seconds}).
+    '''
+    if limiter is None:
+        limiter = myldap.HostLimiter()
+    if pool is None:
+        pool = myldap.ConnectionPool(netTimeout, reuse=False, logger=logger)
+    someError = False
+    ruvs = {}
+    updates = {}
+    hosts = {}
+    for supplier, supplierConf in suppliers.items():
+        hosts[supplier] = myldap.host_uri(supplierConf, supplier), supplierConf
+    for supplier, supplierConf in suppliers.items():
+        for consumer in supplierConf['replica']:
+            for consumer_host in consumer:
+                hosts.setdefault(consumer_host, (myldap.host_uri(supplierConf, consumer_host, consumer=True), supplierConf))
+    for host, (uri, conf) in hosts.items():
+        with limiter.host(host):
+            try:
+                conn = pool.get(uri, conf['bind'], conf['pwd'], conf.get('starttls', False))
+            except ldap.LDAPError as err:
+                events.error(logger, instance=instance, baseDN=basedn, host=host,
+                             action='connect', status='fail', **myldap.handle_fields(err))
+                someError = True
+                continue
+            try:
+                ruvs[host] = read_ruv(conn, basedn)
+                events.info(logger, instance=instance, baseDN=basedn, host=host,
+                            action='read ruv', status='success', detail='{} replica IDs found'.format(len(ruvs[host])))
+                if host in suppliers:
+                    updates[host] = read_update_status(conn, basedn)
+                pool.release(conn)
+            except ldap.LDAPError as err:
+                events.error(logger, instance=instance, baseDN=basedn, host=host,
+                             action='read ruv', status='fail', **myldap.handle_fields(err))
+                pool.discard(conn)
+                someError = True
+
+    results = {}
+    for supplier, supplierConf in suppliers.items():
+        result = {'replica': {}, 'lag': {}, 'detail': {}, 'overallStatus': True, 'status': supplier in ruvs}
+        if not result['status']:
+            result['overallStatus'] = False
+            result['error'] = "Can't read the RUV"
+            events.fatal(logger, instance=instance, baseDN=basedn, supplier=supplier,
+                         action='validate', status='fail', detail="Can't read the RUV")
+        for consumer in supplierConf['replica']:
+            for consumer_host, consumer_repl in consumer.items():
+                status = True
+                detail = None
+                if supplier not in ruvs or consumer_host not in ruvs:
+                    status = False
+                    detail = "Can't read the RUV"
+                else:
+                    lag = consumer_lag(ruvs[supplier], ruvs[consumer_host])
+                    if lag is None:
+                        status = False
+                        detail = 'Replica ID missing on the consumer'
+                    else:
+                        result['lag'][consumer_host] = lag
+                        if consumer_repl is None and lag > maxLag:
+                            status = False
+                            detail = 'Lag of {}s'.format(lag)
+                    code, update, end = updates.get(supplier, {}).get(consumer_host.lower(), (0, None, None))
+                    if status and code not in (0, None):
+                        status = False
+                        detail = 'Last update at {}: {}'.format(end, update)
+                result['replica'][consumer_host] = status
+                if status:
+                    events.info(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer_host,
+                                action='validate ruv', status='success', lag=result['lag'][consumer_host])
+                else:
+                    result['detail'][consumer_host] = detail
+                    result['overallStatus'] = False
+                    someError = True
+                    events.error(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer_host,
+                                 action='validate ruv', status='fail', detail=detail.replace('"', "'"))
+        myldap.record_metrics(instance, basedn, supplier, result, passive=True)
+        results[supplier] = result
+    return results, someError
+
+def passiveTest(directoryInstances, netTimeout, maxLag, logger, logout, workers=1, hostLimit=None, pool=None, progress=None):
+    '''
+    Run the passive checks on all the instances. The suffixes are
+    checked concurrently in a pool of "workers" threads. The balancers
+    and the progress function are as in replTest.
+
+    This function returns a tuple (RESULT, someError), with the same
+    layout of replTest.
+    '''
+    if pool is None:
+        pool = myldap.ConnectionPool(netTimeout, reuse=False, logger=logger)
+    if not logout:
+        mapResult = { True: "\t[  \033[92mOK\033[0m  ]", False: "\t[  \033[91mKO\033[0m  ]" }
+        endStr = ''
+    else:
+        endStr = "\n"
+    someError = False
+    RESULT = {}
+    limiter = myldap.HostLimiter(hostLimit)
+    jobs = {}
+    total = myldap.count_suppliers(directoryInstances)
+    done = 0
+    start = time.monotonic()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers or 1, 1)) as executor:
+            for instance in directoryInstances:
+                RESULT[instance] = {'suffixes': {}, 'status': None}
+                if directoryInstances[instance].get('balancer') is not None:
+                    job = executor.submit(myldap.check_balancer, instance, directoryInstances[instance]['balancer'],
+                                          netTimeout, logger, pool)
+                    jobs[job] = (instance, None)
+                for basedn in directoryInstances[instance]['suffixes']:
+                    RESULT[instance]['suffixes'][basedn] = dict.fromkeys(directoryInstances[instance]['suffixes'][basedn])
+                    job = executor.submit(passive_suffix, instance, basedn, directoryInstances[instance]['suffixes'][basedn],
+                                          netTimeout, maxLag, logger, limiter, pool)
+                    jobs[job] = (instance, basedn)
+
+            for job in concurrent.futures.as_completed(jobs):
+                instance, basedn = jobs[job]
+                if basedn is None:
+                    status, err = job.result()
+                    RESULT[instance]['status'] = status
+                    someError = someError or err
+                    print("{}\tbalancer".format(instance), end=endStr)
+                    if not logout:
+                        print(mapResult[status])
+                    continue
+                results, err = job.result()
+                RESULT[instance]['suffixes'][basedn].update(results)
+                someError = someError or err
+                for supplier, result in results.items():
+                    done += 1
+                    if progress:
+                        progress(done, total, instance, basedn, supplier, result)
+                    print("{}\t{}\tsupplier {} (ruv)".format(instance, basedn, supplier), end=endStr)
+                    if not logout:
+                        print(mapResult[result['overallStatus']])
+    finally:
+        pool.close()
+        metrics.PASS_SECONDS.observe(time.monotonic() - start)
+        metrics.LAST_PASS.set(time.time())
+    return RESULT, someError
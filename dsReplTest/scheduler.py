@@ -0,0 +1,247 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+import dsReplTest.results as results
+
+class ResultStore:
+    '''
+    Keep the results of the last passes for the web server.
+
+    Every update builds a new snapshot and swaps it in one assignment,
+    so readers always see a consistent one without locking.
+    A pass may cover only some instances (staggered schedule): its
+    results replace those instances only. The results of the write
+    probe and of the passive check are kept apart, each one with its
+    own error flag, and the snapshot shows both.
+    The snapshot holds the result model (see dsReplTest.results). Its
+    renderings (JSON, HTML...) are built on the first request after a
+    pass and cached until the next one.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._errors = {}
+        self._result = {}
+        self._snapshot = ([], None, None)
+        self._rendered = {}
+        self.version = 0
+
+    def update(self, result, someError, when=None, passive=False):
+        '''
+        Merge the RESULT dictionary of a pass.
+            someError - the error flag of the pass
+            when - datetime of the end of pass (now by default)
+            passive - the pass is a passive RUV check
+        '''
+        if when is None:
+            when = datetime.now()
+        with self._lock:
+            # Keyed by (instance, passive)
+            merged = dict(self._result)
+            for instance, value in result.items():
+                merged[(instance, passive)] = value
+                self._errors[(instance, passive)] = someError
+            self._result = merged
+            # The write probes first, then the passive checks
+            instances = [results.instance_result(instance, merged[(instance, mode)], mode)
+                         for (instance, mode) in sorted(merged, key=lambda key: key[1])]
+            self._snapshot = (instances, any(self._errors.values()), when)
+            self._rendered = {}
+            self.version += 1
+
+    def snapshot(self):
+        ''' Return a tuple (instances, someError, testdate), instances is a list of InstanceResult. '''
+        return self._snapshot
+
+    def rendered(self, name, render):
+        '''
+        Return the rendering "name" of the last snapshot, calling
+        render(instances, someError, testdate) only once per pass.
+        This function returns a tuple (text, version).
+        '''
+        with self._lock:
+            snapshot, version = self._snapshot, self.version
+            text = self._rendered.get(name)
+        if text is None:
+            text = render(*snapshot)
+            with self._lock:
+                if version == self.version:
+                    self._rendered[name] = text
+        return text, version
+
+    def json(self):
+        ''' Return the last snapshot serialized in JSON. '''
+        return self.rendered('json', results.to_json)[0]
+
+class Broadcaster:
+    '''
+    Push the events of the running passes to the web clients
+    (Server-Sent Events). Every client has its own bounded queue: a
+    slow client loses events, and never slows the checks.
+        maxClients - max clients at the same time (None means no cap)
+    '''
+    def __init__(self, maxsize=1000, maxClients=None):
+        self.maxsize = maxsize
+        self.maxClients = maxClients
+        self._lock = threading.Lock()
+        self._clients = set()
+
+    def subscribe(self):
+        ''' Add a client. This method returns its queue, or None if there are already maxClients. '''
+        client = queue.Queue(self.maxsize)
+        with self._lock:
+            if self.maxClients is not None and len(self._clients) >= self.maxClients:
+                return None
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, event, data):
+        ''' Send an event (name and JSON serializable data) to all the clients. '''
+        message = 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data, default=str))
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def stream(self, client, keepalive=15):
+        ''' Yield the messages of a client, with a comment every keepalive seconds. '''
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    yield client.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(client)
+
+class Scheduler(threading.Thread):
+    '''
+    Run the replication checks every "interval" seconds in background.
+        directoryInstances - the INSTANCES section of the config (dict)
+        runPass - function called with a subset of directoryInstances.
+                  It runs the checks and stores the results.
+        stagger - if True each instance has its own timer, and the
+                  instances are spread evenly along the interval.
+
+    Every pass runs in its own thread. A pass is skipped if one of its
+    suffixes is still checked by a previous pass.
+    '''
+    def __init__(self, directoryInstances, interval, runPass, stagger=False, logger=None):
+        super().__init__(name='ds-repltest scheduler', daemon=True)
+        self.interval = interval
+        self.runPass = runPass
+        self.stagger = stagger
+        self.logger = logger
+        self._halt = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._busy = set()
+        self.jobs = self._plan(directoryInstances, {})
+
+    def _plan(self, directoryInstances, nexts):
+        '''
+        Return the jobs for directoryInstances. nexts maps the instances
+        already scheduled to their next run, which is kept.
+        '''
+        if not directoryInstances or not self.interval:
+            # Without an interval only the passes started by launch() run
+            return []
+        start = time.monotonic() + self.interval
+        if self.stagger:
+            step = self.interval / len(directoryInstances)
+            return [{'instances': {instance: directoryInstances[instance]}, 'next': nexts.get(instance, start + i*step)}
+                    for i, instance in enumerate(directoryInstances)]
+        return [{'instances': directoryInstances, 'next': min(nexts.values(), default=start)}]
+
+    def reschedule(self, directoryInstances):
+        ''' Replace the instances to check, from the next passes on. '''
+        nexts = {}
+        for job in self.jobs:
+            for instance in job['instances']:
+                nexts[instance] = job['next']
+        self.jobs = self._plan(directoryInstances, nexts)
+        self._wake.set()
+
+    def run(self):
+        while not self._halt.is_set():
+            now = time.monotonic()
+            jobs = self.jobs
+            for job in jobs:
+                if job['next'] <= now:
+                    self.launch(job['instances'])
+                    job['next'] += self.interval
+                    if job['next'] <= now:
+                        # We are late: don't run the missed passes
+                        job['next'] = now + self.interval
+            self._wake.wait(max(0, min((job['next'] for job in jobs), default=now + self.interval) - time.monotonic()))
+            self._wake.clear()
+
+    def stop(self):
+        self._halt.set()
+        self._wake.set()
+
+    def launch(self, instances):
+        '''
+        Start a pass on "instances" in a new thread, unless one of
+        their suffixes is busy. This function returns the thread, or
+        None if the pass is skipped.
+        '''
+        # Discovered instances have no suffixes before the pass: lock the whole instance
+        suffixes = set((instance, basedn) for instance in instances for basedn in (instances[instance].get('suffixes') or [None]))
+        with self._lock:
+            if suffixes & self._busy:
+                if self.logger:
+                    self.logger.warning('action=schedule status=skip instances="{}" detail="previous pass still running"'
+                                        .format(','.join(instances)))
+                return None
+            self._busy |= suffixes
+        thread = threading.Thread(target=self._run_pass, args=(instances, suffixes), daemon=True)
+        thread.start()
+        return thread
+
+    def _run_pass(self, instances, suffixes):
+        try:
+            self.runPass(instances)
+        except Exception as exc:
+            if self.logger:
+                self.logger.error('action=schedule status=fail instances="{}" error="{}"'.format(','.join(instances), exc))
+        finally:
+            with self._lock:
+                self._busy -= suffixes
+
+class PassMonitor:
+    '''
+    Follow the running passes, to tell systemd whether the checks are
+    still alive. A pass is stalled when it made no progress (see
+    replTest) for more than "limit" seconds.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._passes = {}   # thread ident -> time.monotonic() of the last progress
+
+    def start(self):
+        with self._lock:
+            self._passes[threading.get_ident()] = time.monotonic()
+
+    def progress(self, *args):
+        with self._lock:
+            self._passes[threading.get_ident()] = time.monotonic()
+
+    def end(self):
+        with self._lock:
+            self._passes.pop(threading.get_ident(), None)
+
+    def stalled(self, limit):
+        ''' Return True if a pass made no progress for more than limit seconds. '''
+        now = time.monotonic()
+        with self._lock:
+            return any(now - last > limit for last in self._passes.values())
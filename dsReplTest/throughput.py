@@ -0,0 +1,286 @@
+'''
+Replication throughput check.
+
+A single probe entry tells that an agreement works, not that it keeps
+up with the write rate. In throughput mode every supplier writes a
+burst of probe entries, pipelined with asynchronous adds, and every
+consumer is searched until it holds all of them. For each agreement
+the result has the entries replicated per second and the percentiles
+of the per-entry lag: the time between the add answered by the
+supplier and the entry found on the consumer. The burst is deleted
+at the end.
+
+The suppliers are checked one at a time, so the bursts don't slow
+each other down.
+'''
+import time
+import ldap
+import ldap.filter
+import dsReplTest.ldap as myldap
+import dsReplTest.plan as plan
+import dsReplTest.events as events
+import dsReplTest.trace as trace
+from dsReplTest.history import percentile
+
+def burst_entries(rDN, testEntry, basedn, runId, supplier, size):
+    '''
+    Compose the burst of a supplier: the probe entries (see
+    dsReplTest.ldap.probe_entry) numbered from 0 to size-1.
+    This function returns a list of (entryDN, entry).
+    '''
+    return [myldap.probe_entry(rDN, testEntry, basedn, runId, '{}-{:06d}'.format(supplier, i)) for i in range(size)]
+
+def burst_filter(rDN, testEntry, runId, supplier):
+    ''' The filter of the burst entries of a supplier. '''
+    prefix = "{}-{}-{}-".format(testEntry[rDN].decode('utf-8'), runId, supplier)
+    return '({}={}*)'.format(rDN, ldap.filter.escape_filter_chars(prefix))
+
+def burst_time(supplierConf, size, netTimeout, timeout):
+    ''' Calculate the longest time the burst of a supplier can take: every add and delete answered at the timeout '''
+    return netTimeout*(2*size + len(supplierConf['replica']) + 2) + timeout
+
+@trace.traced('wait burst', 'wait')
+def wait_burst(conns, basedn, searchFilter, acked, deadlines, timeout=None, poll=0.1):
+    '''
+    Search the burst on many consumers at the same time, every poll
+    seconds, with one level asynchronous searches, until each consumer
+    holds all of it or its deadline passes.
+        conns - {host: LDAPObject}
+        acked - {entry DN in lowercase: time.monotonic() of the add answer}
+        deadlines - {host: time.monotonic() value}
+
+    This function returns {host: (lags, error)}, where lags is {entry
+    DN: seconds} for the entries found and error the ldap.LDAPError
+    raised by the server, if any. The lags are accurate to poll seconds.
+    '''
+    lags = {host: {} for host in conns}
+    errors = {}
+    waiting = set(conns)
+    while waiting:
+        pending = {}
+        for host in waiting:
+            try:
+                pending[host] = conns[host].search(basedn, ldap.SCOPE_ONELEVEL, searchFilter, ['1.1'])
+            except ldap.LDAPError as err:
+                errors[host] = err
+        for host, msgid in pending.items():
+            try:
+                rtype, rdata = conns[host].result(msgid, 1, -1 if timeout is None else timeout)
+            except ldap.NO_SUCH_OBJECT:
+                rdata = []
+            except ldap.LDAPError as err:
+                errors[host] = err
+                continue
+            now = time.monotonic()
+            for dn, attrs in rdata:
+                if dn is None:
+                    continue
+                dn = dn.lower()
+                if dn in acked and dn not in lags[host]:
+                    lags[host][dn] = now - acked[dn]
+        now = time.monotonic()
+        waiting = {host for host in waiting
+                   if host not in errors and len(lags[host]) < len(acked) and now < deadlines[host]}
+        if waiting:
+            time.sleep(poll)
+    return {host: (lags[host], errors.get(host)) for host in conns}
+
+@trace.traced('supplier', 'supplier', 'instance', 'basedn', 'supplier')
+def throughput_supplier(instance, basedn, supplier, supplierConf, rDN, testEntry, runId, size,
+                        netTimeout, timeout, poll, logger, limiter=None, pool=None):
+    '''
+    Write a burst of "size" entries on a supplier, wait up to timeout
+    seconds (after the last add) for it on every consumer and then
+    delete it.
+
+    This function returns a tuple (result, someError), where result is
+    the RESULT dictionary of the supplier (see probe_supplier) with
+    "burst" (entries written), "writeRate" (adds per second on the
+    supplier), and per consumer "throughput" (entries per second),
+    "lagP50" and "lagP99" (seconds).
+    '''
+    if limiter is None:
+        limiter = myldap.HostLimiter()
+    if pool is None:
+        pool = myldap.ConnectionPool(netTimeout, reuse=False, logger=logger)
+    someError = False
+    started = time.monotonic()
+    result = {'replica': {}, 'detail': {}, 'throughput': {}, 'lagP50': {}, 'lagP99': {},
+              'burst': 0, 'writeRate': None, 'status': True, 'overallStatus': True}
+    supplier_uri = myldap.host_uri(supplierConf, supplier)
+    with limiter.host(supplier):
+        try:
+            connS = pool.get(supplier_uri, supplierConf['bind'], supplierConf['pwd'], supplierConf.get('starttls', False))
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier, action='connect', status='success')
+        except ldap.LDAPError as err:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier,
+                         action='connect', status='fail', **myldap.handle_fields(err))
+            result.update(status=False, overallStatus=False, error="Can't connect",
+                          elapsed=round(time.monotonic() - started, 3))
+            return result, True
+
+        # The burst, pipelined
+        entries = burst_entries(rDN, testEntry, basedn, runId, supplier, size)
+        sent = time.monotonic()
+        answers = myldap.add_many(connS, entries, netTimeout)
+        acked = {dn.lower(): at for dn, at, err in answers if err is None}
+        failed = [err for dn, at, err in answers if err is not None]
+        result['burst'] = len(acked)
+        if acked:
+            result['writeRate'] = round(len(acked)/max(max(acked.values()) - sent, 1e-6), 1)
+        if failed:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier, action='burst write', status='fail',
+                         entries=len(failed), **myldap.handle_fields(failed[0]))
+            result.update(status=False, overallStatus=False, error="{} of {} adds failed".format(len(failed), size))
+            someError = True
+        else:
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier, action='burst write', status='success',
+                        entries=size, rate=result['writeRate'])
+        agreements = {consumer_host: consumer_repl for consumer in supplierConf['replica']
+                      for consumer_host, consumer_repl in consumer.items() if consumer_repl is not None}
+        sunFailed = myldap.send_updates_now(connS, agreements, instance, basedn, supplier, logger)
+
+    connsC = {}
+    for consumer in supplierConf['replica']:
+        for consumer_host in consumer:
+            result['replica'][consumer_host] = False
+            if consumer_host in sunFailed:
+                result['detail'][consumer_host] = 'Send update now failed'
+                continue
+            consumer_uri = myldap.host_uri(supplierConf, consumer_host, consumer=True)
+            with limiter.host(consumer_host):
+                try:
+                    connsC[consumer_host] = pool.get(consumer_uri, supplierConf['bind'], supplierConf['pwd'],
+                                                     supplierConf.get('starttls', False))
+                except ldap.LDAPError as err:
+                    events.error(logger, instance=instance, baseDN=basedn, host=consumer_host,
+                                 action='connect', status='fail', **myldap.handle_fields(err))
+                    result['detail'][consumer_host] = "Can't connect"
+
+    if acked:
+        deadline = max(acked.values()) + timeout
+        found = wait_burst(connsC, basedn, burst_filter(rDN, testEntry, runId, supplier), acked,
+                           dict.fromkeys(connsC, deadline), netTimeout, poll)
+    else:
+        found = {}
+    for consumer_host, (lags, err) in found.items():
+        if err is not None:
+            events.error(logger, instance=instance, baseDN=basedn, host=consumer_host,
+                         action='burst search', status='fail', **myldap.handle_fields(err))
+            result['detail'][consumer_host] = myldap.handle_fields(err).get('error', 'Search failed')
+            continue
+        values = sorted(lags.values())
+        if values:
+            arrived = max(acked[dn] + lag for dn, lag in lags.items())
+            result['throughput'][consumer_host] = round(len(values)/max(arrived - sent, 1e-6), 1)
+            result['lagP50'][consumer_host] = percentile(values, 0.5)
+            result['lagP99'][consumer_host] = percentile(values, 0.99)
+        if len(values) == len(acked):
+            result['replica'][consumer_host] = True
+            events.info(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer_host,
+                        action='throughput', status='success', entries=len(values),
+                        rate=result['throughput'][consumer_host], p50=result['lagP50'][consumer_host],
+                        p99=result['lagP99'][consumer_host])
+        else:
+            result['detail'][consumer_host] = '{} of {} entries replicated in {}s'.format(len(values), len(acked), timeout)
+            events.error(logger, instance=instance, baseDN=basedn, supplier=supplier, consumer=consumer_host,
+                         action='throughput', status='fail', detail=result['detail'][consumer_host])
+    if not all(result['replica'].values()):
+        result['overallStatus'] = False
+        someError = True
+    if myldap.release_all(pool, connsC, result, instance, basedn, logger):
+        someError = True
+
+    # Bulk delete of the burst
+    with limiter.host(supplier):
+        failed = [err for dn, at, err in myldap.delete_many(connS, [dn for dn, entry in entries if dn.lower() in acked],
+                                                               netTimeout)
+                  if err is not None and not isinstance(err, ldap.NO_SUCH_OBJECT)]
+        if failed:
+            events.error(logger, instance=instance, baseDN=basedn, host=supplier, action='burst delete', status='fail',
+                         entries=len(failed), **myldap.handle_fields(failed[0]))
+            result.update(status=False, overallStatus=False, error="Can't delete {} entries".format(len(failed)))
+            someError = True
+        else:
+            events.info(logger, instance=instance, baseDN=basedn, host=supplier, action='burst delete', status='success',
+                        entries=len(acked))
+        if myldap.send_updates_now(connS, agreements, instance, basedn, supplier, logger):
+            result['overallStatus'] = False
+            someError = True
+        try:
+            pool.release(connS)
+        except ldap.LDAPError:
+            result['overallStatus'] = False
+            someError = True
+
+    result['elapsed'] = round(time.monotonic() - started, 3)
+    return result, someError
+
+@trace.traced('pass', 'pass')
+def throughputTest(directoryInstances, rDN, testEntry, size, netTimeout, timeout, poll, logger, logout,
+                   hostLimit=None, pool=None, runId=None):
+    '''
+    Run the throughput check on all the suppliers, one at a time.
+        size - entries of the burst of every supplier
+        timeout - seconds a consumer has, after the last add, to get all the burst
+        poll - seconds between two searches of the burst on a consumer
+
+    This function returns a tuple (RESULT, someError), with the same
+    layout of replTest. The balancers are not checked.
+    '''
+    if pool is None:
+        pool = myldap.ConnectionPool(netTimeout, reuse=False, logger=logger)
+    if runId is None:
+        runId = myldap.new_run_id()
+    if not logout:
+        mapResult = { True: "\t[  \033[92mOK\033[0m  ]", False: "\t[  \033[91mKO\033[0m  ]" }
+        endStr = ''
+    else:
+        endStr = "\n"
+    limiter = myldap.HostLimiter(hostLimit)
+    someError = False
+    RESULT = {}
+    suffixes = plan.compile_plan(directoryInstances).suffixes
+    # A run younger than a pass can still be running elsewhere: its entries stay
+    sweepAge = sum(burst_time(supplier.conf, size, netTimeout, timeout) for suffix in suffixes for supplier in suffix.suppliers)
+    try:
+        for instance in directoryInstances:
+            RESULT[instance] = {'suffixes': {}, 'status': None}
+            print (instance)
+            for suffix in suffixes:
+                if suffix.instance != instance:
+                    continue
+                basedn = suffix.basedn
+                print("\t{}".format(basedn))
+                RESULT[instance]['suffixes'][basedn] = {}
+                if myldap.sweep_probes(instance, basedn, suffix.suppliers, rDN, testEntry, runId, netTimeout, logger, limiter, pool,
+                                       maxAge=sweepAge):
+                    someError = True
+                for supplier, supplierConf in directoryInstances[instance]['suffixes'][basedn].items():
+                    print("\t\tBurst of {} entries on supplier {}".format(size, supplier), end=endStr)
+                    result, err = throughput_supplier(instance, basedn, supplier, supplierConf, rDN, testEntry, runId, size,
+                                                      netTimeout, timeout, poll, logger, limiter, pool)
+                    RESULT[instance]['suffixes'][basedn][supplier] = result
+                    someError = someError or err
+                    if not logout:
+                        print(mapResult[result['overallStatus']])
+    finally:
+        pool.close()
+    return RESULT, someError
+
+def report(RESULT):
+    ''' Format the throughput of every agreement as a text table. This function returns a list of lines. '''
+    lines = ['{:<30} {:<30} {:>8} {:>10} {:>8} {:>8}  {}'.format('supplier', 'consumer', 'entries', 'entries/s',
+                                                                 'p50 lag', 'p99 lag', 'suffix')]
+    for instance, value in RESULT.items():
+        for basedn, suppliers in value['suffixes'].items():
+            for supplier, result in suppliers.items():
+                if result.get('error'):
+                    lines.append('{:<30} {:<30} {}  {}'.format(supplier, '-', result['error'], basedn))
+                for consumer in result['replica']:
+                    lines.append('{:<30} {:<30} {:>8} {:>10} {:>8} {:>8}  {}'.format(
+                        supplier, consumer, result['burst'],
+                        *(str(result[key].get(consumer, '-')) for key in ('throughput', 'lagP50', 'lagP99')), basedn))
+                    if result['detail'].get(consumer):
+                        lines.append('{:<30} {:<30} {}'.format('', '', result['detail'][consumer]))
+    return lines
@@ -0,0 +1,155 @@
+'''
+Timing traces of a pass, for --profile.
+
+The pass, the instances, suffixes, suppliers and consumers, every LDAP
+operation and every wait are recorded as nested spans with monotonic
+timestamps. A trace exports as Chrome trace-event JSON (open it in
+chrome://tracing or https://ui.perfetto.dev), and summary() lists the
+top time sinks by self time.
+
+Tracing is off until start(): then span() returns a shared no-op
+context manager and complete() returns at once, so the probes pay a
+function call and a global lookup.
+'''
+import contextlib
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from dsReplTest.common import NOOP
+
+TRACER = None
+
+class Tracer:
+    '''
+    The spans recorded since start(). Each thread keeps its own stack of
+    open spans, so the self time of a span is its duration less the
+    time of its children.
+    '''
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.spans = []     # (name, cat, start, duration, self time, thread id, args, overlap)
+        self.threads = {}
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            thread = threading.current_thread()
+            self.threads[thread.ident] = thread.name
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, name, cat, args):
+        stack = self._stack()
+        frame = [time.monotonic(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            stack.pop()
+            duration = end - frame[0]
+            if stack:
+                stack[-1][1] += duration
+            self.spans.append((name, cat, frame[0], duration, duration - frame[1], threading.get_ident(), args, False))
+
+    def complete(self, name, cat, start, args, overlap=False):
+        '''
+        Record a span which started at start and ends now. The
+        overlapping ones (asynchronous operations in flight together)
+        don't count in the self time of their parent.
+        '''
+        stack = self._stack()
+        duration = time.monotonic() - start
+        if stack and not overlap:
+            stack[-1][1] += duration
+        self.spans.append((name, cat, start, duration, duration, threading.get_ident(), args, overlap))
+
+    def chrome(self):
+        ''' The trace in the Chrome trace-event format (a dictionary). '''
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in self.threads.items()]
+        for n, (name, cat, start, duration, selfTime, tid, args, overlap) in enumerate(self.spans):
+            ts = round((start - self.origin)*1e6, 1)
+            if overlap:
+                # Asynchronous spans don't nest on the thread timeline
+                common = {'name': name, 'cat': cat, 'pid': pid, 'tid': tid, 'id': n}
+                events.append(dict(common, ph='b', ts=ts, args=args))
+                events.append(dict(common, ph='e', ts=round(ts + duration*1e6, 1)))
+            else:
+                events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': ts, 'dur': round(duration*1e6, 1),
+                               'pid': pid, 'tid': tid, 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        ''' Write the Chrome trace-event JSON file. '''
+        with open(path, 'w') as trace:
+            json.dump(self.chrome(), trace, default=str)
+
+    def summary(self, top=15):
+        '''
+        The top time sinks: the spans grouped by name, sorted by self
+        time. This function returns a list of lines.
+        '''
+        groups = {}
+        for name, cat, start, duration, selfTime, tid, args, overlap in self.spans:
+            group = groups.setdefault((cat, name), [0, 0.0, 0.0, 0.0])
+            group[0] += 1
+            group[1] += duration
+            group[2] += selfTime
+            group[3] = max(group[3], duration)
+        wall = max((start + duration for name, cat, start, duration, selfTime, tid, args, overlap in self.spans),
+                   default=self.origin) - self.origin
+        lines = ['{:<10} {:<24} {:>7} {:>10} {:>10} {:>9} {:>9}'.format('category', 'span', 'count', 'self s',
+                                                                       'total s', 'mean ms', 'max ms')]
+        for (cat, name), (count, total, selfTime, longest) in sorted(groups.items(), key=lambda item: -item[1][2])[:top]:
+            lines.append('{:<10} {:<24} {:>7} {:>10.3f} {:>10.3f} {:>9.1f} {:>9.1f}'.format(
+                cat, name, count, selfTime, total, total/count*1000, longest*1000))
+        lines.append('Wall time {:.3f}s, {} spans. Concurrent spans sum up more than the wall time.'.format(wall, len(self.spans)))
+        return lines
+
+def start():
+    ''' Start recording. This function returns the Tracer. '''
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+def stop():
+    ''' Stop recording. This function returns the Tracer (None if not started). '''
+    global TRACER
+    tracer, TRACER = TRACER, None
+    return tracer
+
+def span(name, cat='pass', **args):
+    ''' A context manager recording a span, if tracing. '''
+    if TRACER is None:
+        return NOOP
+    return TRACER.span(name, cat, args)
+
+def complete(name, start, cat='ldap', overlap=False, **args):
+    ''' Record a span which started at start (a time.monotonic() value) and ends now, if tracing. '''
+    if TRACER is not None:
+        TRACER.complete(name, cat, start, args, overlap)
+
+def traced(name, cat='pass', *argnames):
+    '''
+    Decorator recording every call of a function as a span, with the
+    arguments argnames of the call as span arguments.
+    '''
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if TRACER is None:
+                return function(*args, **kwargs)
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            with TRACER.span(name, cat, {arg: bound.get(arg) for arg in argnames}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,243 @@
+'''
+The built-in report server, on the standard library only.
+
+It serves the same pages as the Flask application of ds-repltest.py
+(/, /api/results, /events, /history, /metrics and the static files)
+without loading Flask, Jinja and waitress, for the hosts with little
+memory. The pages are rendered in Python, once per pass: every request
+in between gets the bytes of the snapshot.
+'''
+import email.utils
+import html
+import http.server
+import mimetypes
+import os
+import socketserver
+import time
+from datetime import datetime
+import dsReplTest.results as results
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+def icon(selector):
+    ''' The URL of the icon of a status (see selectIcon in ds-repltest.py). '''
+    if selector is None:
+        return '/static/undef.png'
+    return '/static/yes.png' if selector else '/static/no.png'
+
+def render_report(instances, someError, testdate):
+    ''' The page of templates/template.html, in bytes. '''
+    esc = html.escape
+    page = ['<!DOCTYPE html>\n<html>\n<head>\n<title>Directory Server Check</title>\n'
+            '<link rel="stylesheet" type="text/css" href="/static/style.css">\n</head>\n<body>\n']
+    if testdate is None:
+        page.append('<h4>First check in progress...</h4>\n')
+    for instance in instances:
+        page.append('   <h2>Instance: {}{} <img src="{}" width="16" height="16"></h2>\n   <div id="container">\n'
+                    .format(esc(instance.name), ' (passive)' if instance.passive else '', icon(instance.balancer)))
+        for suffix in instance.suffixes:
+            page.append('      <a id="content" class="item">\n      <h3>{}</h3><ul class="supplier">\n'.format(esc(suffix.basedn)))
+            for supplier in suffix.suppliers:
+                page.append('\t         <li><img src="{}" width="16" height="16"> {}{}\n\t         <ul class="consumer">\n'
+                            .format(icon(supplier.status), esc(supplier.name),
+                                    ' ({})'.format(esc(supplier.error)) if supplier.error else ''))
+                for consumer in supplier.consumers:
+                    page.append('\t\t    <li><img src="{}" width="16" height="16"> {}{}{}{}</li>\n'.format(
+                        icon(consumer.status), esc(consumer.name),
+                        ' ({}s)'.format(consumer.latency) if consumer.latency is not None else '',
+                        ' (lag {}s)'.format(consumer.lag) if consumer.lag is not None else '',
+                        ' ({})'.format(esc(consumer.detail)) if consumer.detail else ''))
+                page.append('\t\t </ul></li>\n')
+            page.append('      </ul></a>\n')
+        page.append('   </div>\n')
+    if testdate is not None:
+        page.append('<h4>Test completed on: {}</h4>\n'.format(testdate.strftime('%d/%m/%Y at %H:%M:%S')))
+    page.append(LIVE_SCRIPT)
+    return ''.join(page).encode('utf-8')
+
+# The live progress of templates/template.html
+LIVE_SCRIPT = '''<h4 id="progress"></h4>
+<ul id="live"></ul>
+<script>
+// The suppliers checked by the running pass; the page reloads at its end
+if (window.EventSource) {
+   var source = new EventSource("/events");
+   source.addEventListener("pass", function () {
+      document.getElementById("live").innerHTML = "";
+   });
+   source.addEventListener("probe", function (message) {
+      var probe = JSON.parse(message.data);
+      var failed = probe.consumers.filter(function (consumer) { return !consumer.status; });
+      var item = document.createElement("li");
+      item.textContent = probe.instance + " " + probe.basedn + " " + probe.name + ": " +
+         (probe.overallStatus ? "ok" : "FAIL" + (probe.error ? " (" + probe.error + ")" : "") +
+          (failed.length ? " " + failed.map(function (consumer) { return consumer.name; }).join(", ") : ""));
+      document.getElementById("live").appendChild(item);
+      document.getElementById("progress").textContent = "Check on progress: " + probe.done + "/" + probe.total + " suppliers done";
+   });
+   source.addEventListener("done", function () {
+      window.location.reload();
+   });
+}
+</script>
+</body>
+</html>
+'''
+
+def render_history(summary):
+    ''' The page of templates/history.html, in bytes. summary is History.summary(). '''
+    esc = html.escape
+    dash = lambda value: '-' if value is None else value
+    page = ['<!DOCTYPE html>\n<html>\n<head>\n<title>Directory Server Check - History</title>\n'
+            '<link rel="stylesheet" type="text/css" href="/static/style.css">\n</head>\n<body>\n'
+            '<h2>Replication history</h2>\n<table class="history">\n'
+            '<tr><th>Instance</th><th>Suffix</th><th>Supplier</th><th>Consumer</th><th>Checks</th><th>Failures</th>\n'
+            '    <th>p50 (s)</th><th>p95 (s)</th><th>p99 (s)</th><th>Last checks</th><th>Last check on</th></tr>\n']
+    for pair in summary:
+        page.append('<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td>\n    <td>{}</td><td>{}</td>\n'
+                    '    <td>{}</td>\n    <td>{}</td>\n    <td>{}</td>\n    <td class="trend">{}</td>\n    <td>{}</td></tr>\n'.format(
+                        esc(pair['instance']), esc(pair['suffix']), esc(pair['supplier']), esc(pair['consumer']),
+                        pair['checks'], pair['failures'], dash(pair['p50']), dash(pair['p95']), dash(pair['p99']),
+                        ''.join('<span class="{}"></span>'.format('ok' if status else 'ko') for status in pair['trend']),
+                        datetime.fromtimestamp(pair['last']).strftime('%d/%m/%Y at %H:%M:%S')))
+    page.append('</table>\n<h4><a href="/">Last results</a></h4>\n</body>\n</html>\n')
+    return ''.join(page).encode('utf-8')
+
+def load_static(directory=STATIC_DIR):
+    ''' Read the static files once: {name: (content, mimetype, mtime)}. '''
+    files = {}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as static:
+                files[name] = (static.read(), mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                               int(os.stat(path).st_mtime))
+    return files
+
+class ReportHandler(http.server.BaseHTTPRequestHandler):
+    ''' The routes of the report server. See ReportServer. '''
+    server_version = 'ds-repltest'
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        path = self.path.split('?', 1)[0]
+        server = self.server
+        if path == '/':
+            self.cached('page', render_report, 'text/html; charset=utf-8', head)
+        elif path == '/api/results':
+            self.cached('json', results.to_json, 'application/json', head)
+        elif path == '/events':
+            self.events(head)
+        elif path == '/history':
+            if server.history is None:
+                self.send(404, b'History is disabled. See at HISTORY_FILE in the config file.\n', 'text/plain; charset=utf-8', head)
+            else:
+                self.send(200, render_history(server.history.summary()), 'text/html; charset=utf-8', head)
+        elif path == '/metrics' and server.metrics is not None:
+            self.send(200, server.metrics.REGISTRY.render().encode('utf-8'), 'text/plain; version=0.0.4', head)
+        elif path.startswith('/static/') and path[len('/static/'):] in server.static:
+            (content, mimetype, mtime) = server.static[path[len('/static/'):]]
+            if self.not_modified(None, mtime):
+                self.send(304, b'', mimetype, True)
+            else:
+                self.send(200, content, mimetype, head, {'Last-Modified': email.utils.formatdate(mtime, usegmt=True)})
+        else:
+            self.send(404, b'Not Found\n', 'text/plain; charset=utf-8', head)
+
+    def cached(self, name, render, mimetype, head):
+        '''
+        Answer with the rendering "name" of the last results, built once
+        per pass. The clients which already have it get a 304.
+        '''
+        (content, version) = self.server.store.rendered(name, render)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        testdate = self.server.store.snapshot()[2]
+        headers = {'ETag': '"{}-{}-{}"'.format(name, self.server.started, version), 'Cache-Control': 'no-cache'}
+        mtime = None
+        if testdate:
+            mtime = int(testdate.timestamp())
+            headers['Last-Modified'] = email.utils.formatdate(mtime, usegmt=True)
+        if self.not_modified(headers['ETag'], mtime):
+            self.send(304, b'', mimetype, True, headers)
+        else:
+            self.send(200, content, mimetype, head, headers)
+
+    def not_modified(self, etag, mtime):
+        ''' True if the client already has this version (If-None-Match first, then If-Modified-Since). '''
+        match = self.headers.get('If-None-Match')
+        if match is not None:
+            return etag is not None and (match.strip() == '*' or etag in [tag.strip() for tag in match.split(',')])
+        since = self.headers.get('If-Modified-Since')
+        if since is None or mtime is None:
+            return False
+        try:
+            return mtime <= email.utils.parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    def events(self, head=False):
+        '''
+        Stream the results of the running passes, supplier by supplier.
+        A HEAD request gets the headers only.
+        '''
+        broadcaster = self.server.broadcaster
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        if head:
+            return
+        stream = broadcaster.stream(broadcaster.subscribe())
+        try:
+            for message in stream:
+                self.wfile.write(message.encode('utf-8'))
+                self.wfile.flush()
+        except OSError:
+            # The client went away
+            pass
+        finally:
+            stream.close()
+
+    def send(self, status, content, mimetype, head=False, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', mimetype)
+        if status != 304:
+            self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not head and status != 304:
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.logger:
+            self.server.logger.debug('web {} {}'.format(self.address_string(), format % args))
+
+class ReportServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    '''
+    A thread per connection: the clients of /events keep theirs until
+    they leave.
+        store - ResultStore object instance
+        broadcaster - Broadcaster object instance
+        history - History object instance, or None
+        metrics - the dsReplTest.metrics module, or None
+        started - the start time, which tells apart the ETags of the runs
+    '''
+    daemon_threads = True
+
+    def __init__(self, host, port, store, broadcaster, history=None, metrics=None, started=None, logger=None):
+        self.store = store
+        self.broadcaster = broadcaster
+        self.history = history
+        self.metrics = metrics
+        self.started = int(time.time()) if started is None else started
+        self.logger = logger
+        self.static = load_static()
+        super().__init__((host, port), ReportHandler)
@@ -15,7 +15,7 @@ setup(
     include_package_data = False,
     package_data={
         'dsReplTest': ['etc/ds-repltest.yaml.dist',
-                       'common.py', 'ldap.py',
+                       'common.py', 'ldap.py', 'scheduler.py', 'metrics.py', 'history.py', 'discovery.py', 'ruv.py', 'results.py', 'config.py', 'events.py', 'throughput.py', 'plan.py', 'trace.py', 'webserver.py',
                        'static/*', 'templates/*' ],
     },
     data_files=[
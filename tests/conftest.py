@@ -0,0 +1,24 @@
+'''
+The tests run from a checkout: the package and the fake LDAP backend of
+the benchmark (bench/fakeldap.py) are imported from the source tree.
+The tests of the LDAP engine are skipped when python-ldap is missing.
+'''
+import os
+import sys
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+@pytest.fixture
+def topology(monkeypatch):
+    '''
+    A simulated topology (see bench/fakeldap.py) which answers the
+    ldap.initialize of the test. Skipped without python-ldap.
+    '''
+    ldap = pytest.importorskip('ldap')
+    from fakeldap import FakeTopology
+    topology = FakeTopology(delay=0.01, jitter=0.01, seed=1)
+    monkeypatch.setattr(ldap, 'initialize', topology.connect)
+    return topology
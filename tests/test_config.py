@@ -0,0 +1,146 @@
+import logging
+import os
+import time
+import pytest
+import yaml
+from dsReplTest.config import Config, ConfigError, ConfigHolder, DEFAULTS
+
+DIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dsReplTest', 'etc', 'ds-repltest.yaml.dist')
+
+def settings(**changes):
+    ''' A valid configuration with two instances, one of them discovered. '''
+    values = {
+        'Logging': {'LOGFILE_DIR': '/tmp', 'LOGFILE_NAME': 'test.log', 'LOGSTDOUT': False, 'TYPE': 'file',
+                    'SYSLOG_FAC': 'syslog', 'LOG_LEVEL': 'INFO', 'SYSLOG_SOCKET': '/dev/log'},
+        'Email': {'SEND': False},
+        'Web': {'HOST': '127.0.0.1', 'PORT': 8080},
+        'INSTANCES': {
+            'prod': {'suffixes': {'o=test': {
+                's1': {'replica': [{'c1': None}, {'c2': 'cn=s1-->c2,cn=config'}],
+                       'port': 389, 'protocol': 'ldap', 'bind': 'cn=dm', 'pwd': 'secret'}}}},
+            'auto': {'discover': {'suppliers': ['seed'], 'port': 389, 'protocol': 'ldap',
+                                  'bind': 'cn=dm', 'pwd': 'secret'}}},
+        'TEST_ENTRY': {'objectClass': ['top', 'groupofuniquenames'], 'cn': 'probe', 'description': 42},
+        'TIMEOUT': 5,
+        'TIMEWAIT': 2,
+        'UPDATE_TIMEWAIT': 3,
+    }
+    values.update(changes)
+    return values
+
+def write(path, values):
+    with open(str(path), 'w') as ymlfile:
+        yaml.safe_dump(values, ymlfile)
+    return str(path)
+
+def test_dist_file_is_valid():
+    assert Config(DIST).INSTANCES
+
+def test_values_and_defaults(tmp_path):
+    config = Config(write(tmp_path / 'conf.yaml', settings(WORKERS=4)))
+    assert config.WORKERS == 4
+    assert config.HOST_LIMIT is DEFAULTS['HOST_LIMIT']
+    assert config.INTERVAL == 43200
+    assert Config(write(tmp_path / 'conf.yaml', settings(INTERVAL=None))).INTERVAL is None
+    assert config.get('MISSING', 'x') == 'x'
+    assert config.rdn == 'cn'
+    assert config.ENTRY == {'objectClass': (b'top', b'groupofuniquenames'), 'cn': b'probe', 'description': b'42'}
+    assert config.persistentAttribute is None
+    assert Config(write(tmp_path / 'conf.yaml', settings(PROBE_MODE='modify'))).persistentAttribute == 'description'
+
+def test_read_only(tmp_path):
+    config = Config(write(tmp_path / 'conf.yaml', settings()))
+    with pytest.raises(AttributeError):
+        config.TIMEOUT = 1
+    with pytest.raises(TypeError):
+        config.INSTANCES['prod'] = {}
+    assert isinstance(config.INSTANCES['prod']['suffixes']['o=test']['s1']['replica'], tuple)
+
+@pytest.mark.parametrize('changes, message', [
+    ({'TIMEOUT': None}, 'Missing parameters: TIMEOUT'),
+    ({'Logging': {'TYPE': 'file'}}, 'Missing Logging parameters'),
+    ({'INSTANCES': {}}, 'INSTANCES must be a not empty dictionary'),
+    ({'INSTANCES': {'prod': {'suffixes': {'o=test': {'s1': {'replica': []}}}}}}, 'misses port, protocol, bind, pwd'),
+    ({'INSTANCES': {'prod': {'suffixes': {'o=test': {'s1': {'replica': [], 'port': 389, 'protocol': 'ldapi',
+                                                            'bind': 'cn=dm', 'pwd': 'x'}}}}}}, 'needs "socket"'),
+    ({'TEST_ENTRY': {'sn': 'probe'}}, "rdn of the test entry"),
+    ({'PROBE_MODE': 'replace'}, "PROBE_MODE"),
+    ({'PROBE_ATTRIBUTE': 'cn'}, 'PROBE_ATTRIBUTE'),
+    ({'TLS_REQCERT': 'maybe'}, 'TLS_REQCERT'),
+    ({'Web': {'SERVER': 'apache'}}, 'Web SERVER'),
+])
+def test_invalid(tmp_path, changes, message):
+    with pytest.raises(ConfigError, match=message):
+        Config(write(tmp_path / 'conf.yaml', settings(**changes)))
+
+def test_unreadable(tmp_path):
+    with pytest.raises(ConfigError, match='Unable to read'):
+        Config(str(tmp_path / 'missing.yaml'))
+    (tmp_path / 'list.yaml').write_text('- a\n- b\n')
+    with pytest.raises(ConfigError, match='not a YAML dictionary'):
+        Config(str(tmp_path / 'list.yaml'))
+
+def test_plans(tmp_path):
+    config = Config(write(tmp_path / 'conf.yaml', settings()))
+    assert list(config.plans) == ['prod']
+    [suffix] = config.plans['prod'].suffixes
+    [supplier] = suffix.suppliers
+    assert supplier.uri == 'ldap://s1:389'
+    assert [(edge.consumer, edge.uri, edge.agreement) for edge in supplier.edges] == [
+        ('c1', 'ldap://c1:389', None), ('c2', 'ldap://c2:389', 'cn=s1-->c2,cn=config')]
+    # The discovered instance is compiled at every pass, the other one is reused
+    discovered = {'suffixes': {'o=auto': {'seed': {'replica': [{'c3': None}], 'port': 389, 'protocol': 'ldap',
+                                                   'bind': 'cn=dm', 'pwd': 'secret'}}}}
+    passPlan = config.plan({'prod': config.INSTANCES['prod'], 'auto': discovered})
+    assert passPlan.instances == ['prod', 'auto']
+    assert passPlan.suffixes[0] is suffix
+    assert passPlan.suppliers() == 2
+    assert set(passPlan.hosts) == {'ldap://s1:389', 'ldap://c1:389', 'ldap://c2:389', 'ldap://seed:389', 'ldap://c3:389'}
+
+def touch(path, values, mtime):
+    write(path, values)
+    os.utime(path, (mtime, mtime))
+
+def test_reload(tmp_path, caplog):
+    path = str(tmp_path / 'conf.yaml')
+    touch(path, settings(), 1000)
+    reloads = []
+    holder = ConfigHolder(path, logging.getLogger('test'), lambda old, new: reloads.append((old, new)))
+    first = holder.current
+    assert not holder.reload_if_changed()
+    touch(path, settings(TIMEOUT=9, INTERVAL=60), 2000)
+    with caplog.at_level(logging.INFO):
+        assert holder.reload_if_changed()
+    assert holder.current.TIMEOUT == 9
+    assert reloads == [(first, holder.current)]
+    assert 'INTERVAL changed: restart to apply' in caplog.text
+    # An invalid file keeps the current Config
+    touch(path, settings(TIMEOUT=None), 3000)
+    assert not holder.reload()
+    assert holder.current.TIMEOUT == 9
+    assert 'action=reload status=fail' in caplog.text
+
+def test_watch(tmp_path):
+    path = str(tmp_path / 'conf.yaml')
+    touch(path, settings(), 1000)
+    holder = ConfigHolder(path)
+    watcher = holder.watch(interval=0.05)
+    assert watcher.daemon
+    touch(path, settings(TIMEOUT=9), 2000)
+    deadline = time.monotonic() + 5
+    while holder.current.TIMEOUT != 9 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert holder.current.TIMEOUT == 9
+
+def test_request_reload(tmp_path):
+    path = str(tmp_path / 'conf.yaml')
+    touch(path, settings(), 1000)
+    holder = ConfigHolder(path)
+    holder.watch(interval=60)
+    # The same modification time: only a requested reload reads the file
+    touch(path, settings(TIMEOUT=9), 1000)
+    holder.request_reload()
+    deadline = time.monotonic() + 5
+    while holder.current.TIMEOUT != 9 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert holder.current.TIMEOUT == 9
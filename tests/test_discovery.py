@@ -0,0 +1,91 @@
+import json
+import logging
+import pytest
+ldap = pytest.importorskip('ldap')
+import dsReplTest.discovery as discovery
+
+LOGGER = logging.getLogger('ds-repltest-test')
+DISCOVER = {'suppliers': ['s1'], 'port': 389, 'protocol': 'ldap', 'bind': 'cn=dm', 'pwd': 'secret'}
+TOPOLOGY = {'o=test': {'s1': {'replica': [{'c1': None}], 'port': 389, 'protocol': 'ldap'}}}
+
+class Seeds:
+    ''' The LDAP discovery: it returns TOPOLOGY, or fails while down. '''
+    def __init__(self):
+        self.calls = []
+        self.down = False
+
+    def discover_instance(self, instance, discover, netTimeout, logger):
+        self.calls.append(instance)
+        if self.down:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return json.loads(json.dumps(TOPOLOGY)), 'fingerprint'
+
+@pytest.fixture
+def seeds(monkeypatch):
+    seeds = Seeds()
+    monkeypatch.setattr(discovery, 'discover_instance', seeds.discover_instance)
+    return seeds
+
+def resolve(path, ttl=3600, instances=None):
+    if instances is None:
+        instances = {'auto': {'discover': DISCOVER}}
+    return discovery.resolve_instances(instances, str(path), ttl, 5, LOGGER)
+
+def test_no_discover_section():
+    instances = {'prod': {'suffixes': TOPOLOGY}}
+    assert discovery.resolve_instances(instances, None, 3600, 5, LOGGER) is instances
+
+def test_cache_keeps_no_credentials(tmp_path, seeds):
+    path = tmp_path / 'cache.json'
+    resolved = resolve(path)
+    assert resolved['auto']['suffixes']['o=test']['s1'] == dict(TOPOLOGY['o=test']['s1'], bind='cn=dm', pwd='secret',
+                                                                starttls=False)
+    cache = json.loads(path.read_text())
+    assert cache['auto']['suffixes'] == TOPOLOGY
+    assert 'secret' not in path.read_text()
+
+def test_cache_is_used_for_ttl(tmp_path, seeds):
+    path = tmp_path / 'cache.json'
+    resolve(path)
+    resolve(path)
+    assert seeds.calls == ['auto']
+    resolve(path, ttl=0)
+    assert seeds.calls == ['auto', 'auto']
+
+def test_new_credentials_apply_to_the_cached_topology(tmp_path, seeds):
+    path = tmp_path / 'cache.json'
+    resolve(path)
+    resolved = resolve(path, instances={'auto': {'discover': dict(DISCOVER, pwd='changed')}})
+    assert resolved['auto']['suffixes']['o=test']['s1']['pwd'] == 'changed'
+
+def test_failed_discovery_uses_the_cache(tmp_path, seeds):
+    path = tmp_path / 'cache.json'
+    resolve(path)
+    seeds.down = True
+    assert resolve(path, ttl=0)['auto']['suffixes']['o=test']['s1']['replica'] == [{'c1': None}]
+
+def test_failed_discovery_without_cache(tmp_path, seeds):
+    seeds.down = True
+    with pytest.raises(ldap.SERVER_DOWN):
+        resolve(tmp_path / 'cache.json')
+
+def test_explicit_suffixes_win(tmp_path, seeds):
+    explicit = {'o=test': {'s9': {'replica': [], 'port': 636, 'protocol': 'ldaps', 'bind': 'cn=dm', 'pwd': 'x'}}}
+    resolved = resolve(tmp_path / 'cache.json', instances={'auto': {'discover': DISCOVER, 'suffixes': explicit}})
+    assert resolved['auto']['suffixes'] == explicit
+
+class AgreementConnection:
+    ''' Answer the subtree search of the agreements. '''
+    def search_s(self, base, scope, filterstr, attrlist):
+        return [
+            ('cn=to c1,' + base, {'nsDS5ReplicaHost': [b'C1.example.com'], 'nsDS5ReplicaRoot': [b'o=test']}),
+            ('cn=to c2,' + base, {'nsDS5ReplicaHost': [b'c2'], 'nsDS5ReplicaRoot': [b'o=test'],
+                                  'nsDS5ReplicaUpdateSchedule': [b'0000-0500 0123456']}),
+            ('cn=to c3,' + base, {'nsDS5ReplicaHost': [b'c3'], 'nsDS5ReplicaRoot': [b'o=test'],
+                                  'nsds5ReplicaEnabled': [b'off']}),
+            (None, ['ldap://referral'])]
+
+def test_read_agreements():
+    assert discovery.read_agreements(AgreementConnection()) == [
+        {'dn': 'cn=to c1,cn=mapping tree,cn=config', 'consumer': 'c1.example.com', 'suffix': 'o=test', 'scheduled': False},
+        {'dn': 'cn=to c2,cn=mapping tree,cn=config', 'consumer': 'c2', 'suffix': 'o=test', 'scheduled': True}]
@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+import pytest
+ldap = pytest.importorskip('ldap')
+import dsReplTest.ldap as myldap
+import dsReplTest.metrics as metrics
+import dsReplTest.plan as plan
+from bench_repltest import TEST_ENTRY, make_instances
+
+LOGGER = logging.getLogger('ds-repltest-test')
+
+def run(topology, instances, workers=1, **options):
+    ''' Run a pass with short waits. This function returns (RESULT, someError). '''
+    options.setdefault('netTimeout', 5)
+    options.setdefault('sleepTime', 0.2)
+    options.setdefault('UPDATE_sleepTime', 0.2)
+    return myldap.replTest(plan.compile_plan(instances), 'cn', TEST_ENTRY, logger=LOGGER, logout=True,
+                           workers=workers, **options)
+
+def statuses(RESULT):
+    return {(supplier, consumer): status for suppliers in RESULT['bench']['suffixes'].values()
+            for supplier, result in suppliers.items() for consumer, status in result['replica'].items()}
+
+def leftovers(topology):
+    ''' The probe entries left on the hosts, once the deletes are replicated. '''
+    time.sleep(0.1)
+    entries = []
+    with topology._lock:
+        for server in topology.servers.values():
+            server.apply(time.monotonic())
+            entries.extend(server.entries)
+    return entries
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_pass(topology, workers):
+    instances = make_instances(topology, 5, 2, 0.2)
+    RESULT, someError = run(topology, instances, workers)
+    assert not someError
+    assert list(RESULT['bench']['suffixes']['o=bench']) == ['ldap000.bench.test', 'ldap001.bench.test']
+    assert len(statuses(RESULT)) == 8 and all(statuses(RESULT).values())
+    assert all(result['overallStatus'] for result in RESULT['bench']['suffixes']['o=bench'].values())
+    assert leftovers(topology) == []
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_consumer_down(topology, workers):
+    instances = make_instances(topology, 4, 1, 0.0, downRate=0.5)
+    RESULT, someError = run(topology, instances, workers)
+    assert someError
+    assert statuses(RESULT) == {('ldap000.bench.test', 'ldap001.bench.test'): False,
+                                ('ldap000.bench.test', 'ldap002.bench.test'): False,
+                                ('ldap000.bench.test', 'ldap003.bench.test'): True}
+
+def test_lost_changes(topology):
+    topology.lossRate = 1.0
+    instances = make_instances(topology, 3, 1, 0.0)
+    RESULT, someError = run(topology, instances, 2)
+    assert someError
+    assert not any(statuses(RESULT).values())
+
+def test_scheduled_agreements_are_forced(topology):
+    instances = make_instances(topology, 4, 1, 1.0)
+    RESULT, someError = run(topology, instances, 2)
+    assert not someError and all(statuses(RESULT).values())
+    assert topology.ops['modify'] >= 3
+
+def test_convergence_measures_the_latency(topology):
+    instances = make_instances(topology, 3, 1, 0.0)
+    RESULT, someError = run(topology, instances, 2, convergeTimeout=5)
+    assert not someError
+    latency = RESULT['bench']['suffixes']['o=bench']['ldap000.bench.test']['latency']
+    assert set(latency) == {'ldap001.bench.test', 'ldap002.bench.test'}
+    assert all(0 <= value < 1 for value in latency.values())
+
+def test_host_limit(topology):
+    instances = make_instances(topology, 4, 3, 0.0)
+    RESULT, someError = run(topology, instances, 4, hostLimit=1)
+    assert not someError and all(statuses(RESULT).values())
+
+def test_progress(topology):
+    instances = make_instances(topology, 4, 2, 0.0)
+    calls = []
+    run(topology, instances, 4, progress=lambda done, total, instance, basedn, supplier, result: calls.append((done, total)))
+    assert sorted(calls) == [(1, 2), (2, 2)]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_deadline(topology, workers):
+    topology.latency = 0.02
+    instances = make_instances(topology, 6, 6, 0.0)
+    start = time.monotonic()
+    RESULT, someError = run(topology, instances, workers, sleepTime=1, deadline=0.5)
+    elapsed = time.monotonic() - start
+    assert someError
+    results = RESULT['bench']['suffixes']['o=bench'].values()
+    assert any(result.get('error') == 'Timed out' for result in results)
+    # The probes running at the deadline stop waiting and delete their entries
+    assert elapsed < 3
+    assert leftovers(topology) == []
+
+def test_modify_mode(topology):
+    instances = make_instances(topology, 3, 1, 0.0)
+    for attempt in range(2):
+        RESULT, someError = run(topology, instances, 2, persistentAttribute='description')
+        assert not someError and all(statuses(RESULT).values())
+    # One persistent entry per supplier, replicated with the last nonce
+    entries = leftovers(topology)
+    assert len(entries) == 3 and len(set(entries)) == 1
+    # The first modify finds no entry and the entry is added
+    assert topology.ops['delete'] == 0 and topology.ops['add'] == 1 and topology.ops['modify'] == 2
+
+def test_sweep_keeps_the_entries_of_running_passes(topology):
+    instances = make_instances(topology, 3, 1, 0.0)
+    conn = topology.connect('ldap://ldap000.bench.test:389')
+    old, _ = myldap.probe_entry('cn', TEST_ENTRY, 'o=bench', '20000101000000.abcdef', 'ldap000.bench.test')
+    running, _ = myldap.probe_entry('cn', TEST_ENTRY, 'o=bench', myldap.new_run_id(), 'ldap009.bench.test')
+    legacy = 'cn=Elettrogeno,o=bench'
+    for dn in (old, running, legacy):
+        conn.add_s(dn, [('cn', dn.split(',')[0][3:].encode('utf-8'))])
+    RESULT, someError = run(topology, instances)
+    assert not someError
+    assert topology.server('ldap000.bench.test').entries.keys() == {running}
+
+def test_run_started():
+    started = myldap.run_started(myldap.new_run_id())
+    assert abs(started - time.time()) < 2
+    assert myldap.run_started('persistent-ldap01') is None
+
+def test_host_limit_covers_the_polls(topology):
+    limiter = myldap.HostLimiter(1)
+    conns = {host: topology.connect('ldap://{}:389'.format(host)) for host in ('c1', 'c2')}
+    conns['c1'].add_s('o=test', [('o', b'test')])
+    # c2 is busy: it's searched once free, and c1 doesn't wait for it
+    limiter.acquire('c2')
+    timer = threading.Timer(0.3, limiter.release, ['c2'])
+    timer.start()
+    found = myldap.wait_entries(conns, 'o=test', dict.fromkeys(conns, 0), limiter=limiter)
+    timer.join()
+    assert found['c1'][:1] == (1,) and found['c1'][1] < 0.3
+    assert found['c2'][:1] == (0,) and found['c2'][1] >= 0.3
+    assert limiter.acquire('c1') and limiter.acquire('c2')
+
+def test_supplier_connect_failure(topology):
+    instances = make_instances(topology, 3, 1, 0.0)
+    supplier = plan.compile_plan(instances).suffixes[0].suppliers[0]
+    metrics.PROBE_STATUS.set(1, 'bench', 'o=bench', supplier.name, 'ldap001.bench.test')
+    topology.server(supplier.name).down = True
+    result, someError = myldap.probe_supplier('bench', 'o=bench', supplier, 'cn=probe,o=bench', TEST_ENTRY, 5, 0.2, 0.2, LOGGER)
+    assert someError and result['error'] == "Can't connect"
+    assert result['replica'] == {'ldap001.bench.test': False, 'ldap002.bench.test': False}
+    assert result['detail']['ldap001.bench.test'] == "Can't connect to the supplier"
+    assert metrics.PROBE_STATUS._values[('bench', 'o=bench', supplier.name, 'ldap001.bench.test')] == 0
+
+def test_passive_metrics_apart():
+    labels = ('prod', 'o=test', 's1', 'c1')
+    myldap.record_metrics('prod', 'o=test', 's1', {'overallStatus': True, 'replica': {'c1': True}})
+    myldap.record_metrics('prod', 'o=test', 's1', {'overallStatus': False, 'replica': {'c1': False}}, passive=True)
+    assert metrics.PROBE_STATUS._values[labels] == 1 and metrics.SUPPLIER_STATUS._values[labels[:3]] == 1
+    assert metrics.PASSIVE_STATUS._values[labels] == 0 and metrics.PASSIVE_SUPPLIER_STATUS._values[labels[:3]] == 0
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch(topology, workers):
+    instances = make_instances(topology, 5, 2, 0.2)
+    RESULT, someError = run(topology, instances, workers, batch=True)
+    assert not someError
+    assert list(RESULT['bench']['suffixes']['o=bench']) == ['ldap000.bench.test', 'ldap001.bench.test']
+    assert len(statuses(RESULT)) == 8 and all(statuses(RESULT).values())
+    assert leftovers(topology) == []
+
+def test_batch_searches_every_consumer_once(topology):
+    instances = make_instances(topology, 6, 3, 0.0)
+    run(topology, instances, 1, batch=True)
+    batched = topology.ops['search']
+    topology.ops.clear()
+    run(topology, instances, 1)
+    # One search per consumer (and one for the garbage collection), not one per edge
+    assert batched == 6 + 1 < topology.ops['search']
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch_consumer_down(topology, workers):
+    instances = make_instances(topology, 4, 1, 0.0, downRate=0.5)
+    RESULT, someError = run(topology, instances, workers, batch=True)
+    assert someError
+    assert statuses(RESULT) == {('ldap000.bench.test', 'ldap001.bench.test'): False,
+                                ('ldap000.bench.test', 'ldap002.bench.test'): False,
+                                ('ldap000.bench.test', 'ldap003.bench.test'): True}
+
+def test_batch_convergence_and_modify_mode(topology):
+    instances = make_instances(topology, 4, 2, 0.0)
+    for attempt in range(2):
+        RESULT, someError = run(topology, instances, 2, batch=True, convergeTimeout=5, persistentAttribute='description')
+        assert not someError and all(statuses(RESULT).values())
+    latency = RESULT['bench']['suffixes']['o=bench']['ldap000.bench.test']['latency']
+    assert all(0 <= value < 1 for value in latency.values())
+    assert topology.ops['delete'] == 0
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_deadline(topology, workers):
+    topology.latency = 0.02
+    instances = make_instances(topology, 6, 6, 0.0)
+    start = time.monotonic()
+    RESULT, someError = run(topology, instances, workers, sleepTime=1, deadline=0.3, batch=True)
+    assert someError and time.monotonic() - start < 3
+    results = RESULT['bench']['suffixes']['o=bench']
+    assert len(results) == 6 and not any(statuses(RESULT).values())
+    assert 'Timed out' in {detail for result in results.values() for detail in result['detail'].values()}
+    # The entries written before the deadline are deleted anyway
+    assert leftovers(topology) == []
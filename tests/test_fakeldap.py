@@ -0,0 +1,42 @@
+import pytest
+ldap = pytest.importorskip('ldap')
+
+ENTRY = {'objectClass': [b'top'], 'cn': b'Elettrogeno-1', 'description': [b'nonce-1', b'other']}
+BASE = 'o=test'
+
+@pytest.fixture
+def conn(topology):
+    conn = topology.connect('ldap://ldap01.test:389')
+    conn.add_s('cn=Elettrogeno-1,' + BASE, list(ENTRY.items()))
+    conn.add_s('cn=Elettrogeno-2,' + BASE, [('cn', b'Elettrogeno-2')])
+    conn.add_s('cn=other,cn=Elettrogeno-1,' + BASE, [('cn', b'other')])
+    return conn
+
+def names(answer):
+    return sorted(dn.split(',')[0] for dn, attrs in answer)
+
+@pytest.mark.parametrize('filterstr, expected', [
+    ('(objectClass=*)', ['cn=Elettrogeno-1', 'cn=Elettrogeno-2']),
+    ('(cn=elettrogeno-*)', ['cn=Elettrogeno-1', 'cn=Elettrogeno-2']),
+    ('(description=nonce\\2d1)', ['cn=Elettrogeno-1']),
+    ('(description=*once*)', ['cn=Elettrogeno-1']),
+    ('(&(cn=Elettrogeno-*)(!(cn=Elettrogeno-2*)))', ['cn=Elettrogeno-1']),
+    ('(|(cn=Elettrogeno-2)(description=other))', ['cn=Elettrogeno-1', 'cn=Elettrogeno-2']),
+    ('(description=*)', ['cn=Elettrogeno-1']),
+])
+def test_one_level_filter(conn, filterstr, expected):
+    assert names(conn.search_s(BASE, ldap.SCOPE_ONELEVEL, filterstr, ['1.1'])) == expected
+
+def test_base_search_applies_the_filter(conn):
+    dn = 'cn=Elettrogeno-1,' + BASE
+    assert conn.search_s(dn, ldap.SCOPE_BASE, '(description=nonce-1)') != []
+    assert conn.search_s(dn, ldap.SCOPE_BASE, '(description=nonce-2)') == []
+
+def test_modify_entry(conn):
+    dn = 'cn=Elettrogeno-1,' + BASE
+    conn.modify_s(dn, [(ldap.MOD_REPLACE, 'description', [b'nonce-2']), (ldap.MOD_ADD, 'seeAlso', [b'cn=x'])])
+    conn.modify_s(dn, [(ldap.MOD_DELETE, 'seeAlso', None)])
+    attrs = conn.search_s(dn, ldap.SCOPE_BASE)[0][1]
+    assert attrs['description'] == [b'nonce-2'] and 'seeAlso' not in attrs
+    with pytest.raises(ldap.NO_SUCH_OBJECT):
+        conn.modify_s('cn=missing,' + BASE, [(ldap.MOD_REPLACE, 'description', [b'x'])])
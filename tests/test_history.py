@@ -0,0 +1,62 @@
+import math
+import pytest
+from dsReplTest.history import History, percentile
+
+def result(status, latency=None):
+    ''' A RESULT dictionary with one supplier and one consumer. '''
+    supplier = {'replica': {'c1': status}, 'overallStatus': status}
+    if latency is not None:
+        supplier['latency'] = {'c1': latency}
+    return {'prod': {'status': None, 'suffixes': {'o=test': {'s1': supplier}}}}
+
+def test_records_in_order(tmp_path):
+    history = History(str(tmp_path / 'history'), capacity=10)
+    history.record_result(result(True, 0.5), when=100)
+    history.record_result(result(False), when=200)
+    assert list(history.records()) == [(100, 0, 1, 0.5), (200, 0, 0, None)]
+    assert history.pairs == [('prod', 'o=test', 's1', 'c1')]
+
+def test_ring_overwrites_the_oldest(tmp_path):
+    history = History(str(tmp_path / 'history'), capacity=3)
+    history.append([(when, 0, True, None) for when in range(5)])
+    assert [record[0] for record in history.records()] == [2, 3, 4]
+    assert history.written == 5
+
+def test_reopen_keeps_records_pairs_and_capacity(tmp_path):
+    path = str(tmp_path / 'history')
+    history = History(path, capacity=4)
+    history.record_result(result(True, 1.0), when=100)
+    history.close()
+    history = History(path, capacity=1000)
+    assert history.capacity == 4
+    assert history.pairs == [('prod', 'o=test', 's1', 'c1')]
+    assert list(history.records()) == [(100, 0, 1, 1.0)]
+
+def test_not_a_history_file(tmp_path):
+    path = tmp_path / 'history'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        History(str(path))
+
+def test_summary(tmp_path):
+    history = History(str(tmp_path / 'history'), capacity=100)
+    for when, (status, latency) in enumerate([(True, 1.0), (True, 2.0), (False, None), (True, 4.0)]):
+        history.record_result(result(status, latency), when=when)
+    [pair] = history.summary(trend=3)
+    assert pair['checks'] == 4
+    assert pair['failures'] == 1
+    assert pair['last'] == 3
+    assert pair['trend'] == [True, False, True]
+    assert (pair['p50'], pair['p99']) == (2.0, 4.0)
+    assert history.summary(since=2)[0]['checks'] == 2
+
+def test_skipped_supplier(tmp_path):
+    history = History(str(tmp_path / 'history'), capacity=10)
+    history.record_result({'prod': {'status': None, 'suffixes': {'o=test': {'s1': None}}}})
+    assert list(history.records()) == []
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.95) == 4.0
+    assert math.isclose(percentile([0.1234], 0.99), 0.123)
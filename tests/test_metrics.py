@@ -0,0 +1,39 @@
+from dsReplTest.metrics import Registry, format_value
+
+def test_gauge():
+    registry = Registry()
+    gauge = registry.gauge('probe_status', 'Last check.', ('supplier', 'consumer'))
+    gauge.set(1, 's1', 'c"1')
+    gauge.set(0.5, 's1', 'c2')
+    assert registry.render() == ('# HELP probe_status Last check.\n'
+                                 '# TYPE probe_status gauge\n'
+                                 'probe_status{supplier="s1",consumer="c\\"1"} 1\n'
+                                 'probe_status{supplier="s1",consumer="c2"} 0.5\n')
+    gauge.remove('s1', 'c"1')
+    assert 'c\\"1' not in registry.render()
+
+def test_histogram():
+    registry = Registry()
+    histogram = registry.histogram('duration_seconds', 'Duration.', ('operation',), (0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, 'add')
+    assert registry.render().splitlines()[2:] == [
+        'duration_seconds_bucket{operation="add",le="0.1"} 1',
+        'duration_seconds_bucket{operation="add",le="1"} 2',
+        'duration_seconds_bucket{operation="add",le="+Inf"} 3',
+        'duration_seconds_sum{operation="add"} 5.55',
+        'duration_seconds_count{operation="add"} 3']
+
+def test_render_is_cached_until_an_update():
+    registry = Registry()
+    gauge = registry.gauge('last_pass', 'Last pass.')
+    gauge.set(1)
+    text = registry.render()
+    assert registry.render() is text
+    gauge.set(2)
+    assert registry.render() == '# HELP last_pass Last pass.\n# TYPE last_pass gauge\nlast_pass 2\n'
+
+def test_format_value():
+    assert format_value(float('inf')) == '+Inf'
+    assert format_value(3.0) == '3'
+    assert format_value(0.25) == '0.25'
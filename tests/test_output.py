@@ -0,0 +1,31 @@
+import json
+from datetime import datetime
+import dsReplTest.results as results
+from test_results import RESULT
+
+def healthy(latency=0.4):
+    return results.from_result({'prod': {'status': True, 'suffixes': {'o=test': {
+        's1': {'status': True, 'overallStatus': True, 'replica': {'c1': True}, 'latency': {'c1': latency}}}}}})
+
+def test_state():
+    assert results.state(healthy(), False) == results.OK
+    assert results.state(healthy(), True) == results.WARNING
+    assert results.state(healthy(5), False, warnLatency=2) == results.WARNING
+    assert results.state(results.from_result(RESULT), False) == results.CRITICAL
+
+def test_to_report():
+    report = json.loads(results.to_report(results.from_result(RESULT), False, datetime(2024, 1, 2), warnLatency=0.1))
+    assert (report['state'], report['code']) == ('CRITICAL', results.CRITICAL)
+    assert report['summary'] == {'pairs': 2, 'failed': 1, 'slow': 1}
+    assert report['balancers'] == [{'instance': 'prod', 'status': True}]
+    assert [pair['consumer'] for pair in report['pairs']] == ['c1', 'c2']
+
+def test_to_nagios():
+    text, code = results.to_nagios(results.from_result(RESULT), False, warnLatency=2)
+    assert code == results.CRITICAL
+    assert text.startswith('DSREPLTEST CRITICAL - 1 of 2 pairs failed: s1->c2 o=test (Not replicated) | ')
+    assert "pairs=2 failed=1;;1 's1_c1_o_test'=0.4s;2" in text
+    text, code = results.to_nagios(healthy(), False)
+    assert (text, code) == ("DSREPLTEST OK - 0 of 1 pairs failed | pairs=1 failed=0;;1 's1_c1_o_test'=0.4s;", results.OK)
+    text, code = results.to_nagios(healthy(), True)
+    assert code == results.WARNING and 'some errors occurred' in text
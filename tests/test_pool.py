@@ -0,0 +1,71 @@
+import pytest
+ldap = pytest.importorskip('ldap')
+import dsReplTest.ldap as myldap
+
+URI = 'ldap://ldap01.test:389'
+
+def test_reuse(topology):
+    pool = myldap.ConnectionPool(5)
+    conn = pool.get(URI, 'cn=dm', 'secret')
+    pool.release(conn)
+    assert pool.get(URI, 'cn=dm', 'secret') is conn
+    assert topology.ops['bind'] == 1
+    # The idle connection is checked before it's handed out again
+    assert topology.ops['search'] == 1
+
+def test_keyed_by_uri_bind_and_starttls(topology):
+    pool = myldap.ConnectionPool(5)
+    conn = pool.get(URI, 'cn=dm', 'secret')
+    pool.release(conn)
+    assert pool.get(URI, 'cn=other', 'secret') is not conn
+    assert pool.get('ldap://ldap02.test:389', 'cn=dm', 'secret') is not conn
+    assert topology.ops['bind'] == 3
+
+def test_a_taken_connection_is_not_shared(topology):
+    pool = myldap.ConnectionPool(5)
+    first = pool.get(URI, 'cn=dm', 'secret')
+    assert pool.get(URI, 'cn=dm', 'secret') is not first
+
+def test_no_reuse(topology):
+    pool = myldap.ConnectionPool(5, reuse=False)
+    conn = pool.get(URI, 'cn=dm', 'secret')
+    pool.release(conn)
+    assert topology.ops['unbind'] == 1
+    assert pool.get(URI, 'cn=dm', 'secret') is not conn
+
+def test_unhealthy_connection_is_replaced(topology):
+    pool = myldap.ConnectionPool(5)
+    conn = pool.get(URI, 'cn=dm', 'secret')
+    pool.release(conn)
+    topology.server('ldap01.test').down = True
+    with pytest.raises(ldap.SERVER_DOWN):
+        pool.get(URI, 'cn=dm', 'secret')
+    assert topology.ops['unbind'] == 1
+    topology.server('ldap01.test').down = False
+    assert pool.get(URI, 'cn=dm', 'secret') is not conn
+
+def test_evict_idle(topology):
+    pool = myldap.ConnectionPool(5, maxIdle=0)
+    conn = pool.get(URI, 'cn=dm', 'secret')
+    pool.release(conn)
+    pool.evict()
+    assert topology.ops['unbind'] == 1
+    assert pool.get(URI, 'cn=dm', 'secret') is not conn
+
+def test_close(topology):
+    pool = myldap.ConnectionPool(5)
+    late = pool.get(URI, 'cn=dm', 'secret')
+    idle = pool.get(URI, 'cn=dm', 'secret')
+    pool.release(idle)
+    pool.close()
+    assert topology.ops['unbind'] == 1
+    # A connection given back after the close is unbound at once
+    pool.release(late)
+    assert topology.ops['unbind'] == 2
+
+def test_discard(topology):
+    pool = myldap.ConnectionPool(5)
+    conn = pool.get(URI, 'cn=dm', 'secret')
+    pool.discard(conn)
+    assert topology.ops['unbind'] == 1
+    assert pool.get(URI, 'cn=dm', 'secret') is not conn
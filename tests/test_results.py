@@ -0,0 +1,57 @@
+import json
+from datetime import datetime
+import dsReplTest.results as results
+from dsReplTest.scheduler import ResultStore
+
+RESULT = {
+    'prod': {'status': True, 'suffixes': {'o=test': {
+        's1': {'status': True, 'overallStatus': False, 'elapsed': 1.5,
+               'replica': {'c1': True, 'c2': False},
+               'latency': {'c1': 0.4}, 'detail': {'c2': 'Not replicated'}},
+        's2': None}}},
+    'dev': {'status': None, 'suffixes': {}},
+}
+
+def test_from_result():
+    prod, dev = results.from_result(RESULT)
+    assert (prod.name, prod.balancer, prod.passive) == ('prod', True, False)
+    [suffix] = prod.suffixes
+    [supplier] = suffix.suppliers
+    assert (supplier.name, supplier.status, supplier.overallStatus, supplier.elapsed) == ('s1', True, False, 1.5)
+    c1, c2 = supplier.consumers
+    assert (c1.name, c1.status, c1.latency, c1.detail) == ('c1', True, 0.4, None)
+    assert (c2.name, c2.status, c2.latency, c2.detail) == ('c2', False, None, 'Not replicated')
+    assert not suffix.status and not prod.status
+    assert dev.status and dev.suffixes == []
+    assert results.from_result(RESULT, passive=True)[0].passive
+
+def test_to_json():
+    instances = results.from_result(RESULT)
+    assert json.loads(results.to_json([], False, None)) == {'testdate': None, 'status': None, 'instances': []}
+    document = json.loads(results.to_json(instances, True, datetime(2024, 1, 2, 3, 4, 5)))
+    assert document['testdate'] == '2024-01-02T03:04:05'
+    assert document['status'] is False
+    prod = document['instances'][0]
+    assert prod['status'] is False and prod['passive'] is False
+    assert prod['suffixes'][0]['suppliers'][0]['consumers'][1] == {
+        'name': 'c2', 'status': False, 'latency': None, 'lag': None, 'detail': 'Not replicated'}
+
+def test_store_renders_once_per_pass():
+    store = ResultStore()
+    calls = []
+    render = lambda instances, someError, testdate: calls.append(testdate) or len(instances)
+    assert store.rendered('count', render) == (0, 0)
+    store.update(RESULT, False, when=datetime(2024, 1, 2))
+    assert store.rendered('count', render) == (2, 1)
+    assert store.rendered('count', render) == (2, 1)
+    assert calls == [None, datetime(2024, 1, 2)]
+
+def test_store_keeps_the_passive_results_apart():
+    store = ResultStore()
+    store.update(RESULT, False)
+    store.update({'prod': RESULT['prod']}, True, passive=True)
+    instances, someError, testdate = store.snapshot()
+    assert [(instance.name, instance.passive) for instance in instances] == [('prod', False), ('dev', False), ('prod', True)]
+    assert someError
+    store.update({'prod': RESULT['prod']}, False, passive=True)
+    assert not store.snapshot()[1]
@@ -0,0 +1,23 @@
+from dsReplTest.scheduler import Broadcaster
+
+def test_broadcast():
+    broadcaster = Broadcaster(maxsize=1)
+    client = broadcaster.subscribe()
+    broadcaster.publish('pass', {'instances': ['prod']})
+    # A full queue drops the event
+    broadcaster.publish('done', {'status': True})
+    assert client.get_nowait() == 'event: pass\ndata: {"instances": ["prod"]}\n\n'
+    assert client.empty()
+    broadcaster.unsubscribe(client)
+    broadcaster.publish('done', {'status': True})
+    assert client.empty()
+
+def test_max_clients():
+    broadcaster = Broadcaster(maxClients=1)
+    client = broadcaster.subscribe()
+    assert broadcaster.subscribe() is None
+    stream = broadcaster.stream(client)
+    assert next(stream) == 'retry: 5000\n\n'
+    # A closed stream frees its place
+    stream.close()
+    assert broadcaster.subscribe() is not None
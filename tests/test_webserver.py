@@ -0,0 +1,99 @@
+import http.client
+import json
+import threading
+import time
+from datetime import datetime
+import pytest
+import dsReplTest.metrics as metrics
+from dsReplTest.history import History
+from dsReplTest.scheduler import Broadcaster, ResultStore
+from dsReplTest.webserver import ReportServer, render_report
+import dsReplTest.results as results
+
+RESULT = {'prod': {'status': True, 'suffixes': {'o=test': {
+    's1': {'status': True, 'overallStatus': False, 'replica': {'c1': True, '<c2>': False},
+           'latency': {'c1': 0.4}, 'detail': {'<c2>': 'Not replicated'}}}}}}
+
+@pytest.fixture
+def server(tmp_path):
+    history = History(str(tmp_path / 'history'), capacity=10)
+    history.record_result(RESULT, when=0)
+    server = ReportServer('127.0.0.1', 0, ResultStore(), Broadcaster(), history, metrics, started=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    history.close()
+
+def request(server, method, path, headers=None):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+def test_report_page(server):
+    status, headers, body = request(server, 'GET', '/')
+    assert status == 200
+    assert b'First check in progress...' in body
+    server.store.update(RESULT, True, when=datetime(2024, 1, 2, 3, 4, 5))
+    status, headers, body = request(server, 'GET', '/')
+    assert headers['ETag'] == '"page-1-1"'
+    assert b'Instance: prod' in body and b'&lt;c2&gt; (Not replicated)' in body
+    assert b'Test completed on: 02/01/2024 at 03:04:05' in body
+    assert request(server, 'GET', '/', {'If-None-Match': headers['ETag']})[0] == 304
+    assert request(server, 'GET', '/', {'If-Modified-Since': headers['Last-Modified']})[0] == 304
+    server.store.update(RESULT, False)
+    assert request(server, 'GET', '/', {'If-None-Match': headers['ETag']})[0] == 200
+
+def test_head(server):
+    status, headers, body = request(server, 'HEAD', '/api/results')
+    assert status == 200 and body == b''
+    assert int(headers['Content-Length']) == len(request(server, 'GET', '/api/results')[2])
+
+def test_head_events_has_no_stream(server):
+    status, headers, body = request(server, 'HEAD', '/events')
+    assert status == 200
+    assert headers['Content-Type'] == 'text/event-stream'
+    assert body == b''
+
+def test_events(server):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    conn.request('GET', '/events')
+    response = conn.getresponse()
+    assert response.readline() == b'retry: 5000\n'
+    assert response.readline() == b'\n'
+    # The stream subscribes after the headers
+    deadline = time.monotonic() + 5
+    while not server.broadcaster._clients and time.monotonic() < deadline:
+        time.sleep(0.01)
+    server.broadcaster.publish('pass', {'total': 1})
+    assert response.readline() == b'event: pass\n'
+    assert json.loads(response.readline()[len(b'data: '):]) == {'total': 1}
+    conn.close()
+
+def test_api_results(server):
+    server.store.update(RESULT, False, when=datetime(2024, 1, 2))
+    status, headers, body = request(server, 'GET', '/api/results')
+    assert headers['Content-Type'] == 'application/json'
+    assert json.loads(body) == json.loads(results.to_json(results.from_result(RESULT), False, datetime(2024, 1, 2)))
+
+def test_history_metrics_and_static(server):
+    status, headers, body = request(server, 'GET', '/history')
+    assert status == 200 and b'<td>&lt;c2&gt;</td>' in body
+    server.history = None
+    assert request(server, 'GET', '/history')[0] == 404
+    status, headers, body = request(server, 'GET', '/metrics')
+    assert status == 200 and b'# TYPE dsrepltest_probe_status gauge' in body
+    status, headers, body = request(server, 'GET', '/static/style.css')
+    assert status == 200 and headers['Content-Type'] == 'text/css'
+    assert request(server, 'GET', '/static/style.css', {'If-Modified-Since': headers['Last-Modified']})[0] == 304
+    assert request(server, 'GET', '/static/missing.css')[0] == 404
+    assert request(server, 'GET', '/missing')[0] == 404
+
+def test_render_report_passive():
+    page = render_report(results.from_result(RESULT, passive=True), False, None)
+    assert b'Instance: prod (passive)' in page